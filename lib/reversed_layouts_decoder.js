@@ -0,0 +1,153 @@
+"use strict";
+
+// Decoder of the binary format of tools/gen_reversed_keylayout.py (--format bin or binary-js).
+// Returns the same layouts as reversed_layouts.js, keymap, deadkeys and
+// modTransitions of a layout are decoded on first access.
+// Note: typed arrays use the platform endianness, the format is little endian.
+
+const reversedLayoutsMagic = 0x334c4b52; // 'RKL3'
+
+/// \return Uint8Array
+const base64ToBytes = function(s) {
+    if (typeof atob === "function") {
+        const bin = atob(s);
+        const bytes = new Uint8Array(bin.length);
+        for (let i = 0; i < bin.length; ++i) {
+            bytes[i] = bin.charCodeAt(i);
+        }
+        return bytes;
+    }
+    return Uint8Array.from(Buffer.from(s, "base64"));
+};
+
+/// \param data base64 String | Uint8Array | ArrayBuffer
+/// \return Array[layout]
+const decodeReversedLayouts = function(data) {
+    if (typeof data === "string") {
+        data = base64ToBytes(data);
+    }
+    // typed arrays need an aligned buffer
+    const buffer = (data instanceof ArrayBuffer)
+        ? data
+        : data.buffer.slice(data.byteOffset, data.byteOffset + data.byteLength);
+
+    const header = new Uint32Array(buffer, 0, 2);
+    if (header[0] !== reversedLayoutsMagic) {
+        throw new Error("reversed layouts: bad magic number");
+    }
+    const sections = new Uint32Array(buffer, 8, header[1] * 2);
+    const u16 = (i) => new Uint16Array(buffer, sections[i * 2], sections[i * 2 + 1] / 2);
+    const u32 = (i) => new Uint32Array(buffer, sections[i * 2], sections[i * 2 + 1] / 4);
+
+    // strings
+    const lengths = new Uint8Array(buffer, sections[0], sections[1]);
+    const text = new TextDecoder().decode(new Uint8Array(buffer, sections[2], sections[3]));
+    const strings = new Array(lengths.length);
+    for (let i = 0, pos = 0; i < lengths.length; ++i) {
+        strings[i] = text.substring(pos, pos + lengths[i]);
+        pos += lengths[i];
+    }
+
+    // pool of objects decoded on demand
+    const pool = function(section, decode) {
+        const offsets = u32(section);
+        const values = u16(section + 1);
+        const cache = new Array(offsets.length - 1);
+        return function(i) {
+            let o = cache[i];
+            if (o === undefined) {
+                o = cache[i] = decode(values, offsets[i], offsets[i + 1]);
+            }
+            return o;
+        };
+    };
+
+    // { mod_flags: scancode }
+    const mods = pool(2, function(values, start, end) {
+        const o = {};
+        for (let i = start; i < end; ++i) {
+            o[values[i] >> 9] = values[i] & 0x1ff;
+        }
+        return o;
+    });
+
+    // { text: { mod_flags: scancode } }
+    const keymaps = pool(4, function(values, start, end) {
+        const o = {};
+        for (let i = start; i < end; i += 2) {
+            o[strings[values[i]]] = mods(values[i + 1]);
+        }
+        return o;
+    });
+
+    // { text: [ dead key, key... ] }
+    const dkeymaps = pool(6, function(values, start, end) {
+        const o = {};
+        for (let i = start; i < end;) {
+            const text = strings[values[i]];
+            const n = values[i + 1];
+            const dk = [];
+            i += 2;
+            for (const e = i + n; i < e; ++i) {
+                dk.push(mods(values[i]));
+            }
+            o[text] = dk;
+        }
+        return o;
+    });
+
+    // [ [ modifiers before scancode ], [ modifiers after scancode ] ]
+    const modseqs = pool(8, function(values, start, end) {
+        const prefixEnd = start + 1 + values[start];
+        return [Array.from(values.subarray(start + 1, prefixEnd)),
+                Array.from(values.subarray(prefixEnd, end))];
+    });
+
+    // modseq by transition state
+    const modrows = pool(10, function(values, start, end) {
+        const row = new Array(end - start);
+        for (let i = start; i < end; ++i) {
+            row[i - start] = modseqs(values[i]);
+        }
+        return row;
+    });
+
+    // [ { expected mod_flags: row }, ... ] by ctrlAndAltIsAltGr
+    const modtrans = pool(12, function(values, start, end) {
+        const o = [{}, {}];
+        for (let i = start; i < end; i += 3) {
+            o[0][values[i]] = modrows(values[i + 1]);
+            o[1][values[i]] = modrows(values[i + 2]);
+        }
+        return o;
+    });
+
+    const layoutValues = u32(14);
+    const layouts = [];
+    for (let i = 0; i < layoutValues.length; i += 7) {
+        const flags = layoutValues[i + 3];
+        const keymapId = layoutValues[i + 4];
+        const dkeymapId = layoutValues[i + 5];
+        const modtransId = layoutValues[i + 6];
+        layouts.push({
+            klid: layoutValues[i],
+            localeName: strings[layoutValues[i + 1]],
+            displayName: strings[layoutValues[i + 2]],
+            ctrlRightIsOem8: (flags & 1) !== 0,
+            altRightIsAltGr: (flags & 2) !== 0,
+            get keymap() { return keymaps(keymapId); },
+            get deadkeys() { return dkeymaps(dkeymapId); },
+            get modTransitions() { return modtrans(modtransId); },
+        });
+    }
+
+    return layouts;
+};
+
+
+try {
+    module.exports.decodeReversedLayouts = decodeReversedLayouts;
+}
+catch (e) {
+    // module not found
+}
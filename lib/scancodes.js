@@ -249,6 +249,11 @@ const NumLockMod  = 0x100;
 const RightShiftMod = 0x200;
 const RightCtrlMod  = 0x400;
 
+// row index of modTransitions: _modFlags & TransitionModMask
+// with right shift and right ctrl on bits 5 and 6
+const TransitionModMask = ShiftMod | AltGrMod | CapsLockMod | CtrlMod | AltMod;
+const TransitionRightModMask = (RightShiftMod | RightCtrlMod) >> 4;
+
 // Control scancodes
 const LShiftSC   = 0x2A;
 const RShiftSC   = 0x36;
@@ -305,7 +310,7 @@ const emptyReversedLayout = {
     keymap: {},
     actions: {},
     deadkeys: {},
-    accents: [],
+    modTransitions: [{}, {}],
 };
 
 const remappingModByLeftMods = {
@@ -393,6 +398,96 @@ NumLock: ${(mods & NumLockMod) ? '1' : '0'}
 KanaLock: ${(mods & KanaLockMod) ? '1' : '0'}`;
 };
 
+// Typeability
+//
+// reversedLayout.reachable: [gap, length, ...] codepoint ranges of the
+// characters typed by keymap and deadkeys (start - end of the previous range,
+// end - start). Without it (binary format), the ranges are built from the
+// keymap and deadkeys texts.
+
+const reachableRangesCache = new WeakMap();
+
+// [start, end, ...] codepoint ranges of reversedLayout
+const reachableRanges = function(reversedLayout) {
+    let ranges = reachableRangesCache.get(reversedLayout);
+    if (ranges) {
+        return ranges;
+    }
+
+    const gaps = reversedLayout.reachable;
+    if (gaps) {
+        ranges = new Uint32Array(gaps.length);
+        let end = 0;
+        for (let i = 0; i < gaps.length; i += 2) {
+            ranges[i] = end + gaps[i];
+            end = ranges[i + 1] = ranges[i] + gaps[i + 1];
+        }
+    }
+    else {
+        const codepoints = new Set();
+        for (const table of [reversedLayout.keymap, reversedLayout.deadkeys]) {
+            for (const text in table) {
+                const codepoint = text.codePointAt(0);
+                if (text.length === (codepoint > 0xffff ? 2 : 1)) {
+                    codepoints.add(codepoint);
+                }
+            }
+        }
+        const accu = [];
+        for (const codepoint of [...codepoints].sort((a, b) => a - b)) {
+            if (accu.length && accu[accu.length - 1] === codepoint) {
+                accu[accu.length - 1] = codepoint + 1;
+            }
+            else {
+                accu.push(codepoint, codepoint + 1);
+            }
+        }
+        ranges = Uint32Array.from(accu);
+    }
+
+    reachableRangesCache.set(reversedLayout, ranges);
+    return ranges;
+};
+
+const isInRanges = function(ranges, codepoint) {
+    // binary search of the last range which starts before codepoint
+    let lo = 0;
+    let hi = ranges.length >> 1;
+    while (lo < hi) {
+        const mid = (lo + hi) >> 1;
+        if (ranges[mid * 2] <= codepoint) {
+            lo = mid + 1;
+        }
+        else {
+            hi = mid;
+        }
+    }
+    return lo > 0 && codepoint < ranges[lo * 2 - 1];
+};
+
+/// @return characters of text without key nor dead key sequence in
+/// reversedLayout, once, in text order (empty when the whole text can be typed)
+const untypeableChars = function(reversedLayout, text) {
+    const ranges = reachableRanges(reversedLayout);
+    const untypeables = new Set();
+    for (const c of text) {
+        if (!isInRanges(ranges, c.codePointAt(0))) {
+            untypeables.add(c);
+        }
+    }
+    return [...untypeables];
+};
+
+const canTypeText = function(reversedLayout, text) {
+    const ranges = reachableRanges(reversedLayout);
+    for (const c of text) {
+        if (!isInRanges(ranges, c.codePointAt(0))) {
+            return false;
+        }
+    }
+    return true;
+};
+
 // Keyboard behavior
 //
 // Windows: ctrl+alt = altgr
@@ -435,6 +530,8 @@ class ReversedKeymap
     set ctrlAndAltIsAltGr(ctrlAndAltIsAltGr) {
         this._configCtrlAndAltIsAltGr = ctrlAndAltIsAltGr;
         this._ctrlAndAltIsAltGr = this._altRightIsAltGr && this._configCtrlAndAltIsAltGr;
+        this._modTransitions = this._layout.modTransitions[this._ctrlAndAltIsAltGr ? 1 : 0];
+        this._deadKeyScancodes.clear();
         this._updateVirtualMod();
     }
 
@@ -446,10 +543,11 @@ class ReversedKeymap
         this._layout = reversedLayout;
         this._keymap = reversedLayout.keymap;
         this._deadKeymap = reversedLayout.deadkeys;
-        this._accentKeymap = reversedLayout.accents;
+        this._deadKeyScancodes = new Map();
         this._ctrlRightIsOem8 = reversedLayout.ctrlRightIsOem8;
         this._altRightIsAltGr = reversedLayout.altRightIsAltGr;
         this._ctrlAndAltIsAltGr = this._altRightIsAltGr && this._configCtrlAndAltIsAltGr;
+        this._modTransitions = reversedLayout.modTransitions[this._ctrlAndAltIsAltGr ? 1 : 0];
         this._updateVirtualMod();
     }
 
@@ -493,23 +591,10 @@ class ReversedKeymap
         if (dk) {
             // release key without accent
             if (flag === KeyRelease) {
-                return this._scancodeByModsToScancodes(this._keymap[dk[dk.length - 1]], flag);
+                return this._scancodeByModsToScancodes(dk[dk.length - 1], flag);
             }
 
-            const accu = this._scancodeByModsToScancodes(this._accentKeymap[dk[0]], flag);
-            // release dead key
-            accu.push(accu[Math.floor(accu.length / 2)] ^ KeyRelease);
-
-            let i = 1;
-            for (; i < dk.length - 1; ++i) {
-                const scancodes = this._scancodeByModsToScancodes(this._keymap[dk[i]], flag);
-                accu.push(...scancodes);
-                // release dead key
-                accu.push(scancodes[Math.floor(scancodes.length / 2)] ^ KeyRelease);
-            }
-            accu.push(...this._scancodeByModsToScancodes(this._keymap[dk[i]], flag));
-
-            return accu;
+            return this._deadKeySequenceToScancodes(key, dk).slice();
         }
 
         // use key before code for special configuration such as Esc <-> CapsLock
@@ -519,13 +604,36 @@ class ReversedKeymap
                codeToScancodes(key, flag);
     }
 
+    /// @param dk [ dead key, key... ] with key = { mod_flags: scancode }
+    /// \return scancodes of the sequence, memoized by modifier state
+    _deadKeySequenceToScancodes(key, dk) {
+        const id = `${this._modFlags}:${key}`;
+        let accu = this._deadKeyScancodes.get(id);
+        if (accu) {
+            return accu;
+        }
+
+        accu = [];
+        const last = dk.length - 1;
+        for (let i = 0; i < last; ++i) {
+            const scancodes = this._scancodeByModsToScancodes(dk[i], KeyAcquire);
+            accu.push(...scancodes);
+            // release dead key
+            accu.push(scancodes[Math.floor(scancodes.length / 2)] ^ KeyRelease);
+        }
+        accu.push(...this._scancodeByModsToScancodes(dk[last], KeyAcquire));
+
+        this._deadKeyScancodes.set(id, accu);
+        return accu;
+    }
+
     _scancodeByModsToScancodes(scancodeByMods, flag) {
         let scancode = scancodeByMods[this._virtualModFlags];
         if (scancode) {
             return [scancode | flag];
         }
 
-        // emulate control key up/down
+        // emulate control key up/down with the first key (lowest mod flags)
 
         let expectedModFlags;
         for (expectedModFlags in scancodeByMods) {
@@ -541,121 +649,24 @@ class ReversedKeymap
             return;
         }
 
-        // const release = flag ^ KeyRelease;
-        // const down = flag & KeyRelease;
-        const release = KeyRelease;
-        const down = 0;
-
-        const accu = [];
-
-        // alt is maybe an altGr on client, but alt on server
-        // relase alt before shift, because alt+shift is a shortcut for switch a layout
-        if (!this._altRightIsAltGr && (this._modFlags & AltGrMod)) {
-            accu.push(AltGrSC | release);
+        // [press/release modifiers, reset modifiers] precomputed by the generator
+        // (see mod_transition() in tools/gen_reversed_keylayout.py)
+        const modFlags = this._modFlags;
+        const transition = this._modTransitions[expectedModFlags][
+            (modFlags & TransitionModMask) | ((modFlags >> 4) & TransitionRightModMask)
+        ];
+        const prefix = transition[0];
+        const suffix = transition[1];
+        const n = prefix.length;
+        // faster than concat()
+        const accu = new Array(n + 1 + suffix.length);
+        for (let i = 0; i < n; ++i) {
+            accu[i] = prefix[i];
         }
-
-        // shift
-        if ((this._virtualModFlags ^ expectedModFlags) & ShiftMod) {
-            if (expectedModFlags & ShiftMod) {
-                accu.push(LShiftSC | down);
-            }
-            else {
-                if (this._modFlags & ShiftMod) accu.push(LShiftSC | release);
-                if (this._modFlags & RightShiftMod) accu.push(RShiftSC | release);
-            }
+        accu[n] = scancode;
+        for (let i = 0; i < suffix.length; ++i) {
+            accu[n + 1 + i] = suffix[i];
         }
-
-        // ctrl
-        // if ((this._virtualModFlags ^ expectedModFlags) & CtrlMod) {
-        //     if (expectedModFlags & CtrlMod) {
-        //         accu.push(LCtrlSC | down);
-        //     }
-        //     else {
-        //         if (this._modFlags & CtrlMod) accu.push(LCtrlSC | release);
-        //         if ((this._modFlags & RightCtrlMod) && !this._ctrlRightIsOem8) accu.push(RCtrlSC | release);
-        //     }
-        // }
-
-        // oem8
-        if ((this._virtualModFlags ^ expectedModFlags) & OEM8Mod) {
-            accu.push(RCtrlSC | ((expectedModFlags & OEM8Mod) ? down : release));
-        }
-
-        // altGr
-        if ((this._virtualModFlags ^ expectedModFlags) & AltGrMod) {
-            if (this._ctrlAndAltIsAltGr) {
-                if (expectedModFlags & AltGrMod) {
-                    accu.push(AltGrSC | down);
-                }
-                // remove ctrl and alt because ctrl+alt = altgr
-                else if (this._virtualModFlags & AltGrMod) {
-                    if (this._modFlags & AltGrMod) {
-                        accu.push(AltGrSC | release);
-                        // if (this._modFlags & AltMod) {
-                        //     accu.push(AltSC | release);
-                        // }
-                    }
-                    else {
-                        accu.push(AltSC | release);
-                    }
-
-                    if (this._modFlags & CtrlMod) {
-                        accu.push(LCtrlSC | release);
-                    }
-                    if (!this._ctrlRightIsOem8 && (this._modFlags & RightCtrlMod)) {
-                        accu.push(RCtrlSC | release);
-                    }
-                }
-            }
-            else {
-                accu.push(AltGrSC | ((expectedModFlags & AltGrMod) ? down : release));
-            }
-        }
-
-        // // KanaMod
-        // if ((this._virtualModFlags ^ expectedModFlags) & KanaMod) {
-        //     accu.push(KanaModSC | ((expectedModFlags & KanaMod) ? down : release));
-        // }
-
-        // CapsLock
-        const hasCapLock = (this._virtualModFlags ^ expectedModFlags) & CapsLockMod;
-        if (hasCapLock) {
-            accu.push(CapsLockSC | down);
-            accu.push(CapsLockSC | release);
-        }
-
-        // // KanaLockMod
-        // const hasKanaLock = (this._virtualModFlags ^ expectedModFlags) & KanaLockMod;
-        // if (hasKanaLock) {
-        //     accu.push(KanaLockSC | down);
-        //     accu.push(KanaLockSC | release);
-        // }
-
-        let accuLen = accu.length;
-        if (hasCapLock) {
-            accuLen -= 2;
-        }
-        // if (hasKanaLock) {
-        //     accuLen -= 2;
-        // }
-
-        accu.push(scancode);
-
-        // reset emulated keys
-        while (accuLen > 0) {
-            accu.push(accu[--accuLen] ^ KeyRelease);
-        }
-
-        if (hasCapLock) {
-            accu.push(CapsLockSC | down);
-            accu.push(CapsLockSC | release);
-        }
-
-        // if (hasKanaLock) {
-        //     accu.push(KanaLockSC | down);
-        //     accu.push(KanaLockSC | release);
-        // }
-
         return accu;
     }
 
@@ -764,6 +775,9 @@ try {
     module.exports.KeyAcquire = KeyAcquire;
     module.exports.SyncFlags = SyncFlags;
     module.exports.toHumanReadableMods = toHumanReadableMods;
+    module.exports.reachableRanges = reachableRanges;
+    module.exports.untypeableChars = untypeableChars;
+    module.exports.canTypeText = canTypeText;
 }
 catch (e) {
     // module not found
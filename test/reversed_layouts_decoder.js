@@ -0,0 +1,149 @@
+"use strict";
+
+const {test} = require('tap')
+
+const {decodeReversedLayouts} = require("reversed_layouts_decoder");
+
+const layouts = require("reversed_layouts").layouts;
+
+// ./tools/gen_reversed_keylayout.py --format bin --klid 409,40c tools/kbdlayout.info.tar.zst | base64
+const data =
+    "UktMMw8AAACAAAAAnQAAACABAADwAAAAEAIAAHwCAACMBAAAkAIAABwHAAAMAAAAKAcAAHgDAACgCgAADAAAAKwKAAAoAQAA1AsA" +
+    "AIQBAABYDQAAYAYAALgTAAAkAAAA3BMAAAAIAADcGwAADAAAAOgbAAAeAAAACBwAADgAAAABAQEBAQEBAQEBAQEBAQEBAQEBAQEB" +
+    "AQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEB" +
+    "AQEBAQEBAQEBBRcBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQUGAAAAGzEyMzQ1Njc4OTAt" +
+    "PQgJcXdlcnR5dWlvcFtdDWFzZGZnaGprbDsnYFx6eGN2Ym5tLC4vIAMhQCMkJV4mKigpXytRV0VSVFlVSU9Qe31BU0RGR0hKS0w6" +
+    "In58WlhDVkJOTTw+Px4ffx0KHGVuLVVTVW5pdGVkIFN0YXRlcyAtIEVuZ2xpc2jDqcOow6fDoMO5wrLCsMKjwrXCp+KCrMKkw6LD" +
+    "qsOuw7TDu8OCw4rDjsOUw5vDpMOrw6/DtsO8w7/DhMOLw4/DlsOcwqjDo8ODw7HDkcO1w5XDrMOyw4DDiMOMw5LDmWZyLUZSRnJl" +
+    "bmNoAAAAAAQAAAAGAAAACAAAAAoAAAAMAAAADgAAABAAAAASAAAAFAAAABYAAAAYAAAAGgAAABwAAAAgAAAAJAAAACYAAAAoAAAA" +
+    "KgAAACwAAAAuAAAAMAAAADIAAAA0AAAANgAAADgAAAA6AAAAPAAAAEAAAABCAAAARAAAAEYAAABIAAAASgAAAEwAAABOAAAAUAAA" +
+    "AFIAAABUAAAAVgAAAFgAAABaAAAAXAAAAF4AAABgAAAAYgAAAGQAAABmAAAAaAAAAGoAAABsAAAAbgAAAHIAAAB2AAAAeAAAAHoA" +
+    "AAB8AAAAfgAAAIAAAACCAAAAhAAAAIYAAACIAAAAigAAAIwAAACOAAAAkAAAAJIAAACUAAAAlgAAAJgAAACaAAAAnAAAAJ4AAACg" +
+    "AAAAogAAAKQAAACmAAAAqAAAAKoAAACsAAAArgAAALAAAACyAAAAtAAAALYAAAC4AAAAugAAALwAAAC+AAAAwAAAAMIAAADEAAAA" +
+    "xgAAAMgAAADKAAAAzAAAAM4AAADQAAAA0gAAANQAAADWAAAA2AAAANoAAADcAAAA3gAAAOAAAADiAAAA5AAAAOYAAADoAAAA6gAA" +
+    "AOwAAADuAAAA8AAAAPIAAAD0AAAA9gAAAPgAAAD6AAAA/AAAAP4AAAAAAQAAAgEAAAQBAAAGAQAACAEAAAoBAAAMAQAADgEAABAB" +
+    "AAASAQAAFAEAABYBAAAYAQAAGgEAABwBAAAeAQAAIAEAACIBAAAkAQAAJgEAACgBAAAsAQAALgEAADABAAAyAQAANAEAADYBAAA4" +
+    "AQAAOgEAADwBAAA+AQAAQAEAAEIBAABEAQAARgEAAEcBAABIAQAAAQABAgEIAQoCAAIIAwADCAQABAgFAAUIBgAGCAcABwgIAAgI" +
+    "CQAJCAoACggLAAsIDAAMCA0ADQgOAA4CDggOCg8ADwIPCA8KEAAQChEAEQoSABIKEwATChQAFAoVABUKFgAWChcAFwoYABgKGQAZ" +
+    "ChoAGggbABsIHAAcAhwIHAoeAB4KHwAfCiAAIAohACEKIgAiCiMAIwokACQKJQAlCiYAJgonACcIKAAoCCkAKQgrACsILAAsCi0A" +
+    "LQouAC4KLwAvCjAAMAoxADEKMgAyCjMAMwg0ADQINQA1CDkAOQI5CDkKRgFGA0YJRgsCAgIKAwIDCgQCBAoFAgUKBgIGCgcCBwoI" +
+    "AggKCQIJCgoCCgoLAgsKDAIMCg0CDQoQAhAIEQIRCBICEggTAhMIFAIUCBUCFQgWAhYIFwIXCBgCGAgZAhkIGgIaChsCGwoeAh4I" +
+    "HwIfCCACIAghAiEIIgIiCCMCIwgkAiQIJQIlCCYCJggnAicKKAIoCikCKQorAisKLAIsCC0CLQguAi4ILwIvCDACMAgxAjEIMgIy" +
+    "CDMCMwo0AjQKNQI1Cg4ADggcABwIAgACCgMAAwoEAAQKBQAFCgYABgoHAAcKCAAICgkACQoKAAoKCwALCgwADAoNAA0KGwAbCicA" +
+    "JwooACgKKwArCjMAMwo0ADQKNQA1ClYAVggCAgIIAwIDCAQCBAgFAgUIBgIGCAcCBwgIAggICQIJCAoCCggLAgsIDAIMCA0CDQgb" +
+    "AhsIJwInCCgCKAgrAisIMwIzCDQCNAg1AjUIVgJWCgkCKwAJCisIBAQEDAUEBQwGBAYMBwQHDAkECQwKBAoMCwQLDAwEDAwNBA0M" +
+    "EgQSDBsEGwwaABoKGgIaCAMECAQAAAAA1AAAALwBAAAAAAAAAQABAAIAAgADAAMABAAEAAUABQAGAAYABwAHAAgACAAJAAkACgAK" +
+    "AAsACwAMAAwADQANAA4ADgAPAA8AEAAQABEAEQASABIAEwATABQAFAAVABUAFgAWABcAFwAYABgAGQAZABoAGgAbABsAHAAcAB0A" +
+    "HQAeAB4AHwAfACAAIAAhACEAIgAiACMAIwAkACQAJQAlACYAJgAnACcAKAAoACkAKQAqACoAKwArACwALAAtAC0ALgAuAC8ALwAw" +
+    "ADAAMQAxADIAMgAzADMANAA0ADUANQA2ADYANwA3ADgAOAA5ADkAOgA6ADsAOwA8ADwAPQA9AD4APgA/AD8AQABAAEEAQQBCAEIA" +
+    "QwBDAEQARABFAEUARgBGAEcARwBIAEgASQBJAEoASgBLAEsATABMAE0ATQBOAE4ATwBPAFAAUABRAFEAUgBSAFMAUwBUAFQAVQBV" +
+    "AFYAVgBXAFcAWABYAFkAWQBaAFoAWwBbAFwAXABdAF0AXgBeAF8AXwBgAGAAYQBhAGIAYgBjAGMAZAA6AGUAPwBmAGQAZwAaAGgA" +
+    "ZQBpACgAAAAAADsAZgBsAGcAVwBoACYAaQA9AGoACwBrAG0AbAA/AG0AbgBuAG8AbwA+AHAADABxAA0ADQAOAA4AHAAPACkAEAAR" +
+    "ABEAEgASABMAEwAUABQAFQAVABYAFgAXABcAGAAYADgAcgAbABsADwAcAB0AHQAeAB4AHwAfACAAIAAhACEAIgAiACMAIwAkACQA" +
+    "LwBzAHAAdABxACcAPAB1ABAAKQAqACoAKwArACwALAAtAC0ALgAuADAALwAlAHYAVgB3ADUAeAAzADMAYQB5ADQANAABAHoAAgB7" +
+    "AAMAfAAEAH0ABQB+AAYAfwAHAIAACACBAAkAggAKAIMAcgCEAEAAhQBNAEEAWgBCAEMAQwBEAEQARQBFAEYARgBHAEcASABIAEkA" +
+    "SQBKAEoAcwCGAEEATQBOAE4ATwBPAFAAUABRAFEAUgBSAFMAUwBUAFQAVQBVAGAAhwA5AIgAdACJAEIAWgBbAFsAXABcAF0AXQBe" +
+    "AF4AXwBfAGMAYAAxAIoAMgCLAHUAjABiAI0AZQA6AGkAjgBkAD0AZgBkAGcAGgBoAGUANwCPAEsAkAAZAJEAWQCSACgAkwA6AJQA" +
+    "NgCVABoAlgBMAJcAdgCYAHcAmQAAAAAAAAAAAJQAAAB4AAIAmgAPAHkAAgCaABEAegACAJoAFgB7AAIAmgAXAHwAAgCaABUAfQAC" +
+    "AJoAQQB+AAIAmgBDAH8AAgCaAEgAgAACAJoASQCBAAIAmgBHAIIAAgCbAA8AgwACAJsAEQCEAAIAmwAWAIUAAgCbABcAhgACAJsA" +
+    "FQCHAAIAmwAUAIgAAgCbAEEAiQACAJsAQwCKAAIAmwBIAIsAAgCbAEkAjAACAJsARwCNAAIAmwAzAI4AAgCcAA8AjwACAJwAQQCQ" +
+    "AAIAnAAuAJEAAgCcAF8AkgACAJwAFwCTAAIAnABJAFgAAgCcADMAlAACAJ0AFgCVAAIAnQAXAJYAAgCdAEEAlwACAJ0AQwCYAAIA" +
+    "nQBIAJkAAgCdAEkAmgACAJ0ARwAnAAIAnQAzAAAAAAABAAAABAAAAAcAAAAMAAAAEQAAABgAAAAfAAAAKAAAACsAAAAwAAAANQAA" +
+    "ADwAAABDAAAATAAAAFUAAABgAAAAYwAAAGgAAABvAAAAeAAAAH0AAACGAAAAiwAAAJIAAACbAAAApgAAAKsAAACyAAAAuwAAAMYA" +
+    "AADLAAAA0gAAANsAAADmAAAA7QAAAPYAAAABAQAADgEAABUBAAAeAQAAKQEAADYBAAA7AQAAQgEAAEsBAABWAQAAXQEAAGYBAABx" +
+    "AQAAfgEAAIMBAACKAQAAkwEAAJ4BAAClAQAArgEAALkBAADGAQAAzQEAANYBAADhAQAA7gEAAPcBAAACAgAADwIAAB4CAAAlAgAA" +
+    "LgIAADkCAABGAgAATwIAAFoCAABnAgAAdgIAAHsCAACEAgAAiwIAAJYCAACdAgAAqAIAAK8CAAC6AgAAwwIAANACAADXAgAA4gIA" +
+    "AOsCAAD4AgAA+wIAAAADAAAHAwAAEAMAABUDAAAcAwAAJQMAADADAAAAAAEAKoAqAAEAOIE4AQIAOIEqgCoAOAECADoAOoA6ADqA" +
+    "AwAqgDoAOoAqADoAOoADADiBOgA6gDgBOgA6gAQAOIEqgDoAOoAqADgBOgA6gAEANoA2AAIAKoA2gDYAKgACADiBNoA2ADgBAwA4" +
+    "gSqANoA2ACoAOAEDADaAOgA6gDYAOgA6gAQAKoA2gDoAOoA2ACoAOgA6gAQAOIE2gDoAOoA2ADgBOgA6gAUAOIEqgDaAOgA6gDYA" +
+    "KgA4AToAOoABACoAKoACADiBKgAqgDgBAwAqADoAOoAqgDoAOoAEADiBKgA6ADqAKoA4AToAOoACACqAOIE4ASoABAAqgDiBOgA6" +
+    "gDgBKgA6ADqAAgA2gDiBOAE2AAMAKoA2gDiBOAE2ACoABAA2gDiBOgA6gDgBNgA6ADqABQAqgDaAOIE6ADqAOAE2ACoAOgA6gAIA" +
+    "OIEdgB0AOAEDACqAOIEdgB0AOAEqAAQAOIEdgDoAOoAdADgBOgA6gAUAKoA4gR2AOgA6gB0AOAEqADoAOoACADiAHYAdADgAAwAq" +
+    "gDiAHYAdADgAKgAEADiAHYA6ADqAHQA4ADoAOoAFACqAOIAdgDoAOoAdADgAKgA6ADqAAwA2gDiBHYAdADgBNgAEACqANoA4gR2A" +
+    "HQA4ATYAKgAFADaAOIEdgDoAOoAdADgBNgA6ADqABgAqgDaAOIEdgDoAOoAdADgBNgAqADoAOoADADaAOIAdgB0AOAA2AAQAKoA2" +
+    "gDiAHYAdADgANgAqAAUANoA4gB2AOgA6gB0AOAA2ADoAOoAGACqANoA4gB2AOgA6gB0AOAA2ACoAOgA6gAIAOIEdgR0BOAEDACqA" +
+    "OIEdgR0BOAEqAAQAOIEdgToAOoAdATgBOgA6gAUAKoA4gR2BOgA6gB0BOAEqADoAOoADADiBHYAdgR0BHQA4AQQAKoA4gR2AHYEd" +
+    "AR0AOAEqAAUAOIEdgB2BOgA6gB0BHQA4AToAOoAGACqAOIEdgB2BOgA6gB0BHQA4ASoAOgA6gAIAOIAdgR0BOAADACqAOIAdgR0B" +
+    "OAAqAAQAOIAdgToAOoAdATgAOgA6gAUAKoA4gB2BOgA6gB0BOAAqADoAOoADADiAHYAdgR0BHQA4AAQAKoA4gB2AHYEdAR0AOAAq" +
+    "AAUAOIAdgB2BOgA6gB0BHQA4ADoAOoAGACqAOIAdgB2BOgA6gB0BHQA4ACoAOgA6gAMANoA4gR2BHQE4ATYABAAqgDaAOIEdgR0B" +
+    "OAE2ACoABQA2gDiBHYE6ADqAHQE4ATYAOgA6gAYAKoA2gDiBHYE6ADqAHQE4ATYAKgA6ADqABAA2gDiBHYAdgR0BHQA4ATYABQAq" +
+    "gDaAOIEdgB2BHQEdADgBNgAqAAYANoA4gR2AHYE6ADqAHQEdADgBNgA6ADqABwAqgDaAOIEdgB2BOgA6gB0BHQA4ATYAKgA6ADqA" +
+    "AwA2gDiAHYEdATgANgAEACqANoA4gB2BHQE4ADYAKgAFADaAOIAdgToAOoAdATgANgA6ADqABgAqgDaAOIAdgToAOoAdATgANgAq" +
+    "ADoAOoAEADaAOIAdgB2BHQEdADgANgAFACqANoA4gB2AHYEdAR0AOAA2ACoABgA2gDiAHYAdgToAOoAdAR0AOAA2ADoAOoAHACqA" +
+    "NoA4gB2AHYE6ADqAHQEdADgANgAqADoAOoACACoAOIE4ASqABAAqADiBOgA6gDgBKoA6ADqAAwAqADiBHYAdADgBKoAFACoAOIEd" +
+    "gDoAOoAdADgBKoA6ADqAAwAqADiAHYAdADgAKoAFACoAOIAdgDoAOoAdADgAKoA6ADqAAwAqADiBHYEdATgBKoAFACoAOIEdgToA" +
+    "OoAdATgBKoA6ADqABAAqADiBHYAdgR0BHQA4ASqABgAqADiBHYAdgToAOoAdAR0AOAEqgDoAOoADACoAOIAdgR0BOAAqgAUAKgA4" +
+    "gB2BOgA6gB0BOAAqgDoAOoAEACoAOIAdgB2BHQEdADgAKoAGACoAOIAdgB2BOgA6gB0BHQA4ACqAOgA6gAEAOAE4gQIAKoA4ATiB" +
+    "KgADADgBOgA6gDiBOgA6gAQAKoA4AToAOoA4gSoAOgA6gAIANoA4ATiBNgADACqANoA4ATiBNgAqAAQANoA4AToAOoA4gTYAOgA6" +
+    "gAUAKoA2gDgBOgA6gDiBNgAqADoAOoAAAAAAgAAAAAABAACAAQAAAAIAAIACAAAAAwAAgAMAAAAEAAAAAAEAAgADAAQABQAGAAcA" +
+    "AAABAAIAAwAEAAUABgAHAAAAAQACAAMABAAFAAYABwAAAAEAAgADAAQABQAGAAcACAAJAAoACwAMAA0ADgAPAAgACQAKAAsADAAN" +
+    "AA4ADwAIAAkACgALAAwADQAOAA8ACAAJAAoACwAMAA0ADgAPAAAAAQACAAMABAAFAAYABwAAAAEAAgADAAQABQAGAAcAAAABAAIA" +
+    "AwAEAAUABgAHAAAAAQACAAMABAAFAAYABwAIAAkACgALAAwADQAOAA8ACAAJAAoACwAMAA0ADgAPAAgACQAKAAsADAANAA4ADwAI" +
+    "AAkACgALAAwADQAOAA8AEAAAABEAAgASAAQAEwAGABAAAAARAAIAEgAEABMABgAQAAAAEQACABIABAATAAYAEAAAABEAAgASAAQA" +
+    "EwAGAAAAAAACAAIABAAEAAYABgAAAAAAAgACAAQABAAGAAYAAAAAAAIAAgAEAAQABgAGAAAAAAACAAIABAAEAAYABgAQAAAAEQAC" +
+    "ABIABAATAAYAEAAAABEAAgASAAQAEwAGABAAAAARAAIAEgAEABMABgAQAAAAEQACABIABAATAAYAAAAAAAIAAgAEAAQABgAGAAAA" +
+    "AAACAAIABAAEAAYABgAAAAAAAgACAAQABAAGAAYAAAAAAAIAAgAEAAQABgAGAAAAAQACABQABAAFAAYAFQAAAAEAAgAUAAQABQAG" +
+    "ABUAAAABAAIAFAAEAAUABgAVAAAAAQACABQABAAFAAYAFQAIAAkAFgAXAAwADQAYABkACAAJABYAFwAMAA0AGAAZAAgACQAWABcA" +
+    "DAANABgAGQAIAAkAFgAXAAwADQAYABkAAAABAAIAFAAEAAUABgAVAAAAAQACABQABAAFAAYAFQAAAAEAAgAUAAQABQAGABUAAAAB" +
+    "AAIAFAAEAAUABgAVAAgACQAWABcADAANABgAGQAIAAkAFgAXAAwADQAYABkACAAJABYAFwAMAA0AGAAZAAgACQAWABcADAANABgA" +
+    "GQAAAAEAAgAUAAQABQAGABUAAAABABoAGwAEAAUAHAAdAAAAAQACABQABAAFAAYAFQAeAB8AGgAbACAAIQAcAB0ACAAJABYAFwAM" +
+    "AA0AGAAZAAgACQAiACMADAANACQAJQAIAAkAFgAXAAwADQAYABkAJgAnACIAIwAoACkAJAAlAAAAAQAqACsABAAFACwALQAAAAEA" +
+    "LgAvAAQABQAwADEAMgAzACoAKwA0ADUALAAtADYANwAuAC8AOAA5ADAAMQAIAAkAOgA7AAwADQA8AD0ACAAJAD4APwAMAA0AQABB" +
+    "AEIAQwA6ADsARABFADwAPQBGAEcAPgA/AEgASQBAAEEAEAAAAEoAAgASAAQASwAGABAAAABKAAIAEgAEAEsABgAQAAAASgACABIA" +
+    "BABLAAYAEAAAAEoAAgASAAQASwAGAAAAAAACAAIABAAEAAYABgAAAAAAAgACAAQABAAGAAYAAAAAAAIAAgAEAAQABgAGAAAAAAAC" +
+    "AAIABAAEAAYABgAQAAAASgACABIABABLAAYAEAAAAEoAAgASAAQASwAGABAAAABKAAIAEgAEAEsABgAQAAAASgACABIABABLAAYA" +
+    "AAAAAAIAAgAEAAQABgAGAAAAAAACAAIABAAEAAYABgAAAAAAAgACAAQABAAGAAYAAAAAAAIAAgAEAAQABgAGABAAAABKAAIAEgAE" +
+    "AEsABgAQAAAATAAaABIABABNABwAEAAAAEoAAgASAAQASwAGAE4AHgBMABoATwAgAE0AHAAAAAAAAgACAAQABAAGAAYAAAAAABoA" +
+    "GgAEAAQAHAAcAAAAAAACAAIABAAEAAYABgAeAB4AGgAaACAAIAAcABwAEAAAAFAAKgASAAQAUQAsABAAAABSAC4AEgAEAFMAMABU" +
+    "ADIAUAAqAFUANABRACwAVgA2AFIALgBXADgAUwAwAAAAAAAqACoABAAEACwALAAAAAAALgAuAAQABAAwADAAMgAyACoAKgA0ADQA" +
+    "LAAsADYANgAuAC4AOAA4ADAAMABYAFkAAAABAFoAWwAEAAUAWABZAAAAAQBaAFsABAAFAFgAWQAAAAEAWgBbAAQABQBYAFkAAAAB" +
+    "AFoAWwAEAAUAXABdAAgACQBeAF8ADAANAFwAXQAIAAkAXgBfAAwADQBcAF0ACAAJAF4AXwAMAA0AXABdAAgACQBeAF8ADAANAFgA" +
+    "WQAAAAEAWgBbAAQABQBYAFkAAAABAFoAWwAEAAUAWABZAAAAAQBaAFsABAAFAFgAWQAAAAEAWgBbAAQABQBcAF0ACAAJAF4AXwAM" +
+    "AA0AXABdAAgACQBeAF8ADAANAFwAXQAIAAkAXgBfAAwADQBcAF0ACAAJAF4AXwAMAA0AWABZAAAAAQBaAFsABAAFAFgAWQAAAAEA" +
+    "WgBbAAQABQBYAFkAAAABAFoAWwAEAAUAAAABAAAAAQAEAAUABAAFAFwAXQAIAAkAXgBfAAwADQBcAF0ACAAJAF4AXwAMAA0AXABd" +
+    "AAgACQBeAF8ADAANAAgACQAIAAkADAANAAwADQBYAFkAAAABAFoAWwAEAAUAWABZAAAAAQBaAFsABAAFAAAAAQAAAAEABAAFAAQA" +
+    "BQAAAAEAAAABAAQABQAEAAUAXABdAAgACQBeAF8ADAANAFwAXQAIAAkAXgBfAAwADQAIAAkACAAJAAwADQAMAA0ACAAJAAgACQAM" +
+    "AA0ADAANAAAAAAAGAAAADwAAAAAAAAAAAAEAAQABAAAAAgADAAEABAAFAAIABgAHAAAACQQAAGoAAABrAAAAAAAAAAAAAAAAAAAA" +
+    "AAAAAAwEAACbAAAAnAAAAAIAAAABAAAAAQAAAAEAAAA=" +
+    "";
+
+const findLayout = function(layouts, klid) {
+    for (const layout of layouts) {
+        if (layout.klid === klid) {
+            return layout;
+        }
+    }
+};
+
+test('decode', t => {
+    const decodedLayouts = decodeReversedLayouts(data);
+    t.equal(decodedLayouts.length, 2);
+
+    for (const klid of [0x409, 0x40c]) {
+        const decoded = findLayout(decodedLayouts, klid);
+        const expected = findLayout(layouts, klid);
+        t.equal(decoded.localeName, expected.localeName);
+        t.equal(decoded.displayName, expected.displayName);
+        t.equal(decoded.ctrlRightIsOem8, expected.ctrlRightIsOem8);
+        t.equal(decoded.altRightIsAltGr, expected.altRightIsAltGr);
+        t.same(decoded.keymap, expected.keymap);
+        t.same(decoded.deadkeys, expected.deadkeys);
+        t.same(decoded.modTransitions, expected.modTransitions);
+    }
+
+    t.end();
+});
+
+test('decode from Uint8Array', t => {
+    const bytes = Uint8Array.from(Buffer.from(data, "base64"));
+    const decoded = decodeReversedLayouts(bytes);
+    t.equal(decoded[1].keymap['é'][0], 0x03);
+    // keymap is decoded once
+    t.equal(decoded[1].keymap, decoded[1].keymap);
+    t.end();
+});
+
+test('bad magic number', t => {
+    t.throws(() => decodeReversedLayouts(new Uint8Array(16)));
+    t.end();
+});
@@ -5,6 +5,7 @@ const {test, Test} = require('tap')
 const {
     ReversedKeymap, SyncFlags, KeyAcquire, KeyRelease, toHumanReadableMods,
     scancodesForSynchronizedMods, scancodesForKeyAcquireMods,
+    reachableRanges, untypeableChars, canTypeText,
 } = require("scancodes");
 
 const layouts = require("reversed_layouts").layouts;
@@ -41,6 +42,14 @@ const rkeymapDoubleDeadKey = (() => {
   }
 })();
 
+const rkeymapDeExtended = (() => {
+  for (const layout of layouts) {
+      if (layout.displayName === "German Extended (E1)") {
+          return new ReversedKeymap(layout);
+      }
+  }
+})();
+
 // add test comparator
 //@{
 Test.prototype.addAssert('hexEqual', 2, function (a, b, message, extra) {
@@ -966,7 +975,8 @@ test('toScancodesAndFlags()', t => {
         t.hexEqual(rkeymapDoubleDeadKey.getModFlags(), 0);
         t.hexEqual(rkeymapDoubleDeadKey.getVirtualModFlags(), 0);
 
-        t.hexArrayEqual(rkeymapDoubleDeadKey.toScancodesAndFlags("Ꮭ", "KeyQ", KeyAcquire), [0x14, 0x8014, 0x2a, 0x3a, 0x803a, 0x26, 0x802a, 0x3a, 0x803a, 0x8026, 0x1e]);
+        // CapsLock+l is shorter than Shift+CapsLock+L for the second dead key
+        t.hexArrayEqual(rkeymapDoubleDeadKey.toScancodesAndFlags("Ꮭ", "KeyQ", KeyAcquire), [0x14, 0x8014, 0x3a, 0x803a, 0x26, 0x3a, 0x803a, 0x8026, 0x1e]);
         t.hexEqual(rkeymapDoubleDeadKey.getModFlags(), 0);
         t.hexEqual(rkeymapDoubleDeadKey.getVirtualModFlags(), 0);
 
@@ -977,6 +987,28 @@ test('toScancodesAndFlags()', t => {
         t.end();
     });
 
+    test('acquiring and releasing dead key followed by a dead key <U+0301>', t => {
+        rkeymapDeExtended.sync(0);
+
+        // ´ is only a dead key
+        const combiningAcute = "\u0301";
+        t.hexArrayEqual(rkeymapDeExtended.toScancodesAndFlags(combiningAcute, "Equal", KeyAcquire), [0xd, 0x800d, 0xd]);
+        t.hexEqual(rkeymapDeExtended.getModFlags(), 0);
+        t.hexEqual(rkeymapDeExtended.getVirtualModFlags(), 0);
+
+        t.hexArrayEqual(rkeymapDeExtended.toScancodesAndFlags(combiningAcute, "Equal", KeyRelease), [0x800d]);
+
+        // memoized sequence is not shared with the caller
+        rkeymapDeExtended.toScancodesAndFlags(combiningAcute, "Equal", KeyAcquire).push(0);
+        t.hexArrayEqual(rkeymapDeExtended.toScancodesAndFlags(combiningAcute, "Equal", KeyAcquire), [0xd, 0x800d, 0xd]);
+
+        t.hexArrayEqual(rkeymapDeExtended.toScancodesAndFlags("Shift", "ShiftLeft", KeyAcquire), [0x2a]);
+        t.hexArrayEqual(rkeymapDeExtended.toScancodesAndFlags(combiningAcute, "Equal", KeyAcquire), [0x802a, 0xd, 0x2a, 0x800d, 0x802a, 0xd, 0x2a]);
+        t.hexArrayEqual(rkeymapDeExtended.toScancodesAndFlags("Shift", "ShiftLeft", KeyRelease), [0x802a]);
+
+        t.end();
+    });
+
     t.end();
 });
 
@@ -1086,3 +1118,28 @@ test('Human readable mods', t => {
 
     t.end();
 });
+
+test('Typeability', t => {
+    const fr = rkeymapFr.layout;
+    t.same(untypeableChars(fr, 'Ça coûte 5€, naïve ĉ 😀 ß 😀'), ['Ç', 'ĉ', '😀', 'ß']);
+    t.same(untypeableChars(fr, ''), []);
+    t.equal(canTypeText(fr, 'ça coûte 5€, naïve'), true);
+    t.equal(canTypeText(fr, 'ça coûte 5€, naïve ĉ'), false);
+
+    // dead key
+    t.equal('à' in rkeymapUsInternational.layout.keymap, false);
+    t.equal(canTypeText(rkeymapUsInternational.layout, 'àé'), true);
+    // double dead key
+    t.equal(rkeymapDoubleDeadKey.layout.deadkeys['Ꮭ'].length, 3);
+    t.equal(canTypeText(rkeymapDoubleDeadKey.layout, 'Ꮭ'), true);
+
+    // ranges of the generator = ranges from keymap and deadkeys (binary format)
+    for (const layout of layouts) {
+        t.hexArrayEqual(
+            reachableRanges(layout),
+            reachableRanges({keymap: layout.keymap, deadkeys: layout.deadkeys}),
+            layout.displayName);
+    }
+
+    t.end();
+});
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+# Benchmark of the layout generation pipeline:
+#   read (archive / synthetic corpus) -> parse -> reverse -> dedup -> emit
+import io
+import json
+import os
+import platform
+import random
+import re
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from kbd_parser import LayoutSource, parse_files, read_sources, share_keymaps
+from gen_reversed_keylayout import dedup_js, reverse_layout, write_js
+
+
+default_corpus = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'kbdlayout.info.tar.zst')
+
+phase_names = ('read', 'parse', 'reverse', 'dedup', 'emit')
+
+# differences below these values are noise and never a regression
+min_time_delta = 0.005  # seconds
+min_rss_delta = 4096  # KiB
+
+_klid_re = re.compile(rb'KLID="[^"]*"')
+_display_name_re = re.compile(rb'LayoutDisplayName="([^"]*)"')
+_text_re = re.compile(rb'Text="([^"&<>]+)"')
+_mutation_chars = [c.encode() for c in 'abcdefghijklmnopqrstuvwxyzàéèçùßøœæ€$£¤']
+
+
+def synthetic_sources(sources: list[LayoutSource], count: int,
+                      mutation_rate: float = 0.05, seed: int = 0) -> list[LayoutSource]:
+    # clone the xml of `sources` until `count` layouts with new KLIDs.
+    # A part of the single Text attributes is replaced so that the dedup
+    # passes see similar but not identical layouts, as in the real corpus.
+    rng = random.Random(seed)
+    datas = [source.data or open(source.name, 'rb').read() for source in sources]
+    # without metadata, a layout cannot be renamed
+    datas = [data for data in datas if _klid_re.search(data)]
+    result = []
+
+    def mutate(m: re.Match) -> bytes:
+        if rng.random() < mutation_rate:
+            return b'Text="' + rng.choice(_mutation_chars) + b'"'
+        return m[0]
+
+    for i in range(count):
+        data = datas[i % len(datas)]
+        klid = f'{0x10000000 + i:08x}'.encode()
+        data = _klid_re.sub(b'KLID="' + klid + b'"', data, count=1)
+        data = _display_name_re.sub(lambda m: b'LayoutDisplayName="' + m[1] + b' #' + klid + b'"', data, count=1)
+        if mutation_rate and i >= len(datas):
+            data = _text_re.sub(mutate, data)
+        result.append(LayoutSource(f'{klid.decode()}.xml', data))
+
+    return result
+
+
+def _peak_rss() -> int:
+    # KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if sys.platform == 'darwin':
+        peak //= 1024
+        children //= 1024
+    return max(peak, children)
+
+
+def _run_pipeline(paths: list[str], synthetic: int, jobs: int) -> tuple[dict[str, float], dict[str, int], dict]:
+    # return the time of each phase, the growth of the peak RSS during each
+    # phase (0 when the phase stays below the previous peak) and information
+    # on the corpus
+    times = {}
+    rss_growth = {}
+    peak = _peak_rss()
+
+    def phase(name, t0):
+        nonlocal peak
+        times[name] = time.perf_counter() - t0
+        new_peak = _peak_rss()
+        rss_growth[name] = new_peak - peak
+        peak = new_peak
+
+    t0 = time.perf_counter()
+    sources = list(read_sources(paths))
+    if synthetic:
+        sources = synthetic_sources(sources, synthetic)
+    phase('read', t0)
+
+    t0 = time.perf_counter()
+    errors = []
+    # as parse_argv()
+    layouts = share_keymaps(parse_files(sources, jobs=jobs, errors=errors))
+    phase('parse', t0)
+
+    t0 = time.perf_counter()
+    error_messages = []
+    rlayouts = [reverse_layout(layout, error_messages) for layout in layouts]
+    phase('reverse', t0)
+
+    t0 = time.perf_counter()
+    tables = dedup_js(rlayouts)
+    phase('dedup', t0)
+
+    t0 = time.perf_counter()
+    out = io.StringIO()
+    write_js(tables, out.write)
+    output = out.getvalue()
+    phase('emit', t0)
+
+    info = {
+        'layouts': len(layouts),
+        'xml_bytes': sum(len(source.data) for source in sources if source.data is not None),
+        'parse_errors': len(errors),
+        'output_bytes': len(output.encode()),
+        'tables': {name: len(table) for name, table in tables.tables().items()},
+        'peak_rss_kib': peak,
+    }
+    return times, rss_growth, info
+
+
+def run_benchmark(paths: list[str], synthetic: int = 0, jobs: int = 1, repeat: int = 3) -> dict:
+    # best time of each phase over `repeat` runs. The RSS is measured on the
+    # first run: rss_growth_kib is the growth of the peak RSS during each
+    # phase, peak_rss_kib the peak of the process, interpreter and modules
+    # included (see run_isolated()).
+    best = None
+    rss_growth = None
+    first_info = None
+    for _ in range(repeat):
+        times, run_rss_growth, info = _run_pipeline(paths, synthetic, jobs)
+        if best is None:
+            best = times
+            rss_growth = run_rss_growth
+            first_info = info
+        else:
+            best = {name: min(best[name], times[name]) for name in phase_names}
+
+    best['total'] = sum(best.values())
+    rss_growth['total'] = sum(rss_growth.values())
+    return {
+        **first_info,
+        'phases': best,
+        'rss_growth_kib': rss_growth,
+    }
+
+
+def run_isolated(paths: list[str], synthetic: int = 0, jobs: int = 1, repeat: int = 3) -> dict:
+    with ProcessPoolExecutor(1, mp_context=get_context('spawn')) as executor:
+        return executor.submit(run_benchmark, paths, synthetic, jobs, repeat).result()
+
+
+def compare(baseline: dict, result: dict, threshold: float) -> list[str]:
+    # regressions of `result` greater than `threshold` (0.1 = 10%)
+    regressions = []
+    for name, bench in result['benchmarks'].items():
+        base = baseline.get('benchmarks', {}).get(name)
+        if base is None:
+            continue
+        for key, min_delta, unit in (('phases', min_time_delta, 's'), ('rss_growth_kib', min_rss_delta, 'KiB')):
+            for phase, value in bench[key].items():
+                old = base.get(key, {}).get(phase)
+                if old is None:
+                    continue
+                if value > old * (1 + threshold) and value - old > min_delta:
+                    regressions.append(f'{name}: {key}.{phase}: {old:.4g}{unit} -> {value:.4g}{unit}'
+                                       f' (+{(value / old - 1) * 100 if old else float("inf"):.1f}%)')
+    return regressions
+
+
+def print_comparison(baseline: dict, result: dict, printer=sys.stderr.write) -> None:
+    for name, bench in result['benchmarks'].items():
+        base = baseline.get('benchmarks', {}).get(name)
+        if base is None:
+            printer(f'{name}: not in baseline\n')
+            continue
+        printer(f'{name}:\n')
+        for phase, value in bench['phases'].items():
+            old = base['phases'].get(phase)
+            if old:
+                printer(f'  {phase:8} {old:9.4f}s -> {value:9.4f}s ({(value / old - 1) * 100:+.1f}%)\n')
+
+
+def usage(argv0: str) -> None:
+    print(argv0, '[-j N] [--repeat N] [--synthetic N (0 = disabled)] [--output result.json]'
+          ' [--baseline baseline.json [--threshold 0.1]] [corpus.tar.zst | layout.xml ...]',
+          file=sys.stderr)
+
+
+def main(argv: list[str]) -> int:
+    jobs = 1
+    repeat = 3
+    synthetic = 2000
+    output = None
+    baseline_path = None
+    threshold = 0.1
+    paths = []
+
+    iargv = 1
+    while iargv < len(argv):
+        arg = argv[iargv]
+        has_value = iargv + 1 < len(argv)
+        if arg in ('-h', '--help'):
+            usage(argv[0])
+            return 0
+        elif arg == '-j' and has_value:
+            iargv += 1
+            jobs = int(argv[iargv])
+        elif arg == '--repeat' and has_value:
+            iargv += 1
+            repeat = max(1, int(argv[iargv]))
+        elif arg == '--synthetic' and has_value:
+            iargv += 1
+            synthetic = int(argv[iargv])
+        elif arg == '--output' and has_value:
+            iargv += 1
+            output = argv[iargv]
+        elif arg == '--baseline' and has_value:
+            iargv += 1
+            baseline_path = argv[iargv]
+        elif arg == '--threshold' and has_value:
+            iargv += 1
+            threshold = float(argv[iargv])
+        elif arg.startswith('-'):
+            usage(argv[0])
+            return 1
+        else:
+            paths.append(arg)
+        iargv += 1
+
+    paths = paths or [default_corpus]
+
+    benchmarks = {'corpus': run_isolated(paths, 0, jobs, repeat)}
+    if synthetic:
+        benchmarks[f'synthetic-{synthetic}'] = run_isolated(paths, synthetic, jobs, repeat)
+
+    result = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'corpus': paths,
+        'jobs': jobs,
+        'repeat': repeat,
+        'benchmarks': benchmarks,
+    }
+
+    text = json.dumps(result, indent=2) + '\n'
+    if output:
+        with open(output, 'w') as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        print_comparison(baseline, result)
+        regressions = compare(baseline, result, threshold)
+        if regressions:
+            print(f'{len(regressions)} regression(s) greater than {threshold * 100:g}%:', file=sys.stderr)
+            print('\n'.join(regressions), file=sys.stderr)
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
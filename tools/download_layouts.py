@@ -1,30 +1,444 @@
 #!/usr/bin/env python3
-
-from urllib.request import (urlopen, URLError)
+# Download the layouts of kbdlayout.info into a compressed tar archive.
+#
+#   download_layouts.py [-j N] [--base-url URL] [kbdlayout.info.tar.zst]
+#
+# Pages and xml files are fetched by a pool of N threads, each with its own
+# keep-alive connection. Layouts already in the archive are revalidated with
+# their ETag / Last-Modified and kept when the server answers 304.
+# Fetched layouts are appended to `archive.partial` (uncompressed tar) as they
+# arrive: an interrupted download restarts from there. The compressed archive
+# is replaced once every layout has been processed.
+import http.client
+import io
+import json
+import os
 import re
+import subprocess
+import sys
+import tarfile
+import threading
+import time
+from collections.abc import Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import IO, NamedTuple
+from urllib.parse import urlsplit
+
+from kbd_parser import _open_decompressed
+
+
+default_base_url = 'http://www.kbdlayout.info'
+default_archive = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'kbdlayout.info.tar.zst')
+
+# directory of the xml files in the archive
+archive_dir = 'kbdlayout.info'
+# {klid: {'etag': ..., 'last_modified': ...}} of the layouts of the archive
+validators_name = f'{archive_dir}/http-cache.json'
+# validators of the members of archive.partial
+_pax_etag = 'KBDLAYOUT.etag'
+_pax_last_modified = 'KBDLAYOUT.last_modified'
 
 lcid_re = re.compile(r'[0-9a-fA-F]{8}')
 klid_re = re.compile(r'.*>([0-9a-f]{8}) \(([^)]+).')
 ldname_re = re.compile(r'\n\s*<tr><th>Layout Display Name</th><td>([^<]+).*')
+metadata_re = re.compile(rb'\n[ \t]*<metadata [^>]*/>')
+
+
+class Response(NamedTuple):
+    status: int
+    headers: http.client.HTTPMessage
+    body: bytes
+
+
+class HttpClient:
+    # GET with one persistent connection per thread and retry with exponential
+    # backoff on network errors, 5xx and 429
+
+    def __init__(self, base_url: str, timeout: float = 30, retries: int = 3, backoff: float = 0.5) -> None:
+        url = urlsplit(base_url)
+        if url.scheme not in ('http', 'https'):
+            raise ValueError(f'unsupported url: {base_url}')
+        self.connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        self.host = url.netloc
+        self.prefix = url.path.rstrip('/')
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.connections = 0
+        self.requests = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self.connection_class(self.host, timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def get(self, path: str, headers: dict[str, str] | None = None) -> Response:
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            conn = self._connection()
+            # the socket is (re)opened by request() after a close
+            reconnect = conn.sock is None
+            try:
+                conn.request('GET', self.prefix + path, headers=headers or {})
+                response = conn.getresponse()
+                body = response.read()
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                error = Exception(f'{path}: {e!r}')
+                continue
+            finally:
+                with self._lock:
+                    self.requests += 1
+                    self.connections += reconnect
+
+            if response.status < 500 and response.status != 429:
+                return Response(response.status, response.headers, body)
+            error = Exception(f'{path}: HTTP {response.status} {response.reason}')
+
+        raise error
+
+
+class LayoutEntry(NamedTuple):
+    klid: str
+    locale_name: str
+    display_name: str
+
+
+class Member(NamedTuple):
+    data: bytes
+    etag: str | None
+    last_modified: str | None
+
+
+class DownloadStats(NamedTuple):
+    layouts: int
+    downloaded: int
+    not_modified: int
+    resumed: int
+    kept: int
+    errors: list[str]
+    requests: int
+    connections: int
+    elapsed: float
+
+
+def parse_index(page: str) -> list[str]:
+    return list(dict.fromkeys(lcid_re.findall(page)))
+
+
+def parse_locale_page(page: str) -> list[LayoutEntry]:
+    return [LayoutEntry(klid, locale_name, display_name)
+            for (klid, locale_name), display_name in zip(klid_re.findall(page), ldname_re.findall(page))]
+
+
+def add_metadata(xml: bytes, entry: LayoutEntry) -> bytes:
+    # <metadata .../> on the second line, replaced when already present
+    metadata = (f'\n  <metadata KLID="{entry.klid}" LocaleName="{entry.locale_name}"'
+                f' LayoutDisplayName="{entry.display_name}"/>').encode()
+    xml, n = metadata_re.subn(lambda m: metadata, xml, count=1)
+    if n:
+        return xml
+    i = xml.find(b'\n')
+    if i < 0:
+        i = len(xml)
+    return xml[:i] + metadata + xml[i:]
+
+
+def member_name(klid: str) -> str:
+    return f'{archive_dir}/{klid}.xml'
+
+
+def _member_klid(name: str) -> str | None:
+    if name.startswith(f'{archive_dir}/') and name.endswith('.xml'):
+        return name[len(archive_dir) + 1:-4]
+    return None
+
+
+def read_archive(filename: str) -> dict[str, Member]:
+    # {klid: Member} of a previous download
+    members = {}
+    validators = {}
+    if not os.path.exists(filename):
+        return members
+
+    with _open_decompressed(filename) as stream, tarfile.open(fileobj=stream, mode='r|*') as tar:
+        for info in tar:
+            if not info.isfile():
+                continue
+            if info.name == validators_name:
+                validators = json.load(tar.extractfile(info))
+            elif klid := _member_klid(info.name):
+                members[klid] = tar.extractfile(info).read()
+
+    return {klid: Member(data, validators.get(klid, {}).get('etag'), validators.get(klid, {}).get('last_modified'))
+            for klid, data in members.items()}
+
+
+def read_partial(filename: str) -> dict[str, Member]:
+    # {klid: Member} of an interrupted download.
+    # A truncated member (interruption during a write) is removed from the file.
+    members = {}
+    end = 0
+    try:
+        with tarfile.open(filename, 'r') as tar:
+            for info in tar:
+                data = tar.extractfile(info).read()
+                if len(data) != info.size:
+                    break
+                if klid := _member_klid(info.name):
+                    members[klid] = Member(data, info.pax_headers.get(_pax_etag),
+                                           info.pax_headers.get(_pax_last_modified))
+                end = info.offset_data + (info.size + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE * tarfile.BLOCKSIZE
+    except (tarfile.ReadError, EOFError):
+        pass
+
+    # tarfile appends after an end of archive marker
+    with open(filename, 'r+b') as f:
+        f.truncate(end)
+        f.seek(end)
+        f.write(tarfile.NUL * tarfile.BLOCKSIZE * 2)
+    return members
+
+
+def _tar_info(name: str, member: Member) -> tarfile.TarInfo:
+    info = tarfile.TarInfo(name)
+    info.size = len(member.data)
+    info.mode = 0o644
+    info.mtime = int(time.time())
+    if member.last_modified:
+        try:
+            info.mtime = int(parsedate_to_datetime(member.last_modified).timestamp())
+        except (TypeError, ValueError):
+            pass
+    return info
+
+
+@contextmanager
+def _open_compressed(filename: str) -> Iterator[tuple[IO[bytes], str]]:
+    # (stream, tarfile mode) of a new archive written to filename.tmp, then
+    # renamed to filename. zst is handled by the zstd command (or
+    # compression.zstd), gz, bz2 and xz by tarfile
+    tmp = f'{filename}.tmp'
+    try:
+        zstd = None
+        if filename.endswith('.zst'):
+            try:
+                from compression import zstd  # Python >= 3.14
+            except ImportError:
+                pass
+
+        if zstd:
+            with zstd.open(tmp, 'wb', level=19) as f:
+                yield f, 'w|'
+        elif filename.endswith('.zst'):
+            with open(tmp, 'wb') as f, subprocess.Popen(['zstd', '-19', '-qc'], stdin=subprocess.PIPE, stdout=f) as proc:
+                yield proc.stdin, 'w|'
+                proc.stdin.close()
+                if proc.wait():
+                    raise Exception(f'{filename}: zstd exited with {proc.returncode}')
+        else:
+            ext = filename.rsplit('.', 1)[-1]
+            with open(tmp, 'wb') as f:
+                yield f, f'w|{ext}' if ext in ('gz', 'bz2', 'xz') else 'w|'
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.replace(tmp, filename)
+
+
+def write_archive(filename: str, members: dict[str, Member]) -> None:
+    # replace filename with members sorted by KLID and their validators
+    validators = {klid: {'etag': member.etag, 'last_modified': member.last_modified}
+                  for klid, member in sorted(members.items())
+                  if member.etag or member.last_modified}
+    validators_member = Member(json.dumps(validators, indent=1).encode() + b'\n', None, None)
+
+    with _open_compressed(filename) as (stream, mode), tarfile.open(fileobj=stream, mode=mode,
+                                                                     format=tarfile.PAX_FORMAT) as tar:
+        info = tarfile.TarInfo(archive_dir)
+        info.type = tarfile.DIRTYPE
+        info.mode = 0o755
+        info.mtime = int(time.time())
+        tar.addfile(info)
+        for klid, member in sorted(members.items()):
+            tar.addfile(_tar_info(member_name(klid), member), io.BytesIO(member.data))
+        tar.addfile(_tar_info(validators_name, validators_member), io.BytesIO(validators_member.data))
+
+
+def fetch_entries(client: HttpClient, executor: ThreadPoolExecutor,
+                  log: Callable[[str], None]) -> list[LayoutEntry]:
+    # layouts of the locale pages listed by the index, in order of the index
+    index = client.get('/')
+    if index.status != 200:
+        raise Exception(f'/: HTTP {index.status}')
+
+    def fetch_page(lcid):
+        response = client.get(f'/{lcid}')
+        if response.status != 200:
+            raise Exception(f'/{lcid}: HTTP {response.status}')
+        return parse_locale_page(response.body.decode())
+
+    lcids = parse_index(index.body.decode())
+    log(f'{len(lcids)} locale pages')
+    entries = {}
+    for page in executor.map(fetch_page, lcids):
+        for entry in page:
+            entries.setdefault(entry.klid, entry)
+    return list(entries.values())
+
+
+def fetch_layout(client: HttpClient, entry: LayoutEntry, cached: Member | None) -> Member | None:
+    # None when cached is not modified
+    headers = {}
+    if cached:
+        if cached.etag:
+            headers['If-None-Match'] = cached.etag
+        if cached.last_modified:
+            headers['If-Modified-Since'] = cached.last_modified
+
+    path = f'/{entry.klid}/download/xml'
+    response = client.get(path, headers)
+    if response.status == 304 and cached:
+        return None
+    if response.status != 200:
+        raise Exception(f'{path}: HTTP {response.status}')
+
+    return Member(add_metadata(response.body, entry),
+                  response.headers.get('ETag'),
+                  response.headers.get('Last-Modified'))
+
+
+def download(archive: str, base_url: str = default_base_url, jobs: int = 8,
+             client: HttpClient | None = None, log: Callable[[str], None] = print) -> DownloadStats:
+    t0 = time.perf_counter()
+    client = client or HttpClient(base_url)
+    previous = read_archive(archive)
+
+    partial_filename = f'{archive}.partial'
+    done = read_partial(partial_filename) if os.path.exists(partial_filename) else {}
+    if done:
+        log(f'resume: {len(done)} layouts in {partial_filename}')
+
+    downloaded = 0
+    not_modified = 0
+    errors = []
+
+    executor = ThreadPoolExecutor(max(1, jobs))
+    partial = tarfile.open(partial_filename, 'a' if done else 'w', format=tarfile.PAX_FORMAT)
+    try:
+        entries = fetch_entries(client, executor, log)
+        todo = [entry for entry in entries if entry.klid not in done]
+        log(f'{len(entries)} layouts, {len(todo)} to revalidate or download')
+
+        futures = {executor.submit(fetch_layout, client, entry, previous.get(entry.klid)): entry
+                   for entry in todo}
+        # the tar file is only written by this thread
+        for future in as_completed(futures):
+            entry = futures[future]
+            try:
+                member = future.result()
+            except Exception as e:
+                errors.append(str(e))
+                log(f'{entry.klid}: {e}')
+                continue
+
+            if member is None:
+                not_modified += 1
+                cached = previous[entry.klid]
+                member = cached._replace(data=add_metadata(cached.data, entry))
+            else:
+                downloaded += 1
+                log(f'{entry.klid}: {entry.locale_name} {entry.display_name}')
+
+            info = _tar_info(member_name(entry.klid), member)
+            info.pax_headers = {key: value for key, value in ((_pax_etag, member.etag),
+                                                              (_pax_last_modified, member.last_modified))
+                                if value}
+            partial.addfile(info, io.BytesIO(member.data))
+            done[entry.klid] = member
+            # a member is complete on disk before the next one
+            partial.fileobj.flush()
+    finally:
+        executor.shutdown(cancel_futures=True)
+        partial.close()
+
+    # layouts which have failed or are no longer listed are kept
+    kept = 0
+    for klid, member in previous.items():
+        if klid not in done:
+            done[klid] = member
+            kept += 1
+
+    write_archive(archive, done)
+    os.remove(partial_filename)
+
+    return DownloadStats(
+        layouts=len(entries),
+        downloaded=downloaded,
+        not_modified=not_modified,
+        resumed=len(entries) - len(todo),
+        kept=kept,
+        errors=errors,
+        requests=client.requests,
+        connections=client.connections,
+        elapsed=time.perf_counter() - t0,
+    )
+
+
+def usage(argv0: str) -> None:
+    print(argv0, f'[-j N (default: 8)] [--base-url URL (default: {default_base_url})]'
+          ' [archive.tar.zst (default: tools/kbdlayout.info.tar.zst)]', file=sys.stderr)
+
+
+def main(argv: list[str]) -> int:
+    jobs = 8
+    base_url = default_base_url
+    archive = default_archive
+
+    iargv = 1
+    while iargv < len(argv):
+        arg = argv[iargv]
+        has_value = iargv + 1 < len(argv)
+        if arg in ('-h', '--help'):
+            usage(argv[0])
+            return 0
+        elif arg == '-j' and has_value:
+            iargv += 1
+            jobs = int(argv[iargv])
+        elif arg == '--base-url' and has_value:
+            iargv += 1
+            base_url = argv[iargv]
+        elif arg.startswith('-'):
+            usage(argv[0])
+            return 1
+        else:
+            archive = arg
+        iargv += 1
+
+    try:
+        stats = download(archive, base_url, jobs)
+    except KeyboardInterrupt:
+        print(f'interrupted, run again to resume from {archive}.partial', file=sys.stderr)
+        return 130
+    except Exception as e:
+        print(f'{e}, run again to resume from {archive}.partial', file=sys.stderr)
+        return 1
+
+    print(f'{stats.layouts} layouts: {stats.downloaded} downloaded, {stats.not_modified} not modified,'
+          f' {stats.resumed} resumed, {stats.kept} kept from the archive, {len(stats.errors)} errors'
+          f' ({stats.requests} requests, {stats.connections} connections, {stats.elapsed:.1f}s)',
+          file=sys.stderr)
+    return 1 if stats.errors else 0
+
 
-ids = set()
-
-def get_url(url):
-    print(url)
-    with urlopen(url) as f:
-        return f.read().decode()
-
-for lcid in lcid_re.findall(get_url('http://www.kbdlayout.info/')):
-    if lcid in ids:
-        continue
-    page = get_url(f'http://www.kbdlayout.info/{lcid}')
-    klids = klid_re.findall(page)
-    ldnames = ldname_re.findall(page)
-    for klid, ldname in zip(klids, ldnames):
-        ids.add(lcid)
-        xml = get_url(f'http://www.kbdlayout.info/{klid[0]}/download/xml')
-        i = xml.index('\n')
-        with open(f'{klid[0]}.xml', 'w') as output:
-            output.write(xml[:i])
-            output.write(f'\n  <metadata KLID="{klid[0]}" LocaleName="{klid[1]}" LayoutDisplayName="{ldname}"/>')
-            output.write(xml[i:])
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
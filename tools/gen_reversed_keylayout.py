@@ -1,10 +1,15 @@
 #!/usr/bin/env python3
-from typing import Optional, NamedTuple
-from collections import OrderedDict, Counter
+from typing import IO, NamedTuple
+from collections.abc import Iterable
+from contextlib import nullcontext
+import base64
+import heapq
+import json
+import struct
 import sys
 import os
 
-from kbd_parser import KeymapType, KeyLayout, Key, parse_argv
+from kbd_parser import DeadKey, DeadKeysType, KeyLayout, Key, Stats, parse_argv
 
 
 vk_control_masks = {
@@ -164,36 +169,23 @@ def key_to_scancode(key:Key) -> int:
 
 numpad_symbol_scancode = {0x53, (0x100 >> 1) | 0x35, 0x37, 0x4A, 0x4E, (0x100 >> 1) | 0x1C}
 
-layouts:list[KeyLayout] = parse_argv()
-
-error_messages = []
-
-keymap_vars = {}
-accent_vars = {}
-dkeymap_vars = {}
-keys_vars = {}
-
-if os.environ.get('DEBUG') == '1':
-    def push_keys(scancodes_by_mods):
-        s = ''
-        for mod_flags, rkeys in scancodes_by_mods.items():
-            s = f'{s}0x{mod_flags:x}: {rkeys[0]}'
-        return f"{{ {''.join(s)}}}"
-else:
-    def push_keys(scancodes_by_mods):
-        s = ''
-        for mod_flags, rkeys in scancodes_by_mods.items():
-            s = f'{s}0x{mod_flags:x}: {rkeys[0]}'
-        i = keys_vars.setdefault(f"{{ {''.join(s)}}};\n", len(keys_vars))
-        return f'key{i}'
-
-output = [
-    '  return [\n'
-]
-
-for layout in layouts:
+ScancodesByMods = dict[int, list[int]]
+
+# ((mod_flags, scancode), ...) of the keys which type the same text (a key of a js keymap)
+KeyMods = tuple[tuple[int, int], ...]
+
+class ReversedLayout(NamedTuple):
+    layout: KeyLayout
+    # {(text, codepoint): {mod_flags: [scancode]}}
+    keymap: dict[tuple[str, int], ScancodesByMods]
+    # {text: (dead key, key, ...)}: shortest compose sequence (see ComposeTrie)
+    deadkeys: dict[str, tuple[KeyMods, ...]]
+
+def reverse_layout(layout:KeyLayout, error_messages:list[str]) -> ReversedLayout:
     normal_rkeymap = {}
     normal_ksyms = set()
+    # [(mod_flags, dead key)]
+    dead_keys = []
 
     # char of numpad symbol
     numpad_chars = set(key.text
@@ -223,7 +215,7 @@ for layout in layouts:
                     scancodes_by_mods:dict = normal_rkeymap.setdefault((key.text, key.codepoint), {})
                     normal_ksyms.add(key.text)
                     scancodes:list = scancodes_by_mods.setdefault(mod_flags, [])
-                    scancodes.append(f'0x{key_to_scancode(key):x}, ')
+                    scancodes.append(key_to_scancode(key))
 
                 elif key_and_scancode := vk_actions.get(key.vk, None):
                     if mod_flags != nomod:
@@ -238,6 +230,9 @@ for layout in layouts:
                     if not (key.codepoint == 0 and mod_flags in (nomod, ctrl)):
                         error_messages.append(f'Unknown {key} + {mods or "noMod"} in {layout.display_name} (0x{layout.klid})')
 
+            elif key:
+                dead_keys.append((mod_flags, key))
+
     # add capslock when missing
     for scancodes_by_mods in normal_rkeymap.values():
         scancodes_by_mods.update({
@@ -246,124 +241,1134 @@ for layout in layouts:
                 if not any(mod_flags & capslock for mod_flags in scancodes_by_mods)
         })
 
-    # dead key and dead key of dead key
-    rdeadkeymap = {}
-    rdeadkeymap2 = {}
-    for mods,keymap in layout.keymaps.items():
-        mod_flags = vk_mod_to_mod_flags(mods)
-        # ignore numlock scancodes
-        if mod_flags & numlock:
-            continue
+    # characters only reachable with dead keys
+    sequences = ComposeTrie(dead_keys, normal_rkeymap).shortest_sequences()
+    rdeadkeymap = {text: keys for text, keys in sequences.items() if text not in normal_ksyms}
 
-        for key in keymap:
-            if key and key.deadkeys:
-                value = key_to_scancode(key)
-                for dkey in key.deadkeys.values():
-                    m0 = f'0x{value:x}, '
-                    m1 = f"'{char_to_char_table.get(dkey.with_, dkey.with_)}'"
-                    if dkey.deadkeys:
-                        for dkey2 in dkey.deadkeys.values():
-                            # print('\n'.join(repr(x) for x in dkey.deadkeys.items()))
-                            assert not dkey2.deadkeys
-                            if dkey2.text not in normal_ksyms:
-                                m2 = f"{m1}, '{char_to_char_table.get(dkey2.with_, dkey2.with_)}'"
-                                map:tuple[dict,set,set] = rdeadkeymap2.setdefault(dkey2.text, (dict(), m2))
-                                map[0].setdefault(mod_flags, []).append(m0)
-                    elif dkey.text not in normal_ksyms:
-                        map:tuple[dict,set] = rdeadkeymap.setdefault(dkey.text, (dict(), m1))
-                        map[0].setdefault(mod_flags, []).append(m0)
-
-    # remove duplicate dead key
-    for k in rdeadkeymap:
-        rdeadkeymap2.pop(k, None)
-
-    output.append(f'  {{\n    klid: 0x{layout.klid},\n    localeName: "{layout.locale_name}",\n    displayName: "{layout.display_name}",\n    ctrlRightIsOem8: {"true" if layout.has_right_ctrl_like_oem8 else "false"},\n    altRightIsAltGr: {"true" if layout.alt_right_is_altgr else "false"},\n    keymap: ')
-
-    json = ['{\n']
-
-    for (text, codepoint), scancodes_by_mods in normal_rkeymap.items():
-        k = char_to_char_table.get(text) or (text if text.isprintable() else (f'\\x{codepoint:02x}' if codepoint <=0xff else f'\\u{codepoint:04x}'))
-        json.append(f"    '{k}': {push_keys(scancodes_by_mods)},\n")
-
-    json.append('  };\n\n')
-
-    kn = keymap_vars.setdefault(''.join(json), len(keymap_vars))
-    output.append(f'keymap{kn},\n    deadkeys: ')
-
-    json = ['{\n']
-
-    accents = dict()
-    push_ref = lambda scancodes_by_mods: \
-        accents.setdefault(
-            ''.join(
-                f"0x{mod_flags:x}: {sorted(x for x in ''.join(scancodes).split(', ') if x)[0]}, "
-                    for mod_flags, scancodes in scancodes_by_mods.items()),
-            len(accents)
+    return ReversedLayout(layout, normal_rkeymap, rdeadkeymap)
+
+def key_mods(scancodes_by_mods:ScancodesByMods) -> KeyMods:
+    # first scancode by mod_flags
+    return tuple((mod_flags, rkeys[0]) for mod_flags, rkeys in scancodes_by_mods.items())
+
+def key_cost(key:KeyMods) -> tuple[int, int]:
+    # (events, modifier changes) to type key without held modifier.
+    # The runtime emulates the lowest mod_flags (first integer key of a js object)
+    mod_flags = min(mod_flags for mod_flags, _scancode in key)
+    events = 2 + 2 * (mod_flags & ~capslock).bit_count() + (4 if mod_flags & capslock else 0)
+    return (events, 1 if mod_flags else 0)
+
+# Modifier transitions of ReversedKeymap._scancodeByModsToScancodes() (lib/scancodes.js).
+# When no key matches the virtual modifiers, the first key of a
+# { mod_flags: scancode } object (the lowest mod_flags) is typed between a
+# prefix and a suffix of modifier events. They depend on the held modifiers
+# (ReversedKeymap._modFlags), the expected mod_flags, altRightIsAltGr,
+# ctrlAndAltIsAltGr and ctrlRightIsOem8, and are computed here for each layout.
+
+shift = vk_control_masks['VK_SHIFT']
+oem8 = vk_control_masks['VK_OEM_8']
+# ReversedKeymap._modFlags only
+right_shift = 0x200
+right_ctrl = 0x400
+
+key_release = 0x8000
+lshift_sc = 0x2A
+rshift_sc = 0x36
+lctrl_sc = 0x1D
+rctrl_sc = 0x11D
+alt_sc = 0x38
+altgr_sc = 0x138
+capslock_sc = 0x3A
+
+# transition state: _modFlags & (shift | altgr | capslock | ctrl | alt) with
+# right shift and right ctrl on bits 5 and 6 (index of a row)
+transition_states = 128
+
+def transition_state_mod_flags(state:int) -> int:
+    return (state & 0x1f) | ((state & 0x60) << 4)
+
+def virtual_mod_flags(mod_flags:int, alt_right_is_altgr:bool, ctrl_and_alt_is_altgr:bool,
+                      ctrl_right_is_oem8:bool) -> int:
+    # ReversedKeymap._updateVirtualMod()
+    has_ctrl = mod_flags & (ctrl if ctrl_right_is_oem8 else ctrl | right_ctrl)
+    has_alt = mod_flags & (alt if alt_right_is_altgr else alt | altgr)
+    virtual = mod_flags & (shift | capslock)
+    virtual |= shift if mod_flags & right_shift else 0
+    virtual |= altgr if ctrl_and_alt_is_altgr and has_ctrl and has_alt else 0
+    virtual |= altgr if alt_right_is_altgr and mod_flags & altgr else 0
+    virtual |= oem8 if ctrl_right_is_oem8 and mod_flags & right_ctrl else 0
+    return virtual
+
+# (prefix, suffix) around the scancode
+ModSequence = tuple[tuple[int, ...], tuple[int, ...]]
+# ModSequence by transition state
+ModRow = tuple[ModSequence, ...]
+
+def mod_transition(mod_flags:int, expected:int, alt_right_is_altgr:bool, ctrl_and_alt_is_altgr:bool,
+                   ctrl_right_is_oem8:bool) -> ModSequence:
+    virtual = virtual_mod_flags(mod_flags, alt_right_is_altgr, ctrl_and_alt_is_altgr, ctrl_right_is_oem8)
+    diff = virtual ^ expected
+    accu = []
+
+    # alt is maybe an altGr on client, but alt on server
+    # release alt before shift, because alt+shift is a shortcut for switch a layout
+    if not alt_right_is_altgr and mod_flags & altgr:
+        accu.append(altgr_sc | key_release)
+
+    if diff & shift:
+        if expected & shift:
+            accu.append(lshift_sc)
+        else:
+            if mod_flags & shift:
+                accu.append(lshift_sc | key_release)
+            if mod_flags & right_shift:
+                accu.append(rshift_sc | key_release)
+
+    if diff & oem8:
+        accu.append(rctrl_sc | (0 if expected & oem8 else key_release))
+
+    if diff & altgr:
+        if ctrl_and_alt_is_altgr:
+            if expected & altgr:
+                accu.append(altgr_sc)
+            # remove ctrl and alt because ctrl+alt = altgr
+            elif virtual & altgr:
+                accu.append((altgr_sc if mod_flags & altgr else alt_sc) | key_release)
+                if mod_flags & ctrl:
+                    accu.append(lctrl_sc | key_release)
+                if not ctrl_right_is_oem8 and mod_flags & right_ctrl:
+                    accu.append(rctrl_sc | key_release)
+        else:
+            accu.append(altgr_sc | (0 if expected & altgr else key_release))
+
+    # reset emulated keys in reverse order
+    suffix = [scancode ^ key_release for scancode in reversed(accu)]
+
+    if diff & capslock:
+        toggle = (capslock_sc, capslock_sc | key_release)
+        accu += toggle
+        suffix += toggle
+
+    return (tuple(accu), tuple(suffix))
+
+_mod_rows:dict[tuple[int, bool, bool, bool], ModRow] = {}
+
+def mod_row(expected:int, alt_right_is_altgr:bool, ctrl_and_alt_is_altgr:bool, ctrl_right_is_oem8:bool) -> ModRow:
+    k = (expected, alt_right_is_altgr, ctrl_and_alt_is_altgr, ctrl_right_is_oem8)
+    row = _mod_rows.get(k)
+    if row is None:
+        row = _mod_rows[k] = tuple(mod_transition(transition_state_mod_flags(state), *k)
+                                   for state in range(transition_states))
+    return row
+
+def layout_mod_transitions(rlayout:ReversedLayout) -> tuple[tuple[tuple[int, ModRow], ...], ...]:
+    # ({expected: row} when ctrlAndAltIsAltGr is false, {expected: row} when true)
+    expecteds = {min(scancodes_by_mods) for scancodes_by_mods in rlayout.keymap.values()}
+    for keys in rlayout.deadkeys.values():
+        expecteds.update(min(mod_flags for mod_flags, _scancode in key) for key in keys)
+
+    layout = rlayout.layout
+    alt_right_is_altgr = layout.alt_right_is_altgr
+    ctrl_right_is_oem8 = layout.has_right_ctrl_like_oem8
+    # ctrlAndAltIsAltGr is only enabled with altRightIsAltGr
+    return tuple(
+        tuple((expected, mod_row(expected, alt_right_is_altgr, ctrl_and_alt_is_altgr, ctrl_right_is_oem8))
+              for expected in sorted(expecteds))
+        for ctrl_and_alt_is_altgr in (False, alt_right_is_altgr)
+    )
+
+class ComposeTrie:
+    # dead key tables of a layout as a trie of any depth.
+    # A node is a DeadKeysType table (shared by the dead keys with the same
+    # table), an edge the text of the next key: a key without dead key or
+    # another dead key (a dead key types its accent in a dead key table).
+    # The leaves are the composed characters.
+
+    def __init__(self, dead_keys:Iterable[tuple[int, Key]], rkeymap:dict[tuple[str, int], ScancodesByMods]):
+        # {id(table): (table, {mod_flags: [scancode]})} of the first dead keys
+        self.roots:dict[int, tuple[DeadKeysType, ScancodesByMods]] = {}
+        # {accent: {mod_flags: [scancode]}}
+        accents:dict[str, ScancodesByMods] = {}
+
+        for mod_flags, key in dead_keys:
+            scancode = key_to_scancode(key)
+            root = self.roots.setdefault(id(key.deadkeys), (key.deadkeys, {}))
+            root[1].setdefault(mod_flags, []).append(scancode)
+            accents.setdefault(key.text, {}).setdefault(mod_flags, []).append(scancode)
+
+        # {id(table): {with: DeadKey}}
+        self._edges:dict[int, dict[str, DeadKey]] = {}
+
+        # {text: key} of the edges, a key without dead key when it exists
+        self.keys:dict[str, KeyMods] = {}
+        for (text, _codepoint), scancodes_by_mods in rkeymap.items():
+            self.keys.setdefault(text, key_mods(scancodes_by_mods))
+        for text, scancodes_by_mods in accents.items():
+            self.keys.setdefault(text, key_mods({mod_flags: sorted(scancodes)
+                                                 for mod_flags, scancodes in scancodes_by_mods.items()}))
+
+    def edges(self, table:DeadKeysType) -> dict[str, DeadKey]:
+        # {with: dead key result} of table
+        edges = self._edges.get(id(table))
+        if edges is None:
+            edges = self._edges[id(table)] = {dkey.with_: dkey for dkey in table.values()}
+        return edges
+
+    def compose(self, table:DeadKeysType, withs:tuple[str, ...]) -> str | None:
+        # text typed by the keys of withs after a dead key of table
+        for with_ in withs:
+            if not table:
+                return None
+            dkey = self.edges(table).get(with_)
+            if dkey is None:
+                return None
+            table = dkey.deadkeys
+        return None if table else dkey.text
+
+    def shortest_sequences(self) -> dict[str, tuple[KeyMods, ...]]:
+        # {text: (dead key, key, ...)} with the fewest events, then the fewest
+        # modifier changes (Dijkstra over the tables, a table can be reached
+        # from several dead keys or paths)
+        queue = []
+        for table, _scancodes_by_mods in self.roots.values():
+            heapq.heappush(queue, (key_cost(self.dead_key(table)), len(queue), table, table, ()))
+
+        visited = set()
+        # {text: (cost, first table, withs)}
+        sequences:dict[str, tuple[tuple[int, int], DeadKeysType, tuple[str, ...]]] = {}
+        counter = len(queue)
+        while queue:
+            (events, changes), _, table, root, withs = heapq.heappop(queue)
+            if id(table) in visited:
+                continue
+            visited.add(id(table))
+
+            for dkey in table.values():
+                key = self.keys.get(dkey.with_)
+                if key is None:
+                    continue
+                key_events, key_changes = key_cost(key)
+                cost = (events + key_events, changes + key_changes)
+                if dkey.deadkeys:
+                    if id(dkey.deadkeys) not in visited:
+                        counter += 1
+                        heapq.heappush(queue, (cost, counter, dkey.deadkeys, root, withs + (dkey.with_,)))
+                elif dkey.text:
+                    best = sequences.get(dkey.text)
+                    if best is None or cost < best[0]:
+                        sequences[dkey.text] = (cost, root, withs + (dkey.with_,))
+
+        # Other keys with the same result are added to a key (the runtime
+        # uses the one of the current modifiers without emulation):
+        # any dead key which types text with the same keys for the first key,
+        # any key to the same dead key table for the next ones.
+        # The last key is kept alone: its release uses the same scancode.
+        result = {}
+        for text, (_cost, table, withs) in sequences.items():
+            scancodes_by_mods = {}
+            for root, root_scancodes_by_mods in self.roots.values():
+                if self.compose(root, withs) == text:
+                    for mod_flags, scancodes in root_scancodes_by_mods.items():
+                        scancodes_by_mods.setdefault(mod_flags, []).extend(scancodes)
+            keys = [self.dead_key_mods(scancodes_by_mods)]
+
+            for with_ in withs[:-1]:
+                next_table = self.edges(table)[with_].deadkeys
+                key = dict(self.keys[with_])
+                for dkey in table.values():
+                    if dkey.deadkeys is next_table and dkey.with_ in self.keys:
+                        for mod_flags, scancode in self.keys[dkey.with_]:
+                            key.setdefault(mod_flags, scancode)
+                keys.append(tuple(key.items()))
+                table = next_table
+
+            keys.append(self.keys[withs[-1]])
+            result[text] = tuple(keys)
+        return result
+
+    @staticmethod
+    def dead_key_mods(scancodes_by_mods:ScancodesByMods) -> KeyMods:
+        # lowest scancode, not extended when possible
+        return key_mods({mod_flags: sorted(scancodes) for mod_flags, scancodes in scancodes_by_mods.items()})
+
+    def dead_key(self, table:DeadKeysType) -> KeyMods:
+        return self.dead_key_mods(self.roots[id(table)][1])
+
+def js_text(text:str, codepoint:int) -> str:
+    return char_to_char_table.get(text) or (text if text.isprintable() else (f'\\x{codepoint:02x}' if codepoint <=0xff else f'\\u{codepoint:04x}'))
+
+def keymap_text(text:str, codepoint:int) -> str:
+    # value of js_text() in javascript
+    return text if text in char_to_char_table or text.isprintable() else chr(codepoint)
+
+def reachable_ranges(rlayout:ReversedLayout) -> tuple[tuple[int, int], ...]:
+    # [start, end) codepoint ranges of the characters typed by a key or by
+    # a dead key sequence (texts of several characters are ignored)
+    codepoints = sorted(set(
+        ord(text)
+        for text in [keymap_text(text, codepoint) for text, codepoint in rlayout.keymap] + list(rlayout.deadkeys)
+        if len(text) == 1
+    ))
+    ranges = []
+    for codepoint in codepoints:
+        if ranges and ranges[-1][1] == codepoint:
+            ranges[-1][1] = codepoint + 1
+        else:
+            ranges.append([codepoint, codepoint + 1])
+    return tuple(map(tuple, ranges))
+
+class ReachableChars:
+    # typeability of texts with a layout: untypeable() is a single
+    # str.translate() which removes the typed characters
+
+    def __init__(self, ranges:Iterable[tuple[int, int]]):
+        self.ranges = tuple(ranges)
+        self._typed = dict.fromkeys(codepoint for start, end in self.ranges for codepoint in range(start, end))
+
+    @classmethod
+    def from_layout(cls, rlayout:ReversedLayout) -> 'ReachableChars':
+        return cls(reachable_ranges(rlayout))
+
+    def __contains__(self, char:str) -> bool:
+        return len(char) == 1 and ord(char) in self._typed
+
+    def untypeable(self, text:str) -> str:
+        # characters of text without key, once, in text order
+        return ''.join(dict.fromkeys(text.translate(self._typed)))
+
+    def can_type(self, text:str) -> bool:
+        return not text.translate(self._typed)
+
+def gap_ranges(ranges:Iterable[tuple[int, int]]) -> tuple[int, ...]:
+    # (start - previous end, end - start, ...): small numbers in js
+    gaps = []
+    previous_end = 0
+    for start, end in ranges:
+        gaps += (start - previous_end, end - start)
+        previous_end = end
+    return tuple(gaps)
+
+class JsTables:
+    # shared const declarations of the layouts, deduplicated by structure
+    # before rendering: {structural tuple: index}
+    #   key: ((mod_flags, scancode), ...)
+    #   keymap: (js text, key index, js text, key index, ...)
+    #   dkeymap: ((js text, (key index, ...)), ...)
+    #   modseq: ((prefix scancode, ...), (suffix scancode, ...))
+    #   modrow: (modseq index, ...) by transition state
+    #   modtrans: (((expected mod_flags, modrow index), ...), ...) by ctrlAndAltIsAltGr
+    #   charset: (gap, length, ...) reachable codepoint ranges (see gap_ranges())
+    # Each value is rendered once by write() (see js_table_names for the order).
+    # A keymap or a dkeymap close to another one is rendered as a LayoutDelta
+    # of it (see plan_deltas()).
+
+    def __init__(self):
+        self.keys = {}
+        self.keymaps = {}
+        self.dkeymaps = {}
+        self.modseqs = {}
+        self.modrows = {}
+        self.modtrans = {}
+        self.charsets = {}
+        # {id(row): modrow index}, rows are shared by mod_row()
+        self._modrow_refs = {}
+        # [(rlayout, (keymap index, dkeymap index, modtrans index, charset index))]
+        self.layouts = []
+        self.lookups = dict.fromkeys(js_table_names, 0)
+        self.output_bytes = dict.fromkeys(js_table_names, 0)
+        # rendered bytes by value index and by layout (see SizeReport)
+        self.value_bytes = {name: [] for name in js_table_names}
+        self.layout_bytes = []
+        # {table name: {index: (base index, {text: value}, (removed text, ...))}}
+        # and the render order of the table (a base before its deltas)
+        self.deltas:dict[str, dict[int, tuple[int, dict, tuple[str, ...]]]] = {}
+        self.render_orders:dict[str, list[int]] = {}
+        self.inline_keys = os.environ.get('DEBUG') == '1'
+
+    def tables(self) -> dict[str, dict[tuple, int]]:
+        return {'key': self.keys, 'keymap': self.keymaps, 'dkeymap': self.dkeymaps,
+                'modseq': self.modseqs, 'modrow': self.modrows, 'modtrans': self.modtrans,
+                'charset': self.charsets}
+
+    def key_ref(self, key:KeyMods) -> KeyMods | int:
+        if self.inline_keys:
+            return key
+        self.lookups['key'] += 1
+        return self.keys.setdefault(key, len(self.keys))
+
+    def modrow_ref(self, row:ModRow) -> int:
+        self.lookups['modrow'] += 1
+        ref = self._modrow_refs.get(id(row))
+        if ref is None:
+            modseqs = self.modseqs
+            self.lookups['modseq'] += len(row)
+            modrow = tuple(modseqs.setdefault(seq, len(modseqs)) for seq in row)
+            ref = self._modrow_refs[id(row)] = self.modrows.setdefault(modrow, len(self.modrows))
+        return ref
+
+    def add_layout(self, rlayout:ReversedLayout) -> None:
+        keymap = []
+        for (text, codepoint), scancodes_by_mods in rlayout.keymap.items():
+            keymap += (js_text(text, codepoint), self.key_ref(key_mods(scancodes_by_mods)))
+
+        dkeymap = tuple(
+            (char_to_char_table.get(text, text), tuple(map(self.key_ref, keys)))
+            for text, keys in rlayout.deadkeys.items()
+        )
+
+        modtrans = tuple(
+            tuple((expected, self.modrow_ref(row)) for expected, row in rows)
+            for rows in layout_mod_transitions(rlayout)
+        )
+
+        refs = (
+            self.keymaps.setdefault(tuple(keymap), len(self.keymaps)),
+            self.dkeymaps.setdefault(dkeymap, len(self.dkeymaps)),
+            self.modtrans.setdefault(modtrans, len(self.modtrans)),
+            self.charsets.setdefault(gap_ranges(reachable_ranges(rlayout)), len(self.charsets)),
         )
+        self.layouts.append((rlayout, refs))
+
+        lookups = self.lookups
+        lookups['keymap'] += 1
+        lookups['dkeymap'] += 1
+        lookups['modtrans'] += 1
+        lookups['charset'] += 1
+
+    @staticmethod
+    def render_key(key:tuple[tuple[int, int], ...]) -> str:
+        s = ''.join(f'0x{mod_flags:x}: 0x{scancode:x}, ' for mod_flags, scancode in key)
+        return f'{{ {s}}}'
+
+    def render_key_ref(self, key:KeyMods | int) -> str:
+        return self.render_key(key) if self.inline_keys else f'key{key}'
+
+    def render_keymap_entry(self, text:str, key:KeyMods | int) -> str:
+        return f"    '{text}': {self.render_key_ref(key)},\n"
 
-    for text, (scancodes_by_mods, rkey) in rdeadkeymap.items():
-        text = char_to_char_table.get(text, text)
-        json.append(f"    '{text}': [{push_ref(scancodes_by_mods)}, {rkey}],\n")
+    def render_dkeymap_entry(self, text:str, keys:tuple) -> str:
+        return f"    '{text}': [{', '.join(map(self.render_key_ref, keys))}],\n"
 
-    for text, (scancodes_by_mods, rkeys) in rdeadkeymap2.items():
-        text = char_to_char_table.get(text, text)
-        json.append(f"    '{text}': [{push_ref(scancodes_by_mods)}, {rkeys}],\n")
+    def render_keymap(self, keymap:tuple) -> str:
+        lines = map(self.render_keymap_entry, keymap[::2], keymap[1::2])
+        return f"{{\n{''.join(lines)}  }};\n\n"
 
-    json.append('  };\n\n')
+    def render_dkeymap(self, dkeymap:tuple) -> str:
+        lines = (self.render_dkeymap_entry(text, keys) for text, keys in dkeymap)
+        return f"{{\n{''.join(lines)}  }};\n\n"
 
-    kn = dkeymap_vars.setdefault(''.join(json), len(dkeymap_vars))
-    output.append(f'dkeymap{kn},\n    accents: ')
+    def render_delta(self, name:str, delta:tuple[int, dict, tuple[str, ...]]) -> str:
+        base, entries, removed = delta
+        render_entry = self.render_keymap_entry if name == 'keymap' else self.render_dkeymap_entry
+        lines = ''.join(render_entry(text, value) for text, value in entries.items())
+        rremoved = ''.join(f"'{text}', " for text in removed)
+        return f"new LayoutDelta({name}{base}, {{\n{lines}  }}, [{rremoved}]);\n\n"
 
-    json = ['[\n']
+    @staticmethod
+    def table_entries(name:str, value:tuple) -> dict:
+        # {text: key} of a keymap, {text: keys} of a dkeymap (a text defined twice is the last one, as in js)
+        return dict(zip(value[::2], value[1::2])) if name == 'keymap' else dict(value)
 
-    for scancodes in accents:
-        json.append(f'    {{{scancodes}}},\n')
+    def plan_deltas(self) -> None:
+        # Each keymap (and dkeymap) is rendered in full or as the difference
+        # with another one, whichever is smaller. Greedy arborescence (Prim):
+        # the cheapest value to attach (in full or from an attached value) is
+        # attached first, so a base is always rendered before its deltas.
+        for name in ('keymap', 'dkeymap'):
+            render_entry = self.render_keymap_entry if name == 'keymap' else self.render_dkeymap_entry
+            values = [self.table_entries(name, value) for value in self.tables()[name]]
+            items = [set(entries.items()) for entries in values]
+            entry_bytes = [{item: len(render_entry(*item)) for item in entries.items()} for entries in values]
+            n = len(values)
+            # (cost, base index or -1)
+            best = [(sum(sizes.values()), -1) for sizes in entry_bytes]
+            depth = [0] * n
+            unattached = set(range(n))
+            order = []
+            deltas = {}
+            while unattached:
+                i = min(unattached, key=lambda i: (best[i][0], i))
+                unattached.remove(i)
+                order.append(i)
+                base = best[i][1]
+                if base >= 0:
+                    depth[i] = depth[base] + 1
+                    base_entries = values[base]
+                    entries = {text: value for text, value in values[i].items()
+                               if text not in base_entries or base_entries[text] != value}
+                    removed = tuple(text for text in base_entries if text not in values[i])
+                    deltas[i] = (base, entries, removed)
+                if depth[i] >= max_delta_depth:
+                    continue
+                base_items = items[i]
+                base_texts = values[i].keys()
+                for j in unattached:
+                    sizes = entry_bytes[j]
+                    cost = (delta_overhead
+                            + sum(sizes[item] for item in items[j] - base_items)
+                            + sum(len(text) + 4 for text in base_texts - values[j].keys()))
+                    if cost < best[j][0]:
+                        best[j] = (cost, i)
+            self.deltas[name] = deltas
+            self.render_orders[name] = order
 
-    json.append('  ];\n\n')
+    @staticmethod
+    def render_modseq(seq:ModSequence) -> str:
+        prefix, suffix = (', '.join(f'0x{scancode:x}' for scancode in scancodes) for scancodes in seq)
+        return f'[[{prefix}], [{suffix}]];\n'
 
-    kn = accent_vars.setdefault(''.join(json), len(accent_vars))
-    output.append(f'accents{kn},\n  }},\n')
+    @staticmethod
+    def render_modrow(row:tuple[int, ...]) -> str:
+        lines = (' '.join(f'modseq{i},' for i in row[j:j + 16]) for j in range(0, len(row), 16))
+        return '[\n' + ''.join(f'    {line}\n' for line in lines) + '  ];\n\n'
 
+    @staticmethod
+    def render_modtrans(modtrans:tuple) -> str:
+        objects = (''.join(f'0x{expected:x}: modrow{i}, ' for expected, i in rows) for rows in modtrans)
+        return '[\n' + ''.join(f'    {{ {o}}},\n' for o in objects) + '  ];\n\n'
 
-print(
+    def render_table_ref(self, prop:str, name:str, i:int) -> str:
+        # a delta is resolved on first access
+        if i in self.deltas.get(name, ()):
+            return f'    get {prop}() {{ return {name}{i}.resolve(); }},\n'
+        return f'    {prop}: {name}{i},\n'
+
+    @staticmethod
+    def render_charset(gaps:tuple[int, ...]) -> str:
+        lines = (', '.join(map(str, gaps[i:i + 24])) for i in range(0, len(gaps), 24))
+        return '[\n' + ''.join(f'    {line},\n' for line in lines) + '  ];\n\n'
+
+    def render_layout(self, rlayout:ReversedLayout, refs:tuple[int, int, int, int]) -> str:
+        layout = rlayout.layout
+        kn, dn, mn, cn = refs
+        return (f'  {{\n    klid: 0x{layout.klid},\n    localeName: "{layout.locale_name}",\n    displayName: "{layout.display_name}",\n    ctrlRightIsOem8: {"true" if layout.has_right_ctrl_like_oem8 else "false"},\n    altRightIsAltGr: {"true" if layout.alt_right_is_altgr else "false"},\n'
+                f'{self.render_table_ref("keymap", "keymap", kn)}{self.render_table_ref("deadkeys", "dkeymap", dn)}    modTransitions: modtrans{mn},\n    reachable: charset{cn},\n  }}')
+
+    def write_tables(self, write) -> None:
+        self.plan_deltas()
+        if any(self.deltas.values()):
+            write(js_layout_delta)
+        renderers = {
+            'key': lambda key: f'{self.render_key(key)};\n',
+            'keymap': self.render_keymap,
+            'dkeymap': self.render_dkeymap,
+            'modseq': self.render_modseq,
+            'modrow': self.render_modrow,
+            'modtrans': self.render_modtrans,
+            'charset': self.render_charset,
+        }
+        for name, table in self.tables().items():
+            render = renderers[name]
+            values = list(table)
+            deltas = self.deltas.get(name, {})
+            value_bytes = self.value_bytes[name] = [0] * len(values)
+            for i in self.render_orders.get(name, range(len(values))):
+                delta = deltas.get(i)
+                rendered = render(values[i]) if delta is None else self.render_delta(name, delta)
+                s = f'  const {name}{i} = {rendered}'
+                value_bytes[i] = len(s.encode())
+                write(s)
+            write('\n')
+            self.output_bytes[name] += sum(value_bytes)
+
+    def write_layouts(self, write) -> None:
+        write('  return [\n')
+        for rlayout, refs in self.layouts:
+            s = self.render_layout(rlayout, refs) + ',\n'
+            self.layout_bytes.append(len(s.encode()))
+            write(s)
+        write('  ];\n})();\n\n')
+
+js_table_names = ('key', 'keymap', 'dkeymap', 'modseq', 'modrow', 'modtrans', 'charset')
+
+# a keymap (or a dkeymap) rendered as the difference with another one
+max_delta_depth = 4
+# bytes of 'new LayoutDelta(keymapN, {...}, [...])' and of the getter
+delta_overhead = 80
+
+js_layout_delta = (
+    '  // base without removed texts, with entries (added or replaced)\n'
+    '  class LayoutDelta {\n'
+    '    constructor(base, entries, removed) {\n'
+    '      this.base = base;\n'
+    '      this.entries = entries;\n'
+    '      this.removed = removed;\n'
+    '      this.table = null;\n'
+    '    }\n'
+    '\n'
+    '    resolve() {\n'
+    '      if (this.table === null) {\n'
+    '        const base = this.base instanceof LayoutDelta ? this.base.resolve() : this.base;\n'
+    '        const table = {};\n'
+    '        const removed = new Set(this.removed);\n'
+    '        for (const text in base) {\n'
+    '          if (!removed.has(text)) {\n'
+    '            table[text] = base[text];\n'
+    '          }\n'
+    '        }\n'
+    '        this.table = Object.assign(table, this.entries);\n'
+    '      }\n'
+    '      return this.table;\n'
+    '    }\n'
+    '  }\n'
+    '\n'
+)
+
+js_format_comment = (
     '// keymap: { text: { mod_flags: scancode } }\n'
-    '// deadkeys: { text: [ idxAccent, idxKeymap, idxKeymap ? ]\n'
-    '// accents: [ { mod_flags: scancode } ]\n'
-    'const layouts = (function(){'
+    '// deadkeys: { text: [ dead key, key... ] } with key = { mod_flags: scancode }\n'
+    '//   (a LayoutDelta of another keymap or deadkeys, resolved by the layout getter)\n'
+    '// modTransitions: [ { expected mod_flags: row }, ... ] by ctrlAndAltIsAltGr\n'
+    '//   with row[transition state] = [ modifiers before scancode, modifiers after scancode ]\n'
+    '// reachable: [ gap, length, ... ] codepoint ranges typed by keymap and deadkeys\n'
+    '//   (start - end of the previous range, end - start), see untypeableChars() of scancodes.js\n'
 )
 
-def print_keymap_dict(name:str, d:dict[str,int]):
-    a = []
-    for kmap,i in d.items():
-        a.append(f'  const {name}{i} = ')
-        a.append(kmap)
-    print(''.join(a))
-
-print_keymap_dict('key', keys_vars)
-print_keymap_dict('keymap', keymap_vars)
-print_keymap_dict('accents', accent_vars)
-print_keymap_dict('dkeymap', dkeymap_vars)
-
-output.append('  ];\n})();\n\n')
-print(''.join(output))
-
-output = []
-output.append('const actionLayout = {\n')
-for key_and_scancode in vk_actions.values():
-    output.append(f'  "{key_and_scancode[0]}": 0x{key_and_scancode[1]:x},\n')
-output.append('};')
-output.append('\n\n')
-output.append('try {\n')
-output.append('    module.exports.layouts = layouts;\n')
-output.append('    module.exports.actionLayout = actionLayout;\n')
-output.append('}\n')
-output.append('catch(e) {\n')
-output.append('    // module not found\n')
-output.append('}\n')
-
-print(''.join(output))
-
-if error_messages:
-    print(f'{len(error_messages)} error(s):', file=sys.stderr)
-    print('\n'.join(error_messages), file=sys.stderr)
-    exit(1)
+def dedup_js(rlayouts:Iterable[ReversedLayout]) -> JsTables:
+    tables = JsTables()
+    for rlayout in rlayouts:
+        tables.add_layout(rlayout)
+    return tables
+
+def write_js(tables:JsTables, write) -> None:
+    write(js_format_comment)
+    write('const layouts = (function(){\n')
+    tables.write_tables(write)
+    tables.write_layouts(write)
+    write('\n')
+    write(js_action_layout())
+    write(js_exports)
+
+def emit_js(rlayouts:Iterable[ReversedLayout], write) -> None:
+    write_js(dedup_js(rlayouts), write)
+
+def layout_module_name(layout:KeyLayout) -> str:
+    return f'reversed_layout_{layout.klid}'
+
+def emit_js_chunks(rlayouts:list[ReversedLayout], directory:str) -> None:
+    # one module by layout with its own pools, and index.js
+    os.makedirs(directory, exist_ok=True)
+
+    index = ['const layoutIndex = [\n']
+
+    for rlayout in rlayouts:
+        layout = rlayout.layout
+        name = layout_module_name(layout)
+        index.append(f'  {{ klid: 0x{layout.klid}, localeName: "{layout.locale_name}", displayName: "{layout.display_name}", module: "{name}" }},\n')
+
+        tables = dedup_js((rlayout,))
+        with open(os.path.join(directory, f'{name}.js'), 'w') as f:
+            f.write(js_format_comment)
+            f.write('(function(){\n')
+            tables.write_tables(f.write)
+            f.write(f'  const layout =\n{tables.render_layout(*tables.layouts[0])};\n\n')
+            f.write(
+                '  try {\n'
+                '      module.exports.layout = layout;\n'
+                '  }\n'
+                '  catch(e) {\n'
+                '      // not a module: global registry by klid\n'
+                '      (globalThis.reversedLayoutChunks = globalThis.reversedLayoutChunks || {})[layout.klid] = layout;\n'
+                '  }\n'
+                '})();\n'
+            )
+
+    index.append('];\n\n')
+
+    with open(os.path.join(directory, 'index.js'), 'w') as f:
+        f.write(
+            '// layouts of this directory.\n'
+            '// node: require(`${entry.module}`).layout\n'
+            '// browser: load `${entry.module}.js`, then reversedLayoutChunks[entry.klid]\n'
+        )
+        f.write(''.join(index))
+        f.write(
+            'const layoutIndexByKlid = {};\n'
+            'const layoutIndexByLocaleName = {};\n'
+            'const layoutIndexByDisplayName = {};\n'
+            'for (const entry of layoutIndex) {\n'
+            '    layoutIndexByKlid[entry.klid] = entry;\n'
+            '    (layoutIndexByLocaleName[entry.localeName] = layoutIndexByLocaleName[entry.localeName] || []).push(entry);\n'
+            '    layoutIndexByDisplayName[entry.displayName] = entry;\n'
+            '}\n\n'
+        )
+        f.write(js_action_layout())
+        f.write(
+            'try {\n'
+            '    module.exports.layoutIndex = layoutIndex;\n'
+            '    module.exports.layoutIndexByKlid = layoutIndexByKlid;\n'
+            '    module.exports.layoutIndexByLocaleName = layoutIndexByLocaleName;\n'
+            '    module.exports.layoutIndexByDisplayName = layoutIndexByDisplayName;\n'
+            '    module.exports.actionLayout = actionLayout;\n'
+            '}\n'
+            'catch(e) {\n'
+            '    // module not found\n'
+            '}\n'
+        )
+
+def js_action_layout() -> str:
+    output = []
+    output.append('const actionLayout = {\n')
+    for key_and_scancode in vk_actions.values():
+        output.append(f'  "{key_and_scancode[0]}": 0x{key_and_scancode[1]:x},\n')
+    output.append('};')
+    output.append('\n\n')
+    return ''.join(output)
+
+js_exports = (
+    'try {\n'
+    '    module.exports.layouts = layouts;\n'
+    '    module.exports.actionLayout = actionLayout;\n'
+    '}\n'
+    'catch(e) {\n'
+    '    // module not found\n'
+    '}\n'
+    '\n'
+)
+
+# Binary format (little endian), decoded by lib/reversed_layouts_decoder.js
+#
+#   u32 magic ('RKL3'), u32 number of sections, (u32 offset, u32 byte length) by section
+#   sections aligned on 4 bytes:
+#
+#   - string lengths: u8 length in UTF-16 code units by string
+#   - string data: u8, concatenated strings in UTF-8
+#   - mods offsets: u32 (n+1 values) in mods data
+#   - mods data: u16 (mod_flags << 9 | scancode) by { mod_flags: scancode } object
+#   - keymap offsets: u32 (n+1 values) in keymap data
+#   - keymap data: u16 pairs (text string id, mods id)
+#   - dkeymap offsets: u32 (n+1 values) in dkeymap data
+#   - dkeymap data: u16 (text string id, number of keys, mods id...)
+#   - modseq offsets: u32 (n+1 values) in modseq data
+#   - modseq data: u16 (prefix length, prefix scancode..., suffix scancode...)
+#   - modrow offsets: u32 (n+1 values) in modrow data
+#   - modrow data: u16 modseq id by transition state
+#   - modtrans offsets: u32 (n+1 values) in modtrans data
+#   - modtrans data: u16 (expected mod_flags, modrow id without ctrlAndAltIsAltGr, modrow id with)
+#   - layouts: u32 (klid, localeName string id, displayName string id, flags, keymap id, dkeymap id, modtrans id)
+#     flags: 1 = ctrlRightIsOem8, 2 = altRightIsAltGr
+
+binary_magic = 0x334c4b52  # 'RKL3'
+
+class _Pool:
+    def __init__(self):
+        self.ids = {}
+        self.offsets = [0]
+        self.data = []
+
+    def push(self, values:tuple) -> int:
+        i = self.ids.get(values)
+        if i is None:
+            i = len(self.ids)
+            self.ids[values] = i
+            self.data += values
+            self.offsets.append(len(self.data))
+        return i
+
+def emit_binary(rlayouts:list[ReversedLayout]) -> bytes:
+    strings = {}
+    def string_id(s:str) -> int:
+        return strings.setdefault(s, len(strings))
+
+    mods_pool = _Pool()
+    keymap_pool = _Pool()
+    dkeymap_pool = _Pool()
+    modseq_pool = _Pool()
+    modrow_pool = _Pool()
+    modtrans_pool = _Pool()
+    layouts_data = []
+    # {id(row): modrow id}
+    modrow_ids = {}
+
+    def mods_id(mods:tuple[tuple[int, int], ...]) -> int:
+        assert all(mod_flags < 0x80 and scancode < 0x200 for mod_flags, scancode in mods)
+        return mods_pool.push(tuple((mod_flags << 9) | scancode for mod_flags, scancode in mods))
+
+    def modrow_id(row:ModRow) -> int:
+        i = modrow_ids.get(id(row))
+        if i is None:
+            i = modrow_ids[id(row)] = modrow_pool.push(tuple(
+                modseq_pool.push((len(prefix), *prefix, *suffix)) for prefix, suffix in row))
+        return i
+
+    for rlayout in rlayouts:
+        layout = rlayout.layout
+
+        keymap = []
+        for (text, codepoint), scancodes_by_mods in rlayout.keymap.items():
+            mods = key_mods(scancodes_by_mods)
+            keymap += (string_id(keymap_text(text, codepoint)), mods_id(mods))
+
+        dkeymap = []
+        for text, keys in rlayout.deadkeys.items():
+            dkeymap += (string_id(text), len(keys))
+            dkeymap += map(mods_id, keys)
+
+        modtrans = []
+        rows, ctrl_and_alt_rows = layout_mod_transitions(rlayout)
+        for (expected, row), (_expected, ctrl_and_alt_row) in zip(rows, ctrl_and_alt_rows):
+            modtrans += (expected, modrow_id(row), modrow_id(ctrl_and_alt_row))
+
+        flags = (1 if layout.has_right_ctrl_like_oem8 else 0) | (2 if layout.alt_right_is_altgr else 0)
+        layouts_data += (
+            int(layout.klid, 16),
+            string_id(layout.locale_name),
+            string_id(layout.display_name),
+            flags,
+            keymap_pool.push(tuple(keymap)),
+            dkeymap_pool.push(tuple(dkeymap)),
+            modtrans_pool.push(tuple(modtrans)),
+        )
+
+    if max(len(strings), len(mods_pool.ids), len(modseq_pool.ids), len(modrow_pool.ids)) > 0xffff:
+        raise Exception('too many strings, mods or modifier transitions for the binary format')
+
+    string_lengths = [len(s.encode('utf-16-le')) // 2 for s in strings]
+    if max(string_lengths, default=0) > 0xff:
+        raise Exception('string too long for the binary format')
+
+    sections = [
+        bytes(string_lengths),
+        ''.join(strings).encode('utf8'),
+    ]
+    for pool in (mods_pool, keymap_pool, dkeymap_pool, modseq_pool, modrow_pool, modtrans_pool):
+        sections.append(struct.pack(f'<{len(pool.offsets)}I', *pool.offsets))
+        sections.append(struct.pack(f'<{len(pool.data)}H', *pool.data))
+    sections.append(struct.pack(f'<{len(layouts_data)}I', *layouts_data))
+
+    header_size = 8 + 8 * len(sections)
+    header = [binary_magic, len(sections)]
+    body = []
+    offset = header_size
+    for section in sections:
+        header += (offset, len(section))
+        padding = -len(section) % 4
+        body.append(section + bytes(padding))
+        offset += len(section) + padding
+
+    return struct.pack(f'<{len(header)}I', *header) + b''.join(body)
+
+def emit_binary_js(rlayouts:list[ReversedLayout], write) -> None:
+    data = base64.b64encode(emit_binary(rlayouts)).decode()
+    write(
+        '// generated by tools/gen_reversed_keylayout.py --format binary-js\n'
+        '// requires reversed_layouts_decoder.js\n'
+        'const layouts = (function(){\n'
+        '  const decode = (typeof decodeReversedLayouts !== "undefined")\n'
+        '    ? decodeReversedLayouts\n'
+        '    : require("reversed_layouts_decoder").decodeReversedLayouts;\n'
+        f'  return decode("{data}");\n'
+        '})();\n\n'
+    )
+    write(js_action_layout())
+    write(js_exports)
+
+def add_tables_stats(stats:Stats, tables:JsTables) -> None:
+    for name, table in tables.tables().items():
+        stats.add_dedup(name, tables.lookups[name], len(table), tables.output_bytes[name])
+
+class TableSize(NamedTuple):
+    distinct: int
+    lookups: int
+    output_bytes: int
+    shared: int  # values referenced by several layouts
+    shared_bytes: int
+    max_layouts: int  # layouts which reference the most shared value
+
+    @property
+    def dedup_ratio(self) -> float:
+        return self.lookups / self.distinct if self.distinct else 0.
+
+class LayoutSize(NamedTuple):
+    klid: str
+    display_name: str
+    record_bytes: int
+    exclusive_bytes: int  # record and values only referenced by this layout
+    amortized_bytes: int  # record and values divided by their number of layouts
+
+class UnsharedKeymap(NamedTuple):
+    name: str
+    klid: str
+    display_name: str
+    output_bytes: int
+
+class SizeReport:
+    # bytes of the js output by table and by layout, filled by generate().
+    # A value of a table is referenced by the layouts which reference it
+    # directly (keymap, dkeymap, modtrans) or through another value
+    # (keymap / dkeymap -> key, modtrans -> modrow -> modseq).
+
+    def __init__(self):
+        self.total_bytes = 0
+        self.tables:dict[str, TableSize] = {}
+        self.layouts:list[LayoutSize] = []
+        self.unshared_keymaps:list[UnsharedKeymap] = []
+
+    def write_counter(self, write):
+        def counting_write(s:str) -> None:
+            self.total_bytes += len(s.encode())
+            write(s)
+        return counting_write
+
+    def add_tables(self, tables:JsTables) -> None:
+        # {name: [bitset of layout indexes by value index]}
+        users = {name: [0] * len(table) for name, table in tables.tables().items()}
+        for i, (_rlayout, (kn, dn, mn, cn)) in enumerate(tables.layouts):
+            bit = 1 << i
+            users['keymap'][kn] |= bit
+            users['dkeymap'][dn] |= bit
+            users['modtrans'][mn] |= bit
+            users['charset'][cn] |= bit
+
+        def propagate(parent:str, child:str, child_refs) -> None:
+            parent_users = users[parent]
+            child_users = users[child]
+            for value, i in tables.tables()[parent].items():
+                for ref in child_refs(value):
+                    child_users[ref] |= parent_users[i]
+
+        # a base is used by the layouts of its deltas (rendered after it)
+        for name, deltas in tables.deltas.items():
+            name_users = users[name]
+            for i in reversed(tables.render_orders[name]):
+                if i in deltas:
+                    name_users[deltas[i][0]] |= name_users[i]
+
+        if not tables.inline_keys:
+            propagate('keymap', 'key', lambda keymap: keymap[1::2])
+            propagate('dkeymap', 'key', lambda dkeymap: (key for _text, keys in dkeymap for key in keys))
+        propagate('modtrans', 'modrow', lambda modtrans: (i for rows in modtrans for _expected, i in rows))
+        propagate('modrow', 'modseq', lambda modrow: modrow)
+
+        exclusive = [0] * len(tables.layouts)
+        amortized = [0.] * len(tables.layouts)
+        for name, table in tables.tables().items():
+            value_bytes = tables.value_bytes[name]
+            shared = shared_bytes = max_layouts = 0
+            for layout_bits, size in zip(users[name], value_bytes):
+                n = layout_bits.bit_count()
+                if n > 1:
+                    shared += 1
+                    shared_bytes += size
+                    max_layouts = max(max_layouts, n)
+                elif n == 1:
+                    exclusive[layout_bits.bit_length() - 1] += size
+                while layout_bits:
+                    low = layout_bits & -layout_bits
+                    amortized[low.bit_length() - 1] += size / n
+                    layout_bits ^= low
+            self.tables[name] = TableSize(len(table), tables.lookups[name], sum(value_bytes),
+                                          shared, shared_bytes, max_layouts)
+
+        for i, (rlayout, _refs) in enumerate(tables.layouts):
+            layout = rlayout.layout
+            record_bytes = tables.layout_bytes[i]
+            self.layouts.append(LayoutSize(layout.klid, layout.display_name, record_bytes,
+                                           record_bytes + exclusive[i], round(record_bytes + amortized[i])))
+
+        keymap_users = users['keymap']
+        for i, size in enumerate(tables.value_bytes['keymap']):
+            if keymap_users[i].bit_count() == 1:
+                layout = tables.layouts[keymap_users[i].bit_length() - 1][0].layout
+                self.unshared_keymaps.append(UnsharedKeymap(f'keymap{i}', layout.klid, layout.display_name, size))
+        self.unshared_keymaps.sort(key=lambda keymap: keymap.output_bytes, reverse=True)
+
+    def to_dict(self) -> dict:
+        tables_bytes = sum(table.output_bytes for table in self.tables.values())
+        layouts_bytes = sum(layout.record_bytes for layout in self.layouts)
+        return {
+            'total_bytes': self.total_bytes,
+            'tables_bytes': tables_bytes,
+            'layouts_bytes': layouts_bytes,
+            'other_bytes': self.total_bytes - tables_bytes - layouts_bytes,
+            'tables': {name: {**table._asdict(), 'dedup_ratio': table.dedup_ratio}
+                       for name, table in self.tables.items()},
+            'layouts': [layout._asdict() for layout in self.layouts],
+            'unshared_keymaps': [keymap._asdict() for keymap in self.unshared_keymaps],
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+    def format(self, largest:int = 10) -> str:
+        d = self.to_dict()
+        lines = [f"output: {d['total_bytes']} bytes (tables: {d['tables_bytes']},"
+                 f" layouts: {d['layouts_bytes']}, other: {d['other_bytes']})",
+                 'table     distinct   lookups  ratio     bytes  shared  shared bytes  max layouts']
+        for name, table in self.tables.items():
+            lines.append(f'{name:8} {table.distinct:9} {table.lookups:9} {table.dedup_ratio:6.1f}'
+                         f' {table.output_bytes:9} {table.shared:7} {table.shared_bytes:13} {table.max_layouts:12}')
+
+        lines.append(f'largest layouts ({len(self.layouts)}):     amortized  exclusive')
+        for layout in sorted(self.layouts, key=lambda layout: layout.amortized_bytes, reverse=True)[:largest]:
+            lines.append(f'  {layout.klid} {layout.display_name[:28]:28} {layout.amortized_bytes:9} {layout.exclusive_bytes:10}')
+
+        lines.append(f'largest unshared keymaps ({len(self.unshared_keymaps)}):')
+        for keymap in self.unshared_keymaps[:largest]:
+            lines.append(f'  {keymap.name:10} {keymap.klid} {keymap.display_name[:28]:28} {keymap.output_bytes:9}')
+
+        return '\n'.join(lines) + '\n'
+
+    def check_budget(self, budget:dict) -> list[str]:
+        # budget: {
+        #   "total": bytes,
+        #   "tables": {table name: bytes},
+        #   "layout": amortized bytes by layout,
+        #   "layouts": {klid: amortized bytes} (overrides "layout")
+        # }
+        # return the exceeded limits
+        errors = []
+        def check(name:str, size:int, limit:int|None) -> None:
+            if limit is not None and size > limit:
+                errors.append(f'{name}: {size} bytes exceeds the budget of {limit} bytes (+{size - limit})')
+
+        check('total', self.total_bytes, budget.get('total'))
+        for name, limit in budget.get('tables', {}).items():
+            if name not in self.tables:
+                errors.append(f'budget: unknown table: {name}')
+            else:
+                check(f'table {name}', self.tables[name].output_bytes, limit)
+        layout_limits = {klid.lower(): limit for klid, limit in budget.get('layouts', {}).items()}
+        for layout in self.layouts:
+            check(f'layout {layout.klid} ({layout.display_name})', layout.amortized_bytes,
+                  layout_limits.get(layout.klid.lower(), budget.get('layout')))
+        return errors
+
+def load_budget(filename:str) -> dict:
+    with open(filename, encoding='utf-8') as f:
+        return json.load(f)
+
+output_formats = ('js', 'binary-js', 'bin')
+
+class _CountingWriter:
+    def __init__(self, out:IO, stats:Stats):
+        self.out = out
+        self.stats = stats
+
+    def write(self, s:str|bytes) -> None:
+        self.stats.count('output_bytes', len(s.encode() if isinstance(s, str) else s))
+        self.out.write(s)
+
+def generate(layouts:Iterable[KeyLayout], out:IO, output_format:str = 'js',
+             error_messages:list[str]|None = None, stats:Stats|None = None,
+             size_report:SizeReport|None = None) -> list[str]:
+    # write the reversed layouts in out (a binary file with output_format = 'bin')
+    # return error_messages (the reverse errors)
+    # size_report is filled with the sizes of the js output (output_format = 'js')
+    if output_format not in output_formats:
+        raise ValueError(f'unknown format: {output_format} ({", ".join(output_formats)})')
+    if size_report and output_format != 'js':
+        raise ValueError('a size report is only available with the js format')
+
+    if error_messages is None:
+        error_messages = []
+    phase = stats.phase if stats else (lambda name: nullcontext())
+
+    if stats:
+        out = _CountingWriter(out, stats)
+
+    with phase('reverse'):
+        rlayouts = [reverse_layout(layout, error_messages) for layout in layouts]
+
+    if output_format == 'js':
+        with phase('dedup'):
+            tables = dedup_js(rlayouts)
+        with phase('emit'):
+            write_js(tables, size_report.write_counter(out.write) if size_report else out.write)
+        if stats:
+            add_tables_stats(stats, tables)
+        if size_report:
+            size_report.add_tables(tables)
+    elif output_format == 'binary-js':
+        with phase('emit'):
+            emit_binary_js(rlayouts, out.write)
+    else:
+        with phase('emit'):
+            out.write(emit_binary(rlayouts))
+
+    return error_messages
+
+def main(argv:list[str], stats:Stats|None = None) -> int:
+    output_format = 'js'
+    split_directory = None
+    stats_format = None
+    size_report_format = None
+    budget_filename = None
+    parser_argv = argv[:1]
+    iargv = 1
+    while iargv < len(argv):
+        if argv[iargv] == '--format' and iargv + 1 < len(argv):
+            output_format = argv[iargv + 1]
+            if output_format not in output_formats:
+                print(f'unknown format: {output_format} ({", ".join(output_formats)})', file=sys.stderr)
+                return 1
+            iargv += 2
+        elif argv[iargv] == '--split' and iargv + 1 < len(argv):
+            split_directory = argv[iargv + 1]
+            iargv += 2
+        elif argv[iargv] in ('--stats', '--stats=text', '--stats=json'):
+            stats_format = 'json' if argv[iargv] == '--stats=json' else 'text'
+            iargv += 1
+        elif argv[iargv] in ('--size-report', '--size-report=text', '--size-report=json'):
+            size_report_format = 'json' if argv[iargv] == '--size-report=json' else 'text'
+            iargv += 1
+        elif argv[iargv] == '--budget' and iargv + 1 < len(argv):
+            budget_filename = argv[iargv + 1]
+            iargv += 2
+        else:
+            parser_argv.append(argv[iargv])
+            iargv += 1
+
+    if split_directory and output_format != 'js':
+        print('--split is only available with --format js', file=sys.stderr)
+        return 1
+
+    size_report = None
+    if size_report_format or budget_filename:
+        if split_directory or output_format != 'js':
+            print('--size-report and --budget are only available with --format js (without --split)', file=sys.stderr)
+            return 1
+        size_report = SizeReport()
+        # read before the generation to fail early
+        budget = load_budget(budget_filename) if budget_filename else None
+
+    if stats is None and stats_format:
+        stats = Stats()
+
+    error_messages = []
+
+    layouts:list[KeyLayout] = parse_argv(parser_argv, errors=error_messages, stats=stats)
+
+    if split_directory:
+        rlayouts = [reverse_layout(layout, error_messages) for layout in layouts]
+        emit_js_chunks(rlayouts, split_directory)
+    else:
+        out = sys.stdout.buffer if output_format == 'bin' else sys.stdout
+        generate(layouts, out, output_format, error_messages, stats, size_report)
+
+    if stats_format == 'json':
+        print(stats.to_json(), file=sys.stderr)
+    elif stats_format:
+        sys.stderr.write(stats.format())
+
+    if size_report_format == 'json':
+        print(size_report.to_json(), file=sys.stderr)
+    elif size_report_format:
+        sys.stderr.write(size_report.format())
+
+    if budget_filename:
+        budget_errors = size_report.check_budget(budget)
+        if budget_errors:
+            print(f'{budget_filename}: {len(budget_errors)} size budget(s) exceeded:', file=sys.stderr)
+            print('\n'.join(budget_errors), file=sys.stderr)
+            return 1
+
+    if error_messages:
+        print(f'{len(error_messages)} error(s):', file=sys.stderr)
+        print('\n'.join(error_messages), file=sys.stderr)
+        return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
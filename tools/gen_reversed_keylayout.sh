@@ -1,27 +1,35 @@
 #!/usr/bin/env bash
 
-# uncompress: tar --zstd -xf kbdlayout.info.tar.zst
+# layouts are read from kbdlayout.info.tar.zst, or from $KBDLAYOUT_PATH/*.xml
+# when KBDLAYOUT_PATH is set (uncompress: tar --zstd -xf kbdlayout.info.tar.zst)
+# The generation of all the layouts fails when lib/reversed_layouts.js exceeds
+# reversed_layouts_budget.json (see --size-report)
 
 set -e
 
 d="$(dirname "$0")"
 
+KBD_CACHE="${KBD_CACHE-"$d"/.cache}"
+
 genfile() {
-  "$d"/gen_reversed_keylayout.py "$@" > "$d"/../lib/reversed_layouts.js
+  "$d"/gen_reversed_keylayout.py -j "${JOBS:-0}" ${KBD_CACHE:+--cache "$KBD_CACHE"} "$@" > "$d"/../lib/reversed_layouts.js
 }
 
-if [[ -z "$KBDLAYOUT_PATH" ]]; then
-   KBDLAYOUT_PATH="$d"/kbdlayout.info
-fi
-
 case "$1" in
   --all|all|'')
-    genfile "${KBDLAYOUT_PATH}"/*.xml ;;
+    if [[ -z "$KBDLAYOUT_PATH" ]]; then
+      genfile --budget "$d"/reversed_layouts_budget.json "$d"/kbdlayout.info.tar.zst
+    else
+      genfile --budget "$d"/reversed_layouts_budget.json "${KBDLAYOUT_PATH}"/*.xml
+    fi ;;
 
   --help|help)
     echo "usage:
 $0 [--all|all]
-$0 files..." ;;
+$0 [--klid KLID,...] [--locale NAME,...] files...
+
+JOBS: number of parser processes (default: 0 = number of CPUs)
+KBD_CACHE: directory of parsed layouts (default: $d/.cache, empty to disable)" ;;
 
   *) genfile "$@"
 esac
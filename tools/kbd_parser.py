@@ -1,6 +1,20 @@
+import hashlib
+import io
+import json
+import os
+import pickle
+import subprocess
 import sys
-from collections.abc import Callable, Iterable
-from typing import Any, NamedTuple
+import tarfile
+import time
+import tracemalloc
+from array import array
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator, Sequence
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import groupby
+from typing import IO, Any, NamedTuple
 from xml.etree import ElementTree as ET
 
 rename_display_name_map = {
@@ -32,7 +46,170 @@ class Key(NamedTuple):
         return True if self.scancode & 0x80 else False
 
 
-KeymapType = list[Key | None]  # always 256 elements
+class _EmptyDeadKeys(dict):
+    __slots__ = ()
+
+    def _readonly(self, *args: Any) -> None:
+        raise TypeError('EMPTY_DEADKEYS is read-only')
+
+    __setitem__ = __delitem__ = setdefault = update = pop = popitem = clear = _readonly  # type: ignore
+
+    def __reduce__(self) -> str:
+        return 'EMPTY_DEADKEYS'
+
+
+# shared by all keys without dead key
+EMPTY_DEADKEYS: DeadKeysType = _EmptyDeadKeys()
+
+
+class KeyTable:
+    # distinct keys of a layout stored by column, shared by the keymaps of the layout.
+    # Entry 0 is the absence of key.
+    # vk and text are indexes of interned strings (strings[0] = None)
+    # and dead keys an index of deadkeys (deadkeys[0] = EMPTY_DEADKEYS)
+
+    __slots__ = ('scancodes', 'codepoints', 'texts', 'vks', 'deadkey_ids',
+                 'strings', 'deadkeys', '_string_ids', '_key_ids')
+
+    def __init__(self) -> None:
+        self.scancodes = array('B', (0,))
+        self.codepoints = array('I', (0,))
+        self.texts = array('H', (0,))
+        self.vks = array('H', (0,))
+        self.deadkey_ids = array('H', (0,))
+        self.strings: list[str | None] = [None]
+        self.deadkeys: list[DeadKeysType] = [EMPTY_DEADKEYS]
+        self._string_ids: dict[str | None, int] | None = {None: 0}
+        self._key_ids: dict[tuple, int] | None = {}
+
+    def __len__(self) -> int:
+        return len(self.scancodes)
+
+    def _key_id_key(self, i: int) -> tuple:
+        strings = self.strings
+        return (self.scancodes[i], self.codepoints[i], strings[self.texts[i]], strings[self.vks[i]],
+                id(self.deadkeys[self.deadkey_ids[i]]) if self.deadkey_ids[i] else 0)
+
+    def freeze(self) -> None:
+        # release the indexes used by key_id()
+        self._string_ids = None
+        self._key_ids = None
+
+    def _string_id(self, s: str | None) -> int:
+        i = self._string_ids.get(s)
+        if i is None:
+            i = len(self.strings)
+            self._string_ids[s] = i
+            self.strings.append(sys.intern(s))
+        return i
+
+    def _index(self) -> dict[tuple, int]:
+        # rebuilt after freeze() or unpickling
+        if self._key_ids is None:
+            self._string_ids = {s: i for i, s in enumerate(self.strings)}
+            self._key_ids = {self._key_id_key(i): i for i in range(1, len(self.scancodes))}
+        return self._key_ids
+
+    def key_id(self, key: Key) -> int:
+        deadkeys = key.deadkeys
+        k = (key.scancode, key.codepoint, key.text, key.vk, id(deadkeys) if deadkeys else 0)
+        i = self._index().get(k)
+        if i is None:
+            i = self._add_key(k, deadkeys)
+        return i
+
+    def _add_key(self, k: tuple, deadkeys: DeadKeysType) -> int:
+        scancode, codepoint, text, vk, _deadkeys_id = k
+        i = len(self.scancodes)
+        self._key_ids[k] = i
+        self.scancodes.append(scancode)
+        self.codepoints.append(codepoint)
+        self.texts.append(self._string_id(text))
+        self.vks.append(self._string_id(vk))
+        if deadkeys:
+            self.deadkey_ids.append(len(self.deadkeys))
+            self.deadkeys.append(deadkeys)
+        else:
+            self.deadkey_ids.append(0)
+        return i
+
+    def import_keys(self, other: 'KeyTable') -> list[int]:
+        # id in this table of each key of other (0 for 0)
+        key_ids = self._index()
+        ids = [0]
+        for i in range(1, len(other)):
+            k = other._key_id_key(i)
+            j = key_ids.get(k)
+            if j is None:
+                j = self._add_key(k, other.deadkeys[other.deadkey_ids[i]])
+            ids.append(j)
+        return ids
+
+    def key(self, i: int) -> Key | None:
+        if not i:
+            return None
+        strings = self.strings
+        return Key(scancode=self.scancodes[i], codepoint=self.codepoints[i],
+                   text=strings[self.texts[i]], vk=strings[self.vks[i]],
+                   deadkeys=self.deadkeys[self.deadkey_ids[i]])
+
+    def __getstate__(self) -> tuple:
+        return (self.scancodes, self.codepoints, self.texts, self.vks, self.deadkey_ids,
+                self.strings, self.deadkeys)
+
+    def __setstate__(self, state: tuple) -> None:
+        (self.scancodes, self.codepoints, self.texts, self.vks, self.deadkey_ids,
+         strings, self.deadkeys) = state
+        self.strings = [s if s is None else sys.intern(s) for s in strings]
+        self._string_ids = None
+        self._key_ids = None
+
+
+# ids of an empty keymap, copied on write
+_empty_ids = array('H', bytes(256 * 2))
+
+
+class Keymap(Sequence):
+    # 256 indexes of KeyTable. A Key is built on access.
+
+    __slots__ = ('table', 'ids')
+
+    def __init__(self, table: KeyTable, ids: array | None = None) -> None:
+        self.table = table
+        self.ids = _empty_ids if ids is None or ids == _empty_ids else ids
+
+    def __len__(self) -> int:
+        return 256
+
+    def __getitem__(self, i: int | slice) -> Key | None | list[Key | None]:
+        if isinstance(i, slice):
+            return list(map(self.table.key, self.ids[i]))
+        return self.table.key(self.ids[i])
+
+    def __iter__(self) -> Iterator[Key | None]:
+        return map(self.table.key, self.ids)
+
+    def __setitem__(self, i: int, key: Key | None) -> None:
+        if self.ids is _empty_ids:
+            self.ids = array('H', _empty_ids)
+        self.ids[i] = 0 if key is None else self.table.key_id(key)
+
+    def has_key(self, i: int) -> bool:
+        return self.ids[i] != 0
+
+    def overlaps(self, other: 'Keymap') -> bool:
+        return any(a and b for a, b in zip(self.ids, other.ids))
+
+    def merged(self, other: 'Keymap') -> 'Keymap':
+        # keys of self, otherwise keys of other
+        assert self.table is other.table
+        return Keymap(self.table, array('H', [a or b for a, b in zip(self.ids, other.ids)]))
+
+    def __reduce__(self) -> tuple:
+        return (Keymap, (self.table, self.ids))
+
+
+KeymapType = Keymap  # always 256 elements
 KeymapsType = dict[str, KeymapType]  # {mods: keymap}
 
 
@@ -51,48 +228,108 @@ Printer = Callable[[str], None]
 LogFn = Callable[..., None]
 
 
-def _getattribs(log: LogFn, node, nodename: str, attrs: dict[str, bool]) -> Iterable[str]:
-    if node.tag != nodename:
-        raise Exception(f'tag = {node.tag}, but {nodename} expected')
+class _AttribsSpec(NamedTuple):
+    tag: str
+    names: tuple[str, ...]
+    known: frozenset[str]
+    mandatory: tuple[str, ...]
+
 
-    d = dict.fromkeys(attrs)
+def _attribs_spec(tag: str, attrs: dict[str, bool]) -> _AttribsSpec:
+    return _AttribsSpec(tag, tuple(attrs), frozenset(attrs), tuple(k for k, v in attrs.items() if v))
 
-    for k, v in node.attrib.items():
-        if k not in d:
-            raise Exception(f'{node.tag}: unknown {k}')
-        d[k] = v
+
+_metadata_spec = _attribs_spec('metadata', {'KLID': True, 'LocaleName': True, 'LayoutDisplayName': True})
+_pk_spec = _attribs_spec('PK', {'SC': True, 'VK': True, 'Name': False})
+_result_spec = _attribs_spec('Result', {'Text': False, 'TextCodepoints': False, 'VK': False, 'With': False})
+_dead_key_table_spec = _attribs_spec('DeadKeyTable', {'Accent': True, 'Name': False})
+_dead_key_result_spec = _attribs_spec('Result', {'Text': False, 'With': True})
+
+
+def _getattribs(log: LogFn, node, spec: _AttribsSpec) -> tuple[str | None, ...]:
+    if node.tag != spec.tag:
+        raise Exception(f'tag = {node.tag}, but {spec.tag} expected')
+
+    attrib = node.attrib
+
+    if not spec.known.issuperset(attrib):
+        k = next(k for k in attrib if k not in spec.known)
+        raise Exception(f'{node.tag}: unknown {k}')
 
     # check that all mandatory attributes are extracted
-    for k, v in attrs.items():
-        if v and d[k] is None:
+    for k in spec.mandatory:
+        if k not in attrib:
             raise Exception(f'{node.tag}: {k} is missing')
 
-    log(nodename, d)
-    return d.values()
+    values = tuple(map(attrib.get, spec.names))
+    if log is not null_fn:
+        log(spec.tag, dict(zip(spec.names, values)))
+    return values
+
+
+class _InternedDeadKeys:
+    # dead keys and tables of dead keys without double dead key shared
+    # between the layouts of a batch
+
+    __slots__ = ('deadkey', 'deadkeys')
+
+    def __init__(self) -> None:
+        self.deadkey: dict[DeadKey, DeadKey] = {}
+        self.deadkeys: dict[tuple[DeadKey, ...], DeadKeysType] = {}
+
+
+# maps of the current batch (see interned_deadkeys())
+_batch_interned: _InternedDeadKeys | None = None
+
 
+@contextmanager
+def interned_deadkeys() -> Iterator[None]:
+    # the layouts parsed in the block share their identical dead keys, the
+    # maps are freed at the end of the block (outside of a block, a layout
+    # only shares its own dead keys)
+    global _batch_interned
+    previous = _batch_interned
+    if previous is None:
+        _batch_interned = _InternedDeadKeys()
+    try:
+        yield
+    finally:
+        _batch_interned = previous
 
-def _parse_deadkeys(log: LogFn, dead_key_table, deadkeys: dict[tuple[str, str], DeadKey]) -> int:
-    accent, _name = _getattribs(log, dead_key_table, 'DeadKeyTable', {'Accent': True, 'Name': False})
+
+def _parse_deadkeys(log: LogFn, dead_key_table, interned: _InternedDeadKeys) -> tuple[str, DeadKeysType]:
+    accent, _name = _getattribs(log, dead_key_table, _dead_key_table_spec)
+    accent = sys.intern(accent)
+    deadkeys = {}
+    has_double_deadkeys = False
     for result in dead_key_table:
-        text, with_ = _getattribs(log, result, 'Result', {'Text': False, 'With': True})
-        deadkey = DeadKey(accent=accent, with_=with_, text=text,
-                          codepoint=(text and ord(text)) or 0,
-                          deadkeys=None if text else {})
+        text, with_ = _getattribs(log, result, _dead_key_result_spec)
+        with_ = sys.intern(with_)
+        if text:
+            deadkey = DeadKey(accent=accent, with_=with_, text=sys.intern(text),
+                              codepoint=ord(text), deadkeys=None)
+            deadkey = interned.deadkey.setdefault(deadkey, deadkey)
+        # double dead keys
+        else:
+            assert len(result) == 1
+            _accent2, deadkeys2 = _parse_deadkeys(log, result[0], interned)
+            deadkey = DeadKey(accent=accent, with_=with_, text=text, codepoint=0, deadkeys=deadkeys2)
+            has_double_deadkeys = True
         k = (accent, with_)
         assert k is not deadkeys
         deadkeys[k] = deadkey
-        # double dead keys
-        if not text:
-            assert len(result) == 1
-            _parse_deadkeys(log, result[0], deadkey.deadkeys)
-    return accent
+
+    if not has_double_deadkeys:
+        deadkeys = interned.deadkeys.setdefault(tuple(deadkeys.values()), deadkeys)
+
+    return accent, deadkeys
 
 
 def verbose_print(*args: Any) -> None:
     print(*args, file=sys.stderr)
 
 
-_merge_numlock = (
+merge_numlock_mods = (
     ('VK_SHIFT VK_NUMLOCK', 'VK_SHIFT'),
     ('VK_SHIFT VK_KANA VK_NUMLOCK', 'VK_SHIFT VK_KANA'),
     ('VK_SHIFT VK_CONTROL VK_MENU VK_NUMLOCK', 'VK_SHIFT VK_CONTROL VK_MENU'),
@@ -101,7 +338,7 @@ _merge_numlock = (
     ('VK_KANA VK_NUMLOCK', 'VK_KANA'),
 )
 
-_merge_numlock_capital = (
+merge_numlock_capital_mods = (
     ('VK_SHIFT VK_NUMLOCK', 'VK_SHIFT VK_CAPITAL', 'VK_SHIFT VK_CAPITAL VK_NUMLOCK'),
     ('VK_SHIFT VK_CONTROL VK_MENU VK_NUMLOCK', 'VK_SHIFT VK_CONTROL VK_MENU VK_CAPITAL',
      'VK_SHIFT VK_CONTROL VK_MENU VK_CAPITAL VK_NUMLOCK'),
@@ -111,47 +348,94 @@ _merge_numlock_capital = (
 )
 
 
-def parse_xml_layout(filename: str, log: LogFn = verbose_print) -> KeyLayout:
+# keymaps read from xml
+parsed_keymap_names = (
+    '',
+    'VK_SHIFT',
+    'VK_SHIFT VK_CONTROL',
+    'VK_SHIFT VK_CAPITAL',
+    'VK_SHIFT VK_NUMLOCK',
+    'VK_SHIFT VK_KANA',
+    'VK_SHIFT VK_OEM_8',
+    'VK_SHIFT VK_CONTROL VK_MENU',
+    'VK_SHIFT VK_CONTROL VK_KANA',
+    'VK_SHIFT VK_KANA VK_NUMLOCK',
+    'VK_SHIFT VK_CONTROL VK_MENU VK_CAPITAL',
+    'VK_SHIFT VK_CONTROL VK_MENU VK_NUMLOCK',
+    'VK_CONTROL',
+    'VK_CONTROL VK_MENU',
+    'VK_CONTROL VK_KANA',
+    'VK_CONTROL VK_MENU VK_NUMLOCK',
+    'VK_CONTROL VK_MENU VK_CAPITAL',
+    'VK_CAPITAL',
+    'VK_NUMLOCK',
+    'VK_OEM_8',
+    'VK_KANA',
+    'VK_KANA VK_NUMLOCK',
+)
+
+# parsed_keymap_names + keymaps created by merge_numlock_keymaps()
+keymap_names = parsed_keymap_names + tuple(final_mod for _, _, final_mod in merge_numlock_capital_mods)
+
+
+def merge_numlock_keymaps(keymaps: KeymapsType) -> None:
+    # new keymap: shiftlock + numlock
+    for num_mod, caps_mod, final_mod in merge_numlock_capital_mods:
+        assert final_mod not in keymaps
+        caps_keymap = keymaps[caps_mod]
+        numlock_keymap = keymaps[num_mod]
+        assert not caps_keymap.overlaps(numlock_keymap)
+        keymaps[final_mod] = caps_keymap.merged(numlock_keymap)
+
+    # merge mod to numlock mod
+    for num_mod, merged_mod in merge_numlock_mods:
+        keymap = keymaps[merged_mod]
+        numlock_keymap = keymaps[num_mod]
+        assert not keymap.overlaps(numlock_keymap)
+        keymaps[num_mod] = keymap.merged(numlock_keymap)
+
+
+def parse_xml_layout(filename: str | IO[bytes], log: LogFn = verbose_print,
+                     merge_numlock: bool = True) -> KeyLayout:
     # VK_MENU = Alt
     # VK_CAPITAL = CapsLock
     # VK_CONTROL + VK_MENU = AltGr
-    keymaps = {k: [None] * 256 for k in (
-        '',
-        'VK_SHIFT',
-        'VK_SHIFT VK_CONTROL',
-        'VK_SHIFT VK_CAPITAL',
-        'VK_SHIFT VK_NUMLOCK',
-        'VK_SHIFT VK_KANA',
-        'VK_SHIFT VK_OEM_8',
-        'VK_SHIFT VK_CONTROL VK_MENU',
-        'VK_SHIFT VK_CONTROL VK_KANA',
-        'VK_SHIFT VK_KANA VK_NUMLOCK',
-        'VK_SHIFT VK_CONTROL VK_MENU VK_CAPITAL',
-        'VK_SHIFT VK_CONTROL VK_MENU VK_NUMLOCK',
-        'VK_CONTROL',
-        'VK_CONTROL VK_MENU',
-        'VK_CONTROL VK_KANA',
-        'VK_CONTROL VK_MENU VK_NUMLOCK',
-        'VK_CONTROL VK_MENU VK_CAPITAL',
-        'VK_CAPITAL',
-        'VK_NUMLOCK',
-        'VK_OEM_8',
-        'VK_KANA',
-        'VK_KANA VK_NUMLOCK',
-    )}
+    table = KeyTable()
+    keymaps = {k: Keymap(table) for k in parsed_keymap_names}
     extra_scancodes = {}
+    interned = _batch_interned or _InternedDeadKeys()
 
-    root = ET.parse(filename).getroot()
-    alt_right_is_altgr = root.attrib['RightAltIsAltGr'] == 'true'
-    klid, locale_name, display_name = _getattribs(log, root[0], 'metadata',
-                                                  {'KLID': True,
-                                                   'LocaleName': True,
-                                                   'LayoutDisplayName': True,
-                                                   })
+    root = None
+    metadata = None
     right_ctrl_like_oem8 = False
     has_oem8_key = False
-    for pk in root[1]:
-        sc, vk, _ = _getattribs(log, pk, 'PK', {'SC': True, 'VK': True, 'Name': False})
+    # depth of the current element (root = 0) and number of children of root:
+    # root[0] is the metadata, root[1] contains the PK
+    depth = -1
+    nchildren = 0
+
+    # each PK is processed as soon as it is complete, then freed
+    for event, node in ET.iterparse(filename, ('start', 'end')):
+        if event == 'start':
+            depth += 1
+            if depth == 0:
+                root = node
+            elif depth == 1:
+                nchildren += 1
+            continue
+
+        depth -= 1
+        if depth == 0:
+            if nchildren == 1:
+                metadata = _getattribs(log, node, _metadata_spec)
+            elif nchildren > 2:
+                node.clear()
+            continue
+        if depth != 1 or nchildren != 2:
+            continue
+
+        pk = node
+        sc, vk, _ = _getattribs(log, pk, _pk_spec)
         sc = int(sc, 16)
 
         # 0xE0XX -> extended
@@ -164,10 +448,11 @@ def parse_xml_layout(filename: str, log: LogFn = verbose_print) -> KeyLayout:
         # Pause
         if sc > 0xE100:
             assert sc == 0xE11D
-            extra_scancodes[sc] = Key(scancode=sc, codepoint=0, text='', vk=vk, deadkeys={})
+            extra_scancodes[sc] = Key(scancode=sc, codepoint=0, text='', vk=vk, deadkeys=EMPTY_DEADKEYS)
+            pk.clear()
             continue
 
-        if not pk and vk == 'VK_OEM_8':
+        if not len(pk) and vk == 'VK_OEM_8':
             # assume that VK_OEM_8 is set after dead keys
             assert has_oem8_key
             assert sc == 0xE01D  # right ctrl
@@ -175,25 +460,22 @@ def parse_xml_layout(filename: str, log: LogFn = verbose_print) -> KeyLayout:
 
         sc = (sc & 0x7f) | (0x80 if sc >> 8 else 0)
 
-        if not pk:
+        if not len(pk):
             keys = keymaps['']
-            assert sc not in keys
-            keys[sc] = Key(scancode=sc, codepoint=0, text='', vk=vk, deadkeys={})
+            assert not keys.has_key(sc)
+            keys[sc] = Key(scancode=sc, codepoint=0, text='', vk=vk, deadkeys=EMPTY_DEADKEYS)
+            pk.clear()
             continue
 
         for result in pk:
-            text, codepoint, vk, with_ = _getattribs(log, result, 'Result',
-                                                     {'Text': False,
-                                                      'TextCodepoints': False,
-                                                      'VK': False,
-                                                      'With': False})
+            text, codepoint, vk, with_ = _getattribs(log, result, _result_spec)
             keys = keymaps[with_ or '']
 
             if with_ and ('VK_OEM_8' in with_):
                 assert not right_ctrl_like_oem8
                 has_oem8_key = True
 
-            if sc in keys:
+            if keys.has_key(sc):
                 raise Exception(f'key {sc} ({text}/{codepoint}) already set')
 
             if text or codepoint:
@@ -210,41 +492,30 @@ def parse_xml_layout(filename: str, log: LogFn = verbose_print) -> KeyLayout:
                     # multi char
                     codepoint = 0
 
-                keys[sc] = Key(scancode=sc, codepoint=codepoint, text=text, vk=vk, deadkeys={})
+                keys[sc] = Key(scancode=sc, codepoint=codepoint, text=text, vk=vk, deadkeys=EMPTY_DEADKEYS)
 
             # dead keys
             elif len(result):
                 assert not vk
                 assert len(result) == 1
-                deadkeys = {}
-                accent = _parse_deadkeys(log, result[0], deadkeys)
+                accent, deadkeys = _parse_deadkeys(log, result[0], interned)
                 assert len(accent) == 1
                 assert deadkeys
                 keys[sc] = Key(scancode=sc, codepoint=ord(accent), text=accent, vk=vk, deadkeys=deadkeys)
 
-    # new keymap: shiftlock + numlock
-    for num_mod, caps_mod, final_mod in _merge_numlock_capital:
-        assert final_mod not in keymaps
-        caps_keymap = keymaps[caps_mod]
-        numlock_keymap = keymaps[num_mod]
-        keymap = [None] * 256
-        for i in range(256):
-            k = caps_keymap[i]
-            knum = numlock_keymap[i]
-            assert not (k and knum)
-            keymap[i] = k or knum
-        keymaps[final_mod] = keymap
+        pk.clear()
 
-    # merge mod to numlock mod
-    for num_mod, merged_mod in _merge_numlock:
-        keymap = keymaps[merged_mod]
-        numlock_keymap = keymaps[num_mod]
-        for i in range(256):
-            k = keymap[i]
-            knum = numlock_keymap[i]
-            assert not (k and knum)
-            if k:
-                numlock_keymap[i] = k
+    if metadata is None:
+        raise Exception('metadata is missing')
+
+    table.freeze()
+
+    klid, locale_name, display_name = metadata
+    alt_right_is_altgr = root.attrib['RightAltIsAltGr'] == 'true'
+
+    # without merge, keymaps only contains parsed_keymap_names (see layout_tensor.merge_numlock())
+    if merge_numlock:
+        merge_numlock_keymaps(keymaps)
 
     return KeyLayout(klid, locale_name, rename_display_name_map.get(klid, display_name),
                      display_name, keymaps, extra_scancodes,
@@ -274,6 +545,45 @@ def _accu_scancodes(strings: list[str], kmap: list[Key]) -> None:
             strings.append(f"  0x{i:02X} -\n")
 
 
+# ids of a KeyTable are u16
+_max_table_ids = 0x10000
+
+
+def share_keymaps(layouts: Iterable[KeyLayout]) -> list[KeyLayout]:
+    # layouts moved to a KeyTable shared by all the layouts, where a keymap
+    # identical to a keymap of another layout is the same Keymap: a variant only
+    # owns the planes which differ from its base layout.
+    # Keymaps must not be modified afterwards (other layouts would change).
+    table = KeyTable()
+    keymaps: dict[bytes, Keymap] = {}
+    shared_layouts = []
+    for layout in layouts:
+        layout_table = next(iter(layout.keymaps.values())).table
+        # a new table when the ids (u16) of keys, strings or dead keys would be exhausted
+        if (len(table) + len(layout_table) > _max_table_ids
+                or len(table.strings) + len(layout_table.strings) > _max_table_ids
+                or len(table.deadkeys) + len(layout_table.deadkeys) > _max_table_ids):
+            table.freeze()
+            table = KeyTable()
+            keymaps = {}
+
+        key_ids = table.import_keys(layout_table)
+        shared = {}
+        for mods, keymap in layout.keymaps.items():
+            if keymap.ids is _empty_ids:
+                ids = _empty_ids
+            else:
+                ids = array('H', [key_ids[i] for i in keymap.ids])
+            k = ids.tobytes()
+            shared_keymap = keymaps.get(k)
+            if shared_keymap is None:
+                shared_keymap = keymaps[k] = Keymap(table, ids)
+            shared[mods] = shared_keymap
+        shared_layouts.append(layout._replace(keymaps=shared))
+    table.freeze()
+    return shared_layouts
+
+
 def print_layout(layout: KeyLayout, printer: Printer = sys.stdout.write) -> None:
     strings = [f'KLID: {layout.klid}\nLocalName: {layout.locale_name}\nDisplayName: {layout.display_name}\nRightAltIsAltGr: {layout.alt_right_is_altgr}\nRightCtrlIsOEM8: {layout.has_right_ctrl_like_oem8}\n']
 
@@ -292,25 +602,559 @@ def null_fn(*args) -> None:  # noqa: ANN002
     pass
 
 
-def parse_argv(argv: list[str] | None = None, printer: Printer = sys.stdout.write) -> list[KeyLayout]:
+class LayoutSource(NamedTuple):
+    name: str
+    data: bytes | None  # None: read the file `name`
+
+
+archive_extensions = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz', '.tar.zst')
+
+
+def is_archive(filename: str) -> bool:
+    return filename.endswith(archive_extensions)
+
+
+@contextmanager
+def _open_decompressed(filename: str) -> Iterator[IO[bytes]]:
+    # gz, bz2 and xz are handled by tarfile
+    if not filename.endswith('.zst'):
+        with open(filename, 'rb') as f:
+            yield f
+        return
+
+    try:
+        from compression import zstd  # Python >= 3.14
+    except ImportError:
+        zstd = None
+
+    if zstd:
+        with zstd.open(filename) as f:
+            yield f
+        return
+
+    try:
+        proc = subprocess.Popen(['zstd', '-dcq', filename], stdout=subprocess.PIPE)
+    except FileNotFoundError:
+        raise Exception(f'{filename}: the zstd command is required to read .tar.zst archives before'
+                        f' Python 3.14 (install zstd, or use an archive in {", ".join(archive_extensions[:-1])},'
+                        f' or extracted xml files)') from None
+    with proc:
+        yield proc.stdout
+        proc.stdout.close()
+        if proc.wait():
+            raise Exception(f'{filename}: zstd exited with {proc.returncode}')
+
+
+header_chunk_size = 1024
+
+
+def _chunks(data: bytes, size: int = header_chunk_size) -> Iterator[bytes]:
+    return (data[i:i + size] for i in range(0, len(data), size))
+
+
+def _scan_header(chunks: Iterable[bytes]) -> tuple[dict[str, str], dict[str, str]]:
+    # (root attributes, metadata attributes): the document is read until the
+    # start tag of metadata (or of the first PK when metadata is missing)
+    parser = ET.XMLPullParser(('start',))
+    root = None
+    for chunk in chunks:
+        parser.feed(chunk)
+        for _event, node in parser.read_events():
+            if root is None:
+                root = node.attrib
+            if node.tag == 'metadata':
+                return root, node.attrib
+            if node.tag == 'PK':
+                return root, {}
+    return root or {}, {}
+
+
+def read_metadata(data: bytes) -> dict[str, str]:
+    # only read the beginning of the document
+    return _scan_header(_chunks(data))[1]
+
+
+class LayoutHeader(NamedTuple):
+    # fields of KeyLayout known without parsing the keys
+    klid: str
+    locale_name: str
+    display_name: str
+    origin_display_name: str
+    alt_right_is_altgr: bool
+
+
+def read_header(source: str | LayoutSource) -> LayoutHeader:
+    # reads the file until the metadata element
+    filename, data = (source, None) if isinstance(source, str) else source
+    if data is None:
+        with open(filename, 'rb') as f:
+            root, metadata = _scan_header(iter(lambda: f.read(header_chunk_size), b''))
+    else:
+        root, metadata = _scan_header(_chunks(data))
+
+    if not metadata:
+        raise Exception('metadata is missing')
+    for k in _metadata_spec.mandatory:
+        if k not in metadata:
+            raise Exception(f'metadata: {k} is missing')
+
+    klid = metadata['KLID']
+    display_name = metadata['LayoutDisplayName']
+    return LayoutHeader(klid, metadata['LocaleName'], rename_display_name_map.get(klid, display_name),
+                        display_name, root.get('RightAltIsAltGr') == 'true')
+
+
+def _normalize_klid(klid: str) -> str:
+    return klid.lower().rjust(8, '0')
+
+
+def filter_sources(sources: Iterable[LayoutSource],
+                   klids: Iterable[str] = (),
+                   locales: Iterable[str] = ()) -> Iterator[LayoutSource]:
+    klids = set(map(_normalize_klid, klids))
+    locales = set(locale.lower() for locale in locales)
+    if not klids and not locales:
+        yield from sources
+        return
+
+    for source in sources:
+        data = source.data
+        if data is None:
+            with open(source.name, 'rb') as f:
+                data = f.read()
+        metadata = read_metadata(data)
+        if (_normalize_klid(metadata.get('KLID', '')) in klids
+                or metadata.get('LocaleName', '').lower() in locales):
+            yield LayoutSource(source.name, data)
+
+
+def read_archive(filename: str, stream: bool = False) -> Iterator[LayoutSource]:
+    # xml files are read from the decompressed stream without extraction.
+    # Sorted by name like a shell glob of the extracted files (the members
+    # are read first). With stream, each member is yielded as it is
+    # decompressed, in the order of the archive (sorted with
+    # download_layouts.py, not for every archive).
+    with _open_decompressed(filename) as f, tarfile.open(fileobj=f, mode='r|*') as tar:
+        sources = (LayoutSource(f'{filename}:{member.name}', tar.extractfile(member).read())
+                   for member in tar if member.isfile() and member.name.endswith('.xml'))
+        if stream:
+            yield from sources
+        else:
+            yield from sorted(sources, key=lambda source: source.name)
+
+
+def read_sources(paths: Iterable[str], stream: bool = False) -> Iterator[LayoutSource]:
+    # stream: see read_archive()
+    for path in paths:
+        if is_archive(path):
+            yield from read_archive(path, stream)
+        else:
+            yield LayoutSource(path, None)
+
+
+# bump when the result of parse_xml_layout changes (KeyLayout, rename_display_name_map, etc)
+PARSER_VERSION = 2
+
+
+class LayoutCache:
+    # parsed layouts indexed by a hash of the xml content and PARSER_VERSION.
+    # The least recently used files are removed beyond max_size bytes.
+
+    def __init__(self, path: str, max_size: int = 64 * 1024 * 1024) -> None:
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def key(data: bytes) -> str:
+        h = hashlib.sha256(data)
+        h.update(f'\0{PARSER_VERSION}'.encode())
+        return h.hexdigest()
+
+    def _filename(self, key: str) -> str:
+        return os.path.join(self.path, f'{key}.pickle')
+
+    def get(self, key: str) -> KeyLayout | None:
+        filename = self._filename(key)
+        try:
+            with open(filename, 'rb') as f:
+                layout = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            self.misses += 1
+            return None
+        # mtime is used for LRU
+        os.utime(filename)
+        self.hits += 1
+        return layout
+
+    def put(self, key: str, layout: KeyLayout) -> None:
+        filename = self._filename(key)
+        tmp = f'{filename}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(layout, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, filename)
+
+    def _entries(self) -> list[os.DirEntry]:
+        return [entry for entry in os.scandir(self.path) if entry.name.endswith('.pickle')]
+
+    def prune(self) -> None:
+        entries = [(entry.stat(), entry.path) for entry in self._entries()]
+        size = sum(st.st_size for st, _ in entries)
+        if size <= self.max_size:
+            return
+        entries.sort(key=lambda x: x[0].st_mtime)
+        for st, path in entries:
+            os.remove(path)
+            size -= st.st_size
+            if size <= self.max_size:
+                break
+
+    def clear(self) -> None:
+        for entry in self._entries():
+            os.remove(entry.path)
+
+
+def deadkeys_depth(deadkeys: DeadKeysType | None) -> int:
+    # 1 for a simple dead key, 2 for a double dead key, etc
+    if not deadkeys:
+        return 0
+    return 1 + max(deadkeys_depth(dk.deadkeys) for dk in deadkeys.values())
+
+
+def _count_deadkeys(deadkeys: DeadKeysType | None) -> int:
+    if not deadkeys:
+        return 0
+    return sum(1 + _count_deadkeys(dk.deadkeys) for dk in deadkeys.values())
+
+
+class FileStats(NamedTuple):
+    name: str
+    parse_time: float  # seconds, 0 when cached
+    cached: bool
+    keys: int  # distinct keys (KeyTable entries)
+    key_slots: int  # non-empty entries of the keymaps
+    deadkeys: int  # DeadKey of the dead key tables of the layout
+    max_deadkey_depth: int
+
+
+class PhaseStats(NamedTuple):
+    time: float  # seconds
+    memory_peak: int  # bytes allocated above the start of the phase (0 without tracemalloc)
+
+
+class DedupStats(NamedTuple):
+    lookups: int
+    distinct: int
+    output_bytes: int
+
+    @property
+    def hit_rate(self) -> float:
+        return (self.lookups - self.distinct) / self.lookups if self.lookups else 0.
+
+
+class Stats:
+    # phase timings, tracemalloc peaks and counters of a generation.
+    # Hooks:
+    #   with stats.phase('name'): ...
+    #   stats.count('name', n)
+    #   stats.add_file(filename, parse_time, layout)
+    #   stats.add_dedup('name', lookups, distinct, output_bytes)
+    # parse_files() and parse_argv() fill files and the cache counters.
+    # Note: tracemalloc slows down the phases (trace_memory=False to disable it).
+
+    def __init__(self, trace_memory: bool = True) -> None:
+        self.trace_memory = trace_memory
+        self.phases: dict[str, PhaseStats] = {}
+        self.files: list[FileStats] = []
+        self.counters: dict[str, int] = {}
+        self.dedup: dict[str, DedupStats] = {}
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started_tracing = False
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            started_tracing = True
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            start_memory = tracemalloc.get_traced_memory()[0]
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - t
+            peak = tracemalloc.get_traced_memory()[1] - start_memory if self.trace_memory else 0
+            if started_tracing:
+                tracemalloc.stop()
+            old = self.phases.get(name)
+            if old:
+                elapsed += old.time
+                peak = max(peak, old.memory_peak)
+            self.phases[name] = PhaseStats(elapsed, peak)
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_dedup(self, name: str, lookups: int, distinct: int, output_bytes: int) -> None:
+        self.dedup[name] = DedupStats(lookups, distinct, output_bytes)
+
+    def add_file(self, filename: str, parse_time: float, layout: KeyLayout, cached: bool = False) -> None:
+        table = None
+        key_slots = 0
+        deadkeys = 0
+        depth = 0
+        for keymap in layout.keymaps.values():
+            table = keymap.table
+            key_slots += sum(1 for i in keymap.ids if i)
+        if table:
+            tables = {id(dks): dks for dks in table.deadkeys[1:]}
+            deadkeys = sum(map(_count_deadkeys, tables.values()))
+            depth = max(map(deadkeys_depth, tables.values()), default=0)
+        self.files.append(FileStats(filename, parse_time, cached,
+                                    len(table) - 1 if table else 0, key_slots, deadkeys, depth))
+
+    def to_dict(self) -> dict:
+        files = self.files
+        return {
+            'phases': {name: phase._asdict() for name, phase in self.phases.items()},
+            'counters': self.counters,
+            'dedup': {name: {**dedup._asdict(), 'hit_rate': dedup.hit_rate} for name, dedup in self.dedup.items()},
+            'totals': {
+                'files': len(files),
+                'cached_files': sum(f.cached for f in files),
+                'parse_time': sum(f.parse_time for f in files),
+                'keys': sum(f.keys for f in files),
+                'key_slots': sum(f.key_slots for f in files),
+                'deadkeys': sum(f.deadkeys for f in files),
+                'max_deadkey_depth': max((f.max_deadkey_depth for f in files), default=0),
+            },
+            'files': [f._asdict() for f in files],
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+    def format(self, slowest_files: int = 5) -> str:
+        d = self.to_dict()
+        totals = d['totals']
+        lines = ['phase                 time    memory peak']
+        for name, phase in self.phases.items():
+            lines.append(f'{name:16} {phase.time:9.3f}s {phase.memory_peak / 1024 / 1024:10.1f} MiB')
+        if self.trace_memory:
+            lines.append('(times include the tracemalloc overhead)')
+
+        lines.append(f"files: {totals['files']} ({totals['cached_files']} cached),"
+                     f" parse time: {totals['parse_time']:.3f}s")
+        for f in sorted(self.files, key=lambda f: f.parse_time, reverse=True)[:slowest_files]:
+            if f.parse_time:
+                lines.append(f'  {f.name}: {f.parse_time * 1000:.1f}ms')
+        lines.append(f"keys: {totals['keys']}, key slots: {totals['key_slots']},"
+                     f" dead keys: {totals['deadkeys']}, max dead key depth: {totals['max_deadkey_depth']}")
+
+        if self.dedup:
+            lines.append('dedup          lookups  distinct  hit rate  output bytes')
+            for name, dedup in self.dedup.items():
+                lines.append(f'{name:12} {dedup.lookups:9} {dedup.distinct:9} {dedup.hit_rate * 100:8.1f}% {dedup.output_bytes:13}')
+
+        for name, value in self.counters.items():
+            lines.append(f'{name}: {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def _parse_file(filename: str, data: bytes | None, log: LogFn) -> tuple[KeyLayout | None, str | None, float]:
+    log('filename:', filename)
+    t = time.perf_counter()
+    try:
+        layout = parse_xml_layout(filename if data is None else io.BytesIO(data), log)
+        return layout, None, time.perf_counter() - t
+    except Exception as e:
+        return None, f'{filename}: {type(e).__name__}: {e}', time.perf_counter() - t
+
+
+def parse_files(sources: Iterable[str | LayoutSource], log: LogFn = null_fn, jobs: int = 1,
+                errors: list[str] | None = None,
+                cache: LayoutCache | None = None,
+                stats: Stats | None = None) -> list[KeyLayout]:
+    # layouts are returned in the order of sources.
+    # a source is a filename or a LayoutSource
+    # jobs > 1: number of worker processes (0 = os.cpu_count())
+    # a file in error is skipped and reported in errors (or on stderr when None)
+    # Sources are parsed while they are read: at most jobs * 4 files are in
+    # memory (with read_sources(stream=True), an archive is not decompressed
+    # in memory).
+    # Identical dead keys are shared between the layouts parsed in this
+    # process during the call (see interned_deadkeys()).
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+    max_pending = jobs * 4 if jobs > 1 else 0
+
+    layouts: list[KeyLayout] = []
+    error_count = 0
+    # (filename, (layout, error, parse time) or its Future, cache key, cached)
+    pending: deque[tuple[str, Any, str | None, bool]] = deque()
+    executor = None
+
+    def finish(filename: str, result: Any, key: str | None, cached: bool) -> None:
+        nonlocal error_count
+        layout, error, parse_time = result.result() if isinstance(result, Future) else result
+        if error:
+            error_count += 1
+            if errors is None:
+                print(error, file=sys.stderr)
+            else:
+                errors.append(error)
+            return
+        if key:
+            cache.put(key, layout)
+        layouts.append(layout)
+        if stats is not None:
+            stats.add_file(filename, parse_time, layout, cached=cached)
+
+    try:
+        with interned_deadkeys():
+            for source in sources:
+                filename, data = (source, None) if isinstance(source, str) else source
+                key = None
+                if cache is not None:
+                    if data is None:
+                        try:
+                            with open(filename, 'rb') as f:
+                                data = f.read()
+                        except OSError as e:
+                            pending.append((filename, (None, f'{filename}: {type(e).__name__}: {e}', 0), None, False))
+                            continue
+
+                    key = cache.key(data)
+                    layout = cache.get(key)
+                    if layout:
+                        log('filename:', filename, '(cached)')
+                        pending.append((filename, (layout, None, 0), None, True))
+                        continue
+
+                if jobs > 1:
+                    if executor is None:
+                        executor = ProcessPoolExecutor(jobs)
+                    result = executor.submit(_parse_file, filename, data, log)
+                else:
+                    result = _parse_file(filename, data, log)
+                pending.append((filename, result, key, False))
+
+                while len(pending) > max_pending:
+                    finish(*pending.popleft())
+
+            while pending:
+                finish(*pending.popleft())
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    if cache is not None:
+        cache.prune()
+
+    if stats is not None:
+        stats.count('parse_errors', error_count)
+        if cache is not None:
+            stats.count('cache_hits', cache.hits)
+            stats.count('cache_misses', cache.misses)
+
+    return layouts
+
+
+def parse_argv(argv: list[str] | None = None, printer: Printer = sys.stdout.write,
+               errors: list[str] | None = None, stats: Stats | None = None) -> list[KeyLayout]:
     argv = argv if argv is not None else sys.argv
     log = null_fn
+    jobs = 1
+    cache_path = None
+    cache_size = None
+    clear_cache = False
+    stream = False
+    klids = []
+    locales = []
     iargv = 1
 
-    if len(argv) > 1 and argv[1] == '-v':
-        log = verbose_print
+    while iargv < len(argv):
+        arg = argv[iargv]
+        has_value = iargv + 1 < len(argv)
+        if arg == '-v':
+            log = verbose_print
+        elif arg == '-j' and has_value:
+            iargv += 1
+            jobs = int(argv[iargv])
+        elif arg.startswith('-j') and arg[2:].isdigit():
+            jobs = int(arg[2:])
+        elif arg == '--cache' and has_value:
+            iargv += 1
+            cache_path = argv[iargv]
+        elif arg == '--cache-size' and has_value:
+            iargv += 1
+            cache_size = int(argv[iargv]) * 1024 * 1024
+        elif arg == '--clear-cache':
+            clear_cache = True
+        elif arg == '--stream-archives':
+            stream = True
+        elif arg == '--klid' and has_value:
+            iargv += 1
+            klids += argv[iargv].split(',')
+        elif arg == '--locale' and has_value:
+            iargv += 1
+            locales += argv[iargv].split(',')
+        else:
+            break
         iargv += 1
 
+    cache = None
+    if cache_path:
+        cache = LayoutCache(cache_path) if cache_size is None else LayoutCache(cache_path, cache_size)
+        if clear_cache:
+            cache.clear()
+
     if len(argv) == iargv:
-        print(argv[0], '[-v] layout.xml...', file=sys.stderr)
+        if clear_cache:
+            sys.exit(0)
+        print(argv[0], '[-v] [-j N (0 = number of CPUs)] [--cache DIR [--cache-size MiB] [--clear-cache]]'
+              ' [--stream-archives] [--klid KLID,...] [--locale NAME,...] {layout.xml | layouts.tar[.gz|.bz2|.xz|.zst] | layouts.kldb}...',
+              file=sys.stderr)
         sys.exit(1)
 
-    layouts: list[KeyLayout] = []
-    for filename in argv[iargv:]:
-        log('filename:', filename)
-        layout = parse_xml_layout(filename, log)
-        layouts.append(layout)
-        if log == verbose_print:
+    # layouts in the order of the paths. Compiled databases (layout_db.py) are
+    # read without parsing, their layouts keep the file mapped in memory. The
+    # keymaps of the parsed layouts are shared.
+    layouts = []
+    # indexes of the parsed layouts in layouts
+    parsed = []
+    for is_db, group in groupby(argv[iargv:], lambda path: path.endswith('.kldb')):
+        if is_db:
+            from layout_db import LayoutDB
+            for path in group:
+                layouts += LayoutDB.open(path).select(klids, locales)
+            continue
+
+        sources = filter_sources(read_sources(list(group), stream), klids, locales)
+        if stats is None:
+            group_layouts = parse_files(sources, log, jobs, errors, cache)
+        else:
+            with stats.phase('read'):
+                sources = list(sources)
+            with stats.phase('parse'):
+                group_layouts = parse_files(sources, log, jobs, errors, cache, stats)
+        parsed += range(len(layouts), len(layouts) + len(group_layouts))
+        layouts += group_layouts
+
+    if parsed:
+        if stats is None:
+            shared = share_keymaps([layouts[i] for i in parsed])
+        else:
+            with stats.phase('parse'):
+                shared = share_keymaps([layouts[i] for i in parsed])
+        for i, layout in zip(parsed, shared):
+            layouts[i] = layout
+
+    if log == verbose_print:
+        for layout in layouts:
             print_layout(layout, printer)
 
     return layouts
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# Local stand-in of the kbdlayout.info pages used by download_layouts.py,
+# serving the layouts of an archive or xml files:
+#
+#   /                     index with a link per locale id
+#   /{lcid}               KLID, locale name and display name of each layout
+#   /{klid}/download/xml  layout without <metadata/>, with ETag and Last-Modified
+#
+#   kbdlayout_server.py [--port 8000] [--fail-rate 0.1] [--delay 0.01] layouts...
+#   download_layouts.py --base-url http://localhost:8000 /tmp/layouts.tar.zst
+import hashlib
+import html
+import random
+import sys
+import threading
+import time
+from collections.abc import Iterable
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from kbd_parser import LayoutSource, read_metadata, read_sources
+from download_layouts import metadata_re
+
+
+class Layout:
+    __slots__ = ('klid', 'locale_name', 'display_name', 'xml', 'etag', 'mtime')
+
+    def __init__(self, klid: str, locale_name: str, display_name: str, xml: bytes, mtime: float) -> None:
+        self.klid = klid
+        self.locale_name = locale_name
+        self.display_name = display_name
+        self.xml = xml
+        self.etag = f'"{hashlib.sha1(xml).hexdigest()[:16]}"'
+        self.mtime = mtime
+
+
+def load_layouts(sources: Iterable[LayoutSource], mtime: float) -> dict[str, Layout]:
+    layouts = {}
+    for source in sources:
+        data = source.data if source.data is not None else open(source.name, 'rb').read()
+        metadata = read_metadata(data)
+        if 'KLID' not in metadata:
+            continue
+        xml = metadata_re.sub(b'', data, count=1)
+        layouts[metadata['KLID']] = Layout(metadata['KLID'], metadata.get('LocaleName', ''),
+                                           metadata.get('LayoutDisplayName', ''), xml, mtime)
+    return layouts
+
+
+class LayoutServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], layouts: dict[str, Layout],
+                 fail_rate: float = 0, delay: float = 0, verbose: bool = False) -> None:
+        super().__init__(address, LayoutRequestHandler)
+        self.layouts = layouts
+        self.fail_rate = fail_rate
+        self.delay = delay
+        self.verbose = verbose
+        self.rng = random.Random(0)
+        self.lock = threading.Lock()
+        # statistics read by tests
+        self.requests = 0
+        self.connections = 0
+        self.not_modified = 0
+        self.failures = 0
+
+        # locale id (low word of the KLID) -> layouts
+        self.locales: dict[str, list[Layout]] = {}
+        for klid, layout in sorted(layouts.items()):
+            self.locales.setdefault(f'0000{klid[4:]}', []).append(layout)
+
+    def index_page(self) -> str:
+        links = ''.join(f'    <li><a href="/{lcid}">{lcid}</a></li>\n' for lcid in self.locales)
+        return f'<html>\n<body>\n  <ul>\n{links}  </ul>\n</body>\n</html>\n'
+
+    def locale_page(self, lcid: str) -> str | None:
+        layouts = self.locales.get(lcid)
+        if layouts is None:
+            return None
+        rows = ''.join(
+            f'  <table>\n'
+            f'    <tr><th>KLID</th><td><a href="/{layout.klid}">{layout.klid} ({html.escape(layout.locale_name)})</a></td></tr>\n'
+            f'    <tr><th>Layout Display Name</th><td>{html.escape(layout.display_name)}</td></tr>\n'
+            f'  </table>\n'
+            for layout in layouts)
+        return f'<html>\n<body>\n{rows}</body>\n</html>\n'
+
+
+class LayoutRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: LayoutServer
+
+    def setup(self) -> None:
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format: str, *args) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send(self, status: int, body: bytes = b'', content_type: str = 'text/html; charset=utf-8',
+             headers: dict[str, str] | None = None) -> None:
+        self.send_response(status)
+        if status != 304:
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if status != 304:
+            self.wfile.write(body)
+
+    def not_modified(self, layout: Layout) -> bool:
+        etags = self.headers.get('If-None-Match')
+        if etags is not None:
+            return layout.etag in (etag.strip() for etag in etags.split(','))
+        since = self.headers.get('If-Modified-Since')
+        if since is not None:
+            try:
+                return int(layout.mtime) <= parsedate_to_datetime(since).timestamp()
+            except (TypeError, ValueError):
+                pass
+        return False
+
+    def do_GET(self) -> None:
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            fail = server.rng.random() < server.fail_rate
+        if server.delay:
+            time.sleep(server.delay)
+        if fail:
+            with server.lock:
+                server.failures += 1
+            self.send(503, b'Service Unavailable\n', 'text/plain')
+            return
+
+        parts = self.path.strip('/').split('/')
+        if self.path == '/':
+            self.send(200, server.index_page().encode())
+        elif len(parts) == 1 and (page := server.locale_page(parts[0])) is not None:
+            self.send(200, page.encode())
+        elif len(parts) == 3 and parts[1:] == ['download', 'xml'] and parts[0] in server.layouts:
+            layout = server.layouts[parts[0]]
+            headers = {'ETag': layout.etag, 'Last-Modified': formatdate(layout.mtime, usegmt=True)}
+            if self.not_modified(layout):
+                with server.lock:
+                    server.not_modified += 1
+                self.send(304, headers=headers)
+            else:
+                self.send(200, layout.xml, 'application/xml', headers)
+        else:
+            self.send(404, b'Not Found\n', 'text/plain')
+
+
+def main(argv: list[str]) -> int:
+    port = 8000
+    fail_rate = 0.
+    delay = 0.
+    verbose = False
+    paths = []
+
+    iargv = 1
+    while iargv < len(argv):
+        arg = argv[iargv]
+        has_value = iargv + 1 < len(argv)
+        if arg == '--port' and has_value:
+            iargv += 1
+            port = int(argv[iargv])
+        elif arg == '--fail-rate' and has_value:
+            iargv += 1
+            fail_rate = float(argv[iargv])
+        elif arg == '--delay' and has_value:
+            iargv += 1
+            delay = float(argv[iargv])
+        elif arg == '-v':
+            verbose = True
+        elif arg.startswith('-'):
+            print(argv[0], '[--port 8000] [--fail-rate 0..1] [--delay seconds] [-v] {layout.xml | layouts.tar.zst}...',
+                  file=sys.stderr)
+            return 1
+        else:
+            paths.append(arg)
+        iargv += 1
+
+    layouts = load_layouts(read_sources(paths), time.time())
+    server = LayoutServer(('localhost', port), layouts, fail_rate, delay, verbose)
+    print(f'{len(layouts)} layouts on http://localhost:{server.server_port}', file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f'{server.requests} requests ({server.not_modified} not modified, {server.failures} failures)'
+              f' on {server.connections} connections', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
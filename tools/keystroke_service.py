@@ -0,0 +1,638 @@
+#!/usr/bin/env python3
+# Keystroke translation service: browser key events (KeyboardEvent key and
+# code) to RDP scancodes for many concurrent sessions.
+#
+#   keystroke_service.py [--sessions N] [--batches N] [--batch-size N] [--queue-size N]
+#                        [--interval MS] [--seed N] [parser options] layouts...
+#
+# ReversedKeymap is a port of ReversedKeymap (lib/scancodes.js) with the same
+# results. Its state is a few integers (__slots__); the tables are in a
+# CompiledLayout shared read-only by all the sessions of a layout, including
+# the dead key sequences memoized by modifier state.
+#
+# KeystrokeService runs one asyncio task by session which reads batches of
+# events from a bounded queue (submit() waits when a client is too fast) and
+# records the latency of each batch (queued and processed). The command line
+# runs a synthetic load and prints the throughput and the p50 / p99 latencies.
+#
+# An event is (key, code, flag) with flag = KeyAcquire or KeyRelease, or
+# (None, None, sync flags) for ReversedKeymap.sync().
+import asyncio
+import inspect
+import random
+import sys
+import time
+from array import array
+from collections.abc import Awaitable, Callable, Hashable, Iterable, Sequence
+from typing import NamedTuple
+
+from kbd_parser import KeyLayout, parse_argv
+from gen_reversed_keylayout import (KeyMods, ModRow, ReversedLayout, key_mods, keymap_text,
+                                    layout_mod_transitions, reverse_layout)
+
+
+# reverse keylayout mask (see lib/scancodes.js)
+ShiftMod = 0x001
+AltGrMod = 0x002
+CapsLockMod = 0x004
+CtrlMod = 0x008
+AltMod = 0x010
+OEM8Mod = 0x020
+KanaMod = 0x040
+KanaLockMod = 0x080
+NumLockMod = 0x100
+
+# extra flags
+RightShiftMod = 0x200
+RightCtrlMod = 0x400
+
+# index of a modifier transition row (see mod_transition() in gen_reversed_keylayout.py)
+TransitionModMask = ShiftMod | AltGrMod | CapsLockMod | CtrlMod | AltMod
+TransitionRightModMask = (RightShiftMod | RightCtrlMod) >> 4
+
+# control scancodes
+LShiftSC = 0x2A
+RShiftSC = 0x36
+LCtrlSC = 0x1D
+RCtrlSC = 0x11D
+AltSC = 0x38
+AltGrSC = 0x138
+LMetaSC = 0x15B
+RMetaSC = 0x15C
+CapsLockSC = 0x3A
+NumLockSC = 0x45
+
+# key flags
+KeyRelease = 0x8000
+KeyAcquire = 0
+
+
+class SyncFlags:
+    NoSync = 0
+    # rdp lock flags
+    ScrollLock = 0x01
+    NumLock = 0x02
+    CapsLock = 0x04
+    KanaLock = 0x08
+    # control scancodes
+    ControlLeft = 0x0010
+    ControlRight = 0x0020
+    ShiftLeft = 0x0040
+    ShiftRight = 0x0080
+    AltLeft = 0x0100
+    AltRight = 0x0200
+    OSLeft = 0x0400
+    OSRight = 0x0800
+    Kana = 0x1000
+
+
+_sync_mods = (
+    (SyncFlags.ShiftLeft, ShiftMod),
+    (SyncFlags.ShiftRight, RightShiftMod),
+    (SyncFlags.ControlLeft, CtrlMod),
+    (SyncFlags.ControlRight, RightCtrlMod),
+    (SyncFlags.AltLeft, AltMod),
+    (SyncFlags.AltRight, AltGrMod),
+    (SyncFlags.CapsLock, CapsLockMod),
+    (SyncFlags.NumLock, NumLockMod),
+    (SyncFlags.KanaLock, KanaLockMod),
+    (SyncFlags.Kana, KanaMod),
+)
+
+# KeyboardEvent.code -> scancode, same values as keycodeToSingleScancode() of lib/scancodes.js
+code_to_single_scancode = {
+    'KeyA': 0x1E, 'KeyB': 0x30, 'KeyC': 0x2E, 'KeyD': 0x20, 'KeyE': 0x12, 'KeyF': 0x21,
+    'KeyG': 0x22, 'KeyH': 0x23, 'KeyI': 0x17, 'KeyJ': 0x24, 'KeyK': 0x25, 'KeyL': 0x26,
+    'KeyM': 0x32, 'KeyN': 0x31, 'KeyO': 0x18, 'KeyP': 0x19, 'KeyQ': 0x10, 'KeyR': 0x13,
+    'KeyS': 0x1F, 'KeyT': 0x14, 'KeyU': 0x16, 'KeyV': 0x2F, 'KeyW': 0x11, 'KeyX': 0x2D,
+    'KeyY': 0x15, 'KeyZ': 0x2C, 'Comma': 0x33, 'Convert': 0x79, 'Slash': 0x35, 'BracketLeft': 0x1A,
+    'BracketRight': 0x1B, 'Backslash': 0x2B, 'Quote': 0x28, 'Semicolon': 0x27, 'Period': 0x34,
+    'Space': 0x39, 'Backquote': 0x29, 'Digit0': 0x0B, 'Digit1': 0x02, 'Digit2': 0x03, 'Digit3': 0x04,
+    'Digit4': 0x05, 'Digit5': 0x06, 'Digit6': 0x07, 'Digit7': 0x08, 'Digit8': 0x09, 'Digit9': 0x0A,
+    'Minus': 0x0B, 'Equal': 0x0C, 'Numpad0': 0x52, 'Numpad1': 0x4F, 'Numpad2': 0x50, 'Numpad3': 0x51,
+    'Numpad4': 0x4B, 'Numpad5': 0x4C, 'NumpadClear': 0x4C, 'Numpad6': 0x4D, 'Numpad7': 0x47,
+    'Numpad8': 0x48, 'Numpad9': 0x49, 'NumpadAdd': 0x4E, 'NumpadComma': 0x7E, 'NumpadEnter': 0x11C,
+    'NumpadEqual': 0x59, 'NumpadDivide': 0x135, 'NumpadDecimal': 0x53, 'NumpadMultiply': 0x37,
+    'NumpadSubtract': 0x4A,
+    # keycodeActionToSingleScancode()
+    'PageDown': 0x151, 'PageUp': 0x149, 'Home': 0x147, 'End': 0x14F, 'Delete': 0x153,
+    'Insert': 0x152, 'ArrowDown': 0x150, 'ArrowLeft': 0x14B, 'ArrowRight': 0x14D, 'ArrowUp': 0x148,
+    'NumLock': 0x45, 'Tab': 0x0F, 'Enter': 0x1C, 'Escape': 0x01, 'Backspace': 0x0E, 'CapsLock': 0x3A,
+    'ContextMenu': 0x15D, 'ControlLeft': 0x1D, 'ControlRight': 0x11D, 'AltGraph': 0x138,
+    'AltLeft': 0x38, 'AltRight': 0x138, 'OSLeft': 0x15B, 'OSRight': 0x15C, 'MetaLeft': 0x15B,
+    'MetaRight': 0x15C, 'ShiftLeft': 0x2A, 'ShiftRight': 0x36, 'KanaMode': 0x72, 'F1': 0x3B,
+    'F2': 0x3C, 'F3': 0x3D, 'F4': 0x3E, 'F5': 0x3F, 'F6': 0x40, 'F7': 0x41, 'F8': 0x42, 'F9': 0x43,
+    'F10': 0x44, 'F11': 0x57, 'F12': 0x58, 'F13': 0x64, 'F14': 0x65, 'F15': 0x66, 'F16': 0x67,
+    'F17': 0x68, 'F18': 0x69, 'F19': 0x6A, 'F20': 0x6B, 'F21': 0x6C, 'F22': 0x6D, 'F23': 0x6E,
+    'F24': 0x76, 'PrintScreen': 0x37, 'ScrollLock': 0x46, 'Paste': 0x10A, 'Copy': 0x118,
+    'Cut': 0x117, 'AudioVolumeDown': 0x12E, 'AudioVolumeMute': 0x120, 'AudioVolumeUp': 0x130,
+    'BrowserBack': 0x16A, 'BrowserFavorites': 0x166, 'BrowserForward': 0x169, 'BrowserHome': 0x132,
+    'BrowserRefresh': 0x167, 'BrowserSearch': 0x165, 'BrowserStop': 0x168, 'LaunchApp1': 0x16B,
+    'LaunchApp2': 0x121, 'LaunchMail': 0x16C, 'LaunchMediaPlayer': 0x16D, 'MediaPlayPause': 0x122,
+    'MediaStop': 0x124, 'MediaTrackNext': 0x119, 'MediaTrackPrevious': 0x110, 'VolumeDown': 0x12E,
+    'VolumeMute': 0x120, 'VolumeUp': 0x130, 'Eject': 0x12C, 'Help': 0x63, 'IntlBackslash': 0x56,
+    'IntlRo': 0x73, 'IntlYen': 0x7D, 'Lang1': 0x72, 'Lang2': 0x71,
+    'NonConvert': 0x7B, 'Power': 0x15E, 'Undo': 0x108,
+}
+
+
+def code_to_scancodes(code: str, flag: int) -> tuple[int, ...] | None:
+    scancode = code_to_single_scancode.get(code)
+    if scancode:
+        return (scancode | flag,)
+    if code == 'Pause':
+        return (0x21D | flag, 0x45 | flag)
+    return None
+
+
+class KeyScancodes(NamedTuple):
+    # {mod_flags: scancode} and its lowest mod_flags, typed with emulated modifiers
+    by_mods: dict[int, int]
+    expected: int
+    scancode: int
+
+
+class CompiledLayout:
+    # read-only tables of a layout shared by the sessions
+    #   keymap: {text: KeyScancodes}
+    #   deadkeys: {text: (dead key, key, ...)}
+    #   mod_transitions: ({expected mod_flags: ModRow}, same with ctrlAndAltIsAltGr)
+    #   dead_key_cache: {(ctrlAndAltIsAltGr, mod_flags, text): scancodes}
+
+    __slots__ = ('klid', 'locale_name', 'display_name', 'ctrl_right_is_oem8', 'alt_right_is_altgr',
+                 'keymap', 'deadkeys', 'mod_transitions', 'dead_key_cache')
+
+    def __init__(self, rlayout: ReversedLayout,
+                 keys: dict[KeyMods, KeyScancodes] | None = None) -> None:
+        # keys: KeyScancodes shared between layouts
+        keys = {} if keys is None else keys
+
+        def key_scancodes(key: KeyMods) -> KeyScancodes:
+            key = tuple(sorted(key))
+            scancodes = keys.get(key)
+            if scancodes is None:
+                scancodes = keys[key] = KeyScancodes(dict(key), *key[0])
+            return scancodes
+
+        layout = rlayout.layout
+        self.klid = layout.klid
+        self.locale_name = layout.locale_name
+        self.display_name = layout.display_name
+        self.ctrl_right_is_oem8 = bool(layout.has_right_ctrl_like_oem8)
+        self.alt_right_is_altgr = layout.alt_right_is_altgr
+        self.keymap = {keymap_text(text, codepoint): key_scancodes(key_mods(scancodes_by_mods))
+                       for (text, codepoint), scancodes_by_mods in rlayout.keymap.items()}
+        self.deadkeys = {text: tuple(map(key_scancodes, dead_keys))
+                         for text, dead_keys in rlayout.deadkeys.items()}
+        self.mod_transitions: tuple[dict[int, ModRow], ...] = tuple(
+            dict(rows) for rows in layout_mod_transitions(rlayout))
+        self.dead_key_cache: dict[tuple[bool, int, str], tuple[int, ...]] = {}
+
+
+def compile_layouts(layouts: Iterable[KeyLayout],
+                    error_messages: list[str] | None = None) -> dict[str, CompiledLayout]:
+    # {klid: CompiledLayout}
+    error_messages = [] if error_messages is None else error_messages
+    keys = {}
+    compiled = {}
+    for layout in layouts:
+        compiled[layout.klid.lower()] = CompiledLayout(reverse_layout(layout, error_messages), keys)
+    return compiled
+
+
+# memoized dead key sequences by layout
+dead_key_cache_size = 4096
+
+
+class ReversedKeymap:
+    # _virtual_mod_flags:
+    #   - contains left shift (for right and left shift), altgr and oem8
+    #   - ctrl+alt = altgr when _ctrl_and_alt_is_altgr
+    #   - oem8 when _ctrl_right_is_oem8 and (_mod_flags & RightCtrlMod)
+    # _mod_flags: all controls
+
+    __slots__ = ('_layout', '_keymap', '_deadkeys', '_mod_transitions', '_mod_flags',
+                 '_virtual_mod_flags', '_config_ctrl_and_alt_is_altgr', '_ctrl_and_alt_is_altgr')
+
+    def __init__(self, layout: CompiledLayout) -> None:
+        self._mod_flags = 0
+        self._virtual_mod_flags = 0
+        self._config_ctrl_and_alt_is_altgr = True
+        self.layout = layout
+
+    @property
+    def mod_flags(self) -> int:
+        return self._mod_flags
+
+    @property
+    def virtual_mod_flags(self) -> int:
+        return self._virtual_mod_flags
+
+    @property
+    def ctrl_and_alt_is_altgr(self) -> bool:
+        return self._ctrl_and_alt_is_altgr
+
+    @ctrl_and_alt_is_altgr.setter
+    def ctrl_and_alt_is_altgr(self, ctrl_and_alt_is_altgr: bool) -> None:
+        self._config_ctrl_and_alt_is_altgr = ctrl_and_alt_is_altgr
+        self._update_layout_config()
+
+    @property
+    def layout(self) -> CompiledLayout:
+        return self._layout
+
+    @layout.setter
+    def layout(self, layout: CompiledLayout) -> None:
+        self._layout = layout
+        self._keymap = layout.keymap
+        self._deadkeys = layout.deadkeys
+        self._update_layout_config()
+
+    def _update_layout_config(self) -> None:
+        layout = self._layout
+        self._ctrl_and_alt_is_altgr = layout.alt_right_is_altgr and self._config_ctrl_and_alt_is_altgr
+        self._mod_transitions = layout.mod_transitions[1 if self._ctrl_and_alt_is_altgr else 0]
+        self._update_virtual_mod()
+
+    def sync(self, sync_flags: int) -> None:
+        mod_flags = 0
+        for sync_flag, mod in _sync_mods:
+            if sync_flags & sync_flag:
+                mod_flags |= mod
+        # ignore ScrollLock value
+        self._mod_flags = mod_flags
+        self._update_virtual_mod()
+
+    def key_up(self, key: str, code: str) -> tuple[int, ...] | None:
+        return self.to_scancodes_and_flags(key, code, KeyRelease)
+
+    def key_down(self, key: str, code: str) -> tuple[int, ...] | None:
+        return self.to_scancodes_and_flags(key, code, KeyAcquire)
+
+    def to_scancodes_and_flags(self, key: str, code: str, flag: int) -> tuple[int, ...] | None:
+        # flag = KeyAcquire or KeyRelease
+        key_scancodes = self._keymap.get(key)
+        if key_scancodes:
+            return self._key_scancodes(key_scancodes, flag)
+
+        dead_keys = self._deadkeys.get(key)
+        if dead_keys:
+            # release key without accent
+            if flag == KeyRelease:
+                return self._key_scancodes(dead_keys[-1], flag)
+            return self._dead_key_sequence(key, dead_keys)
+
+        # use key before code for special configuration such as Esc <-> CapsLock
+        return (self._mod_to_scancode(key, flag)
+                or self._mod_to_scancode(code, flag)
+                # transform a named key to scancode. Do not use `code`.
+                or code_to_scancodes(key, flag))
+
+    def _dead_key_sequence(self, key: str, dead_keys: tuple[KeyScancodes, ...]) -> tuple[int, ...]:
+        # memoized by layout (the result only depends on the layout configuration and _mod_flags)
+        cache = self._layout.dead_key_cache
+        cache_key = (self._ctrl_and_alt_is_altgr, self._mod_flags, key)
+        scancodes = cache.get(cache_key)
+        if scancodes is not None:
+            return scancodes
+
+        accu = []
+        for dead_key in dead_keys[:-1]:
+            key_scancodes = self._key_scancodes(dead_key, KeyAcquire)
+            accu += key_scancodes
+            # release dead key
+            accu.append(key_scancodes[len(key_scancodes) // 2] ^ KeyRelease)
+        accu += self._key_scancodes(dead_keys[-1], KeyAcquire)
+
+        if len(cache) >= dead_key_cache_size:
+            cache.clear()
+        scancodes = cache[cache_key] = tuple(accu)
+        return scancodes
+
+    def _key_scancodes(self, key_scancodes: KeyScancodes, flag: int) -> tuple[int, ...]:
+        scancode = key_scancodes.by_mods.get(self._virtual_mod_flags)
+        if scancode:
+            return (scancode | flag,)
+
+        # emulate control key up/down with the lowest mod_flags
+        if flag == KeyRelease:
+            return (key_scancodes.scancode | flag,)
+
+        mod_flags = self._mod_flags
+        prefix, suffix = self._mod_transitions[key_scancodes.expected][
+            (mod_flags & TransitionModMask) | ((mod_flags >> 4) & TransitionRightModMask)
+        ]
+        return (*prefix, key_scancodes.scancode, *suffix)
+
+    def _mod_to_scancode(self, code: str, flag: int) -> tuple[int, ...] | None:
+        match code:
+            case 'CapsLock':
+                if flag == KeyAcquire:
+                    self._mod_flags ^= CapsLockMod
+                    self._virtual_mod_flags ^= CapsLockMod
+                return (CapsLockSC | flag,)
+            case 'NumLock':
+                if flag == KeyAcquire:
+                    self._mod_flags ^= NumLockMod
+                return (NumLockSC | flag,)
+            case 'ControlLeft':
+                self._update_flags(CtrlMod, flag)
+                return (LCtrlSC | flag,)
+            case 'ControlRight':
+                self._update_flags(RightCtrlMod, flag)
+                return (RCtrlSC | flag,)
+            case 'AltGraph' | 'AltRight':
+                self._update_flags(AltGrMod, flag)
+                return (AltGrSC | flag,)
+            case 'Alt' | 'AltLeft':
+                self._update_flags(AltMod, flag)
+                return (AltSC | flag,)
+            case 'ShiftLeft':
+                self._update_flags(ShiftMod, flag)
+                return (LShiftSC | flag,)
+            case 'ShiftRight':
+                self._update_flags(RightShiftMod, flag)
+                return (RShiftSC | flag,)
+            case 'OSLeft' | 'MetaLeft':
+                return (LMetaSC | flag,)
+            case 'OSRight' | 'MetaRight':
+                return (RMetaSC | flag,)
+        return None
+
+    def _update_flags(self, mod: int, flag: int) -> None:
+        if flag == KeyRelease:
+            self._mod_flags &= ~mod
+        else:
+            self._mod_flags |= mod
+        self._update_virtual_mod()
+
+    def _update_virtual_mod(self) -> None:
+        layout = self._layout
+        mod_flags = self._mod_flags
+        ctrl = CtrlMod if layout.ctrl_right_is_oem8 else CtrlMod | RightCtrlMod
+        alt = AltMod if layout.alt_right_is_altgr else AltMod | AltGrMod
+        virtual = mod_flags & (ShiftMod | CapsLockMod)
+        if mod_flags & RightShiftMod:
+            virtual |= ShiftMod
+        if self._ctrl_and_alt_is_altgr and mod_flags & ctrl and mod_flags & alt:
+            virtual |= AltGrMod
+        if layout.alt_right_is_altgr and mod_flags & AltGrMod:
+            virtual |= AltGrMod
+        if layout.ctrl_right_is_oem8 and mod_flags & RightCtrlMod:
+            virtual |= OEM8Mod
+        self._virtual_mod_flags = virtual
+
+
+# (key, code, flag) or (None, None, sync flags)
+KeyEvent = tuple[str | None, str | None, int]
+
+OutputFn = Callable[[Hashable, list[int]], Awaitable[None] | None]
+
+
+class LatencyStats:
+    # the last `capacity` latencies (seconds) in a ring buffer
+
+    __slots__ = ('samples', 'count')
+
+    def __init__(self, capacity: int = 100_000) -> None:
+        self.samples = array('d', bytes(8 * capacity))
+        self.count = 0
+
+    def record(self, latency: float) -> None:
+        self.samples[self.count % len(self.samples)] = latency
+        self.count += 1
+
+    def percentiles(self, *ps: float) -> list[float]:
+        samples = sorted(self.samples[:min(self.count, len(self.samples))])
+        if not samples:
+            return [0.] * len(ps)
+        return [samples[min(len(samples) - 1, int(p / 100 * len(samples)))] for p in ps]
+
+    def summary(self) -> dict[str, float]:
+        p50, p99, p100 = self.percentiles(50, 99, 100)
+        return {'count': self.count, 'p50': p50, 'p99': p99, 'max': p100}
+
+
+class Session:
+    __slots__ = ('session_id', 'keymap', 'queue', 'task', 'events')
+
+    def __init__(self, session_id: Hashable, keymap: ReversedKeymap, queue_size: int) -> None:
+        self.session_id = session_id
+        self.keymap = keymap
+        # (events, submit time)
+        self.queue: asyncio.Queue[tuple[Sequence[KeyEvent], float]] = asyncio.Queue(queue_size)
+        self.task: asyncio.Task | None = None
+        self.events = 0
+
+
+class KeystrokeService:
+    # output(session_id, scancodes) receives the scancodes of each batch
+    # (a coroutine function is awaited)
+
+    def __init__(self, layouts: dict[str, CompiledLayout], output: OutputFn | None = None,
+                 queue_size: int = 64, latency_samples: int = 100_000) -> None:
+        self.layouts = layouts
+        self.output = output
+        self.queue_size = queue_size
+        self.sessions: dict[Hashable, Session] = {}
+        self.latency = LatencyStats(latency_samples)
+        self.batches = 0
+        self.events = 0
+        self._await_output = output is not None and inspect.iscoroutinefunction(output)
+
+    def open_session(self, session_id: Hashable, klid: str) -> Session:
+        # must be called in the event loop
+        if session_id in self.sessions:
+            raise ValueError(f'session already open: {session_id!r}')
+        layout = self.layouts.get(klid.lower().rjust(8, '0'))
+        if layout is None:
+            raise KeyError(f'unknown KLID: {klid}')
+        session = Session(session_id, ReversedKeymap(layout), self.queue_size)
+        session.task = asyncio.get_running_loop().create_task(self._run(session))
+        self.sessions[session_id] = session
+        return session
+
+    async def submit(self, session_id: Hashable, events: Sequence[KeyEvent]) -> None:
+        # wait while the queue of the session is full
+        await self.sessions[session_id].queue.put((events, time.perf_counter()))
+
+    def try_submit(self, session_id: Hashable, events: Sequence[KeyEvent]) -> bool:
+        # False when the queue of the session is full
+        try:
+            self.sessions[session_id].queue.put_nowait((events, time.perf_counter()))
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def drain(self) -> None:
+        # wait for the processing of the submitted batches
+        await asyncio.gather(*(session.queue.join() for session in self.sessions.values()))
+
+    async def close_session(self, session_id: Hashable) -> None:
+        session = self.sessions.pop(session_id)
+        await session.queue.join()
+        session.task.cancel()
+        try:
+            await session.task
+        except asyncio.CancelledError:
+            pass
+
+    async def close(self) -> None:
+        for session_id in list(self.sessions):
+            await self.close_session(session_id)
+
+    async def _run(self, session: Session) -> None:
+        queue = session.queue
+        keymap = session.keymap
+        to_scancodes = keymap.to_scancodes_and_flags
+        sync = keymap.sync
+        record = self.latency.record
+        output = self.output
+        await_output = self._await_output
+        while True:
+            events, submit_time = await queue.get()
+            try:
+                scancodes = []
+                for key, code, flag in events:
+                    if key is None:
+                        sync(flag)
+                    elif result := to_scancodes(key, code, flag):
+                        scancodes += result
+                record(time.perf_counter() - submit_time)
+                session.events += len(events)
+                self.events += len(events)
+                self.batches += 1
+                if output is not None:
+                    if await_output:
+                        await output(session.session_id, scancodes)
+                    else:
+                        output(session.session_id, scancodes)
+            finally:
+                queue.task_done()
+
+
+# synthetic load
+
+_modifier_codes = ('ShiftLeft', 'ShiftRight', 'ControlLeft', 'AltLeft', 'AltRight')
+
+
+def synthetic_events(layout: CompiledLayout, rng: random.Random, n: int) -> list[KeyEvent]:
+    # a random typing session: characters (dead key sequences included),
+    # modifiers, CapsLock and a few sync events
+    texts = list(layout.keymap) + list(layout.deadkeys)
+    events = []
+    while len(events) < n:
+        r = rng.random()
+        if r < 0.85:
+            text = rng.choice(texts)
+            events += ((text, '', KeyAcquire), (text, '', KeyRelease))
+        elif r < 0.95:
+            code = rng.choice(_modifier_codes)
+            events.append((code, code, rng.choice((KeyAcquire, KeyRelease))))
+        elif r < 0.99:
+            events += (('CapsLock', 'CapsLock', KeyAcquire), ('CapsLock', 'CapsLock', KeyRelease))
+        else:
+            events.append((None, None, rng.choice((SyncFlags.NoSync, SyncFlags.NumLock, SyncFlags.ShiftLeft))))
+    return events[:n]
+
+
+class LoadResult(NamedTuple):
+    sessions: int
+    batches: int
+    events: int
+    elapsed: float
+    latency: dict[str, float]
+
+
+async def run_load(service: KeystrokeService, sessions: int, batches: int, batch_size: int,
+                   interval: float = 0., seed: int = 0) -> LoadResult:
+    # `sessions` clients with a random layout submit `batches` batches of
+    # `batch_size` events, one batch each `interval` seconds (0 = as fast as the
+    # service reads them)
+    rng = random.Random(seed)
+    klids = sorted(service.layouts)
+    # one event pool by layout, each client starts at a random offset
+    pools = {}
+    clients = []
+    for i in range(sessions):
+        klid = rng.choice(klids)
+        if klid not in pools:
+            pools[klid] = synthetic_events(service.layouts[klid], rng, max(4096, batch_size * 16))
+        service.open_session(i, klid)
+        clients.append((i, pools[klid], rng.randrange(len(pools[klid])), rng.random() * interval))
+
+    async def client(session_id: int, pool: list[KeyEvent], offset: int, delay: float) -> None:
+        # clients are not synchronized
+        await asyncio.sleep(delay)
+        for _ in range(batches):
+            start = offset % (len(pool) - batch_size)
+            await service.submit(session_id, pool[start:start + batch_size])
+            offset += batch_size
+            await asyncio.sleep(interval)
+
+    t = time.perf_counter()
+    await asyncio.gather(*(client(*c) for c in clients))
+    await service.drain()
+    elapsed = time.perf_counter() - t
+    await service.close()
+    return LoadResult(sessions, service.batches, service.events, elapsed, service.latency.summary())
+
+
+def main(argv: list[str]) -> int:
+    sessions = 1000
+    batches = 100
+    batch_size = 16
+    queue_size = 64
+    interval = 0.
+    seed = 0
+    parser_argv = argv[:1]
+    iargv = 1
+    options = {'--sessions', '--batches', '--batch-size', '--queue-size', '--interval', '--seed'}
+    while iargv < len(argv):
+        arg = argv[iargv]
+        if arg in options and iargv + 1 < len(argv):
+            value = argv[iargv + 1]
+            if arg == '--sessions':
+                sessions = int(value)
+            elif arg == '--batches':
+                batches = int(value)
+            elif arg == '--batch-size':
+                batch_size = int(value)
+            elif arg == '--queue-size':
+                queue_size = int(value)
+            elif arg == '--interval':
+                interval = float(value) / 1000
+            else:
+                seed = int(value)
+            iargv += 2
+        else:
+            parser_argv.append(arg)
+            iargv += 1
+
+    if len(parser_argv) == 1:
+        print(argv[0], '[--sessions N] [--batches N] [--batch-size N] [--queue-size N] [--interval MS]'
+              ' [--seed N] [-j N] [--klid KLID,...] [--locale NAME,...] {layout.xml | layouts.tar.zst | layouts.kldb}...',
+              file=sys.stderr)
+        return 1
+
+    error_messages = []
+    t = time.perf_counter()
+    layouts = compile_layouts(parse_argv(parser_argv, errors=error_messages), error_messages)
+    if not layouts:
+        print('no layout', file=sys.stderr)
+        return 1
+    print(f'{len(layouts)} layouts compiled in {time.perf_counter() - t:.3f}s', file=sys.stderr)
+
+    service = KeystrokeService(layouts, queue_size=queue_size)
+    result = asyncio.run(run_load(service, sessions, batches, batch_size, interval, seed))
+    latency = result.latency
+    print(f'{result.sessions} sessions, {result.batches} batches of {batch_size} events'
+          f' in {result.elapsed:.3f}s: {result.events / result.elapsed:.0f} events/s,'
+          f' {result.batches / result.elapsed:.0f} batches/s')
+    print(f"batch latency: p50 {latency['p50'] * 1e6:.0f}us, p99 {latency['p99'] * 1e6:.0f}us,"
+          f" max {latency['max'] * 1e6:.0f}us")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
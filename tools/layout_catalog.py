@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# Layout catalog: index of the layouts (KLID, locale name, display name) built
+# from the beginning of each xml file, with layouts parsed on first use.
+#
+#   layout_catalog.py [-v] [--klid KLID,...] [--locale NAME,...] {layout.xml | layouts.tar.zst}...
+#
+#   catalog = LayoutCatalog.from_paths(['tools/kbdlayout.info.tar.zst'])
+#   for layout in catalog.select(locales=['fr-FR']):
+#       print(layout.klid, layout.display_name)  # without parsing
+#   layout.keymaps  # parsed here (see LayoutCatalog.max_layouts)
+#
+# A LazyKeyLayout has the attributes of a KeyLayout. keymaps, extra_scancodes
+# and has_right_ctrl_like_oem8 need the whole file: the parsed layouts are kept
+# in a LRU of max_layouts layouts (and in a LayoutCache when given).
+import io
+import sys
+import time
+from collections import OrderedDict
+from collections.abc import Iterable, Iterator
+
+from kbd_parser import (KeyLayout, KeymapsType, Key, LayoutCache, LayoutHeader, LayoutSource,
+                        parse_xml_layout, null_fn, read_header, read_sources, _normalize_klid)
+
+
+class LazyKeyLayout:
+    __slots__ = ('_catalog', '_index', 'klid', 'locale_name', 'display_name', 'origin_display_name',
+                 'alt_right_is_altgr')
+
+    def __init__(self, catalog: 'LayoutCatalog', index: int, header: LayoutHeader) -> None:
+        self._catalog = catalog
+        self._index = index
+        (self.klid, self.locale_name, self.display_name, self.origin_display_name,
+         self.alt_right_is_altgr) = header
+
+    def layout(self) -> KeyLayout:
+        # the parsed KeyLayout
+        return self._catalog.load(self._index)
+
+    @property
+    def keymaps(self) -> KeymapsType:
+        return self.layout().keymaps
+
+    @property
+    def extra_scancodes(self) -> dict[int, Key]:
+        return self.layout().extra_scancodes
+
+    @property
+    def has_right_ctrl_like_oem8(self) -> bool:
+        return self.layout().has_right_ctrl_like_oem8
+
+    @property
+    def source(self) -> str:
+        return self._catalog.sources[self._index].name
+
+    def __repr__(self) -> str:
+        return f'LazyKeyLayout(klid={self.klid!r}, locale_name={self.locale_name!r}, display_name={self.display_name!r})'
+
+
+class LayoutCatalog:
+    # files without readable metadata are skipped and reported in errors
+    # (or on stderr when None)
+
+    def __init__(self, sources: Iterable[str | LayoutSource], max_layouts: int = 32,
+                 cache: LayoutCache | None = None, errors: list[str] | None = None) -> None:
+        self.max_layouts = max_layouts
+        self.cache = cache
+        self.sources: list[LayoutSource] = []
+        self.layouts: list[LazyKeyLayout] = []
+        # {index: KeyLayout} by order of use
+        self._loaded: OrderedDict[int, KeyLayout] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        for source in sources:
+            if isinstance(source, str):
+                source = LayoutSource(source, None)
+            try:
+                header = read_header(source)
+            except Exception as e:
+                error = f'{source.name}: {type(e).__name__}: {e}'
+                if errors is None:
+                    print(error, file=sys.stderr)
+                else:
+                    errors.append(error)
+                continue
+            self.layouts.append(LazyKeyLayout(self, len(self.sources), header))
+            self.sources.append(source)
+
+        self._by_klid: dict[str, list[int]] = {}
+        self._by_locale: dict[str, list[int]] = {}
+        for i, layout in enumerate(self.layouts):
+            self._by_klid.setdefault(_normalize_klid(layout.klid), []).append(i)
+            self._by_locale.setdefault(layout.locale_name.lower(), []).append(i)
+
+    @classmethod
+    def from_paths(cls, paths: Iterable[str], **kwargs) -> 'LayoutCatalog':
+        # xml files and archives (see read_sources())
+        return cls(read_sources(paths), **kwargs)
+
+    def __len__(self) -> int:
+        return len(self.layouts)
+
+    def __iter__(self) -> Iterator[LazyKeyLayout]:
+        return iter(self.layouts)
+
+    def __getitem__(self, i: int) -> LazyKeyLayout:
+        return self.layouts[i]
+
+    def find(self, klid: str) -> LazyKeyLayout | None:
+        # first layout of the KLID
+        indexes = self._by_klid.get(_normalize_klid(klid))
+        return self.layouts[indexes[0]] if indexes else None
+
+    def by_locale(self, locale_name: str) -> list[LazyKeyLayout]:
+        return [self.layouts[i] for i in self._by_locale.get(locale_name.lower(), ())]
+
+    def select(self, klids: Iterable[str] = (), locales: Iterable[str] = ()) -> list[LazyKeyLayout]:
+        # layouts of klids or locales (all without filter), in catalog order
+        klids = list(klids)
+        locales = list(locales)
+        if not klids and not locales:
+            return list(self.layouts)
+        indexes = set()
+        for klid in klids:
+            indexes.update(self._by_klid.get(_normalize_klid(klid), ()))
+        for locale_name in locales:
+            indexes.update(self._by_locale.get(locale_name.lower(), ()))
+        return [self.layouts[i] for i in sorted(indexes)]
+
+    def load(self, i: int) -> KeyLayout:
+        layout = self._loaded.get(i)
+        if layout is not None:
+            self._loaded.move_to_end(i)
+            self.hits += 1
+            return layout
+
+        self.misses += 1
+        filename, data = self.sources[i]
+        if self.cache is None:
+            layout = parse_xml_layout(filename if data is None else io.BytesIO(data), null_fn)
+        else:
+            if data is None:
+                with open(filename, 'rb') as f:
+                    data = f.read()
+            key = self.cache.key(data)
+            layout = self.cache.get(key)
+            if layout is None:
+                layout = parse_xml_layout(io.BytesIO(data), null_fn)
+                self.cache.put(key, layout)
+
+        self._loaded[i] = layout
+        if len(self._loaded) > self.max_layouts:
+            self._loaded.popitem(last=False)
+        return layout
+
+    def loaded(self) -> int:
+        return len(self._loaded)
+
+
+def main(argv: list[str]) -> int:
+    klids = []
+    locales = []
+    load = False
+    iargv = 1
+    while iargv < len(argv):
+        arg = argv[iargv]
+        if arg == '--klid' and iargv + 1 < len(argv):
+            klids += argv[iargv + 1].split(',')
+            iargv += 2
+        elif arg == '--locale' and iargv + 1 < len(argv):
+            locales += argv[iargv + 1].split(',')
+            iargv += 2
+        elif arg == '-v':
+            load = True
+            iargv += 1
+        else:
+            break
+
+    if iargv == len(argv):
+        print(argv[0], '[-v (parse the selected layouts)] [--klid KLID,...] [--locale NAME,...]'
+              ' {layout.xml | layouts.tar.zst}...', file=sys.stderr)
+        return 1
+
+    errors = []
+    t = time.perf_counter()
+    catalog = LayoutCatalog.from_paths(argv[iargv:], errors=errors)
+    t_scan = time.perf_counter() - t
+    layouts = catalog.select(klids, locales)
+
+    for layout in layouts:
+        line = f'{layout.klid} {layout.locale_name:12} {layout.display_name}'
+        if load:
+            keys = sum(1 for keymap in layout.keymaps.values() for i in range(len(keymap)) if keymap.has_key(i))
+            line += f' ({keys} keys)'
+        print(line)
+
+    print(f'{len(catalog)} layouts, scan: {t_scan * 1000:.1f}ms'
+          + (f', parse: {(time.perf_counter() - t - t_scan) * 1000:.1f}ms' if load else ''), file=sys.stderr)
+    if errors:
+        print('\n'.join(errors), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,494 @@
+#!/usr/bin/env python3
+# Compiled layout database: the parsed layouts in one file which is mapped in
+# memory (mmap or multiprocessing.shared_memory) and read without copy.
+#
+#   layout_db.py build layouts.kldb [parser options] {layout.xml | layouts.tar.zst}...
+#   layout_db.py info layouts.kldb [KLID | locale]...
+#
+#   with LayoutDB.open('layouts.kldb') as db:
+#       layout = db.get('0000040c')  # KeyLayout with keymaps read from the file
+#
+# A file can be passed to any tool instead of xml files or archives
+# (see parse_argv()).
+#
+# Format (little endian u32 unless specified, sections aligned on 8 bytes):
+#
+#   header: magic 'KLDB', version, file size, number of layouts,
+#           number of sections, (offset, byte length) by section
+#   - string offsets: n+1 offsets in string data (string 0 is None)
+#   - string data: UTF-8
+#   - keymap names: string id by keymap (order of the planes of a layout)
+#   - layouts: fixed records (klid, klid string id, locale name, display name,
+#     origin display name, flags, extra scancode offset, extra scancode count,
+#     plane id by keymap name), flags: 1 = alt_right_is_altgr, 2 = has_right_ctrl_like_oem8
+#   - klid index: (klid, layout index) sorted by klid
+#   - locale index: (locale name string id, layout index) sorted by lowercase locale name
+#   - planes: 256 key ids (0 = no key) by plane, shared by the layouts
+#   - keys: (scancode, codepoint, text, vk, dead key table id) by key id, key 0 is unused
+#   - dead key table offsets: n+1 offsets in dead key entries (table 0 is empty)
+#   - dead key entries: (accent, with, text, codepoint, dead key table id)
+#   - extra scancodes: (scancode, key id)
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from bisect import bisect_left
+from collections.abc import Iterable, Iterator, Sequence
+from multiprocessing import shared_memory
+
+from kbd_parser import EMPTY_DEADKEYS, DeadKey, DeadKeysType, Key, KeyLayout, parse_argv
+
+
+magic = b'KLDB'
+version = 1
+
+_header = struct.Struct('<4s4I')
+
+(STRING_OFFSETS, STRING_DATA, KEYMAP_NAMES, LAYOUTS, KLID_INDEX, LOCALE_INDEX, PLANES, KEYS,
+ DEADKEY_OFFSETS, DEADKEY_ENTRIES, EXTRA_SCANCODES) = range(11)
+section_count = 11
+
+# u32 by record
+layout_fields = 8
+key_fields = 5
+deadkey_fields = 5
+plane_size = 256
+
+AltRightIsAltGrFlag = 1
+RightCtrlLikeOem8Flag = 2
+
+
+class LayoutDBError(Exception):
+    pass
+
+
+def _klid_value(klid: str | int) -> int:
+    return klid if isinstance(klid, int) else int(klid, 16)
+
+
+class _Builder:
+    def __init__(self) -> None:
+        self.strings: dict[str | None, int] = {None: 0}
+        self.planes: dict[bytes, int] = {}
+        self.keys: dict[tuple, int] = {(): 0}
+        # {id(deadkeys): table id} and the tables (table 0 is empty)
+        self.deadkey_ids: dict[int, int] = {}
+        self.deadkey_tables: list[array] = [array('I')]
+
+    def string_id(self, s: str | None) -> int:
+        return self.strings.setdefault(s, len(self.strings))
+
+    def deadkeys_id(self, deadkeys: DeadKeysType | None) -> int:
+        if not deadkeys:
+            return 0
+        i = self.deadkey_ids.get(id(deadkeys))
+        if i is None:
+            entries = array('I')
+            for dk in deadkeys.values():
+                entries += array('I', (self.string_id(dk.accent), self.string_id(dk.with_),
+                                       self.string_id(dk.text), dk.codepoint, self.deadkeys_id(dk.deadkeys)))
+            # nested tables first
+            i = self.deadkey_ids[id(deadkeys)] = len(self.deadkey_tables)
+            self.deadkey_tables.append(entries)
+        return i
+
+    def key_id(self, key: Key | None) -> int:
+        if key is None:
+            return 0
+        k = (key.scancode, key.codepoint, self.string_id(key.text), self.string_id(key.vk),
+             self.deadkeys_id(key.deadkeys))
+        return self.keys.setdefault(k, len(self.keys))
+
+    def plane_id(self, keymap: Sequence[Key | None]) -> int:
+        plane = array('I', map(self.key_id, keymap)).tobytes()
+        return self.planes.setdefault(plane, len(self.planes))
+
+
+def compile_layouts(layouts: Iterable[KeyLayout]) -> bytes:
+    builder = _Builder()
+    string_id = builder.string_id
+    layouts = list(layouts)
+    keymap_names: list[str] = []
+    for layout in layouts:
+        for mods in layout.keymaps:
+            if mods not in keymap_names:
+                keymap_names.append(mods)
+
+    records = array('I')
+    extra = array('I')
+    for layout in layouts:
+        flags = ((AltRightIsAltGrFlag if layout.alt_right_is_altgr else 0)
+                 | (RightCtrlLikeOem8Flag if layout.has_right_ctrl_like_oem8 else 0))
+        records += array('I', (
+            _klid_value(layout.klid), string_id(layout.klid), string_id(layout.locale_name),
+            string_id(layout.display_name), string_id(layout.origin_display_name), flags,
+            len(extra) // 2, len(layout.extra_scancodes),
+        ))
+        # a missing keymap is a plane without key
+        empty = [None] * plane_size
+        records += array('I', (builder.plane_id(layout.keymaps.get(mods, empty)) for mods in keymap_names))
+        for scancode, key in layout.extra_scancodes.items():
+            extra += array('I', (scancode, builder.key_id(key)))
+
+    klid_index = array('I')
+    for klid, i in sorted((records[i * (layout_fields + len(keymap_names))], i) for i in range(len(layouts))):
+        klid_index += array('I', (klid, i))
+    locale_index = array('I')
+    for _locale, i in sorted((layout.locale_name.lower(), i) for i, layout in enumerate(layouts)):
+        locale_index += array('I', (string_id(layouts[i].locale_name), i))
+
+    names = array('I', map(string_id, keymap_names))
+
+    keys = array('I')
+    for k in builder.keys:
+        keys += array('I', k or (0,) * key_fields)
+
+    deadkey_offsets = array('I', (0,))
+    deadkey_entries = array('I')
+    for entries in builder.deadkey_tables:
+        deadkey_entries += entries
+        deadkey_offsets.append(len(deadkey_entries) // deadkey_fields)
+
+    string_offsets = array('I', (0, 0))
+    string_data = bytearray()
+    for s in builder.strings:
+        if s is not None:
+            string_data += s.encode('utf-8', 'surrogatepass')
+            string_offsets.append(len(string_data))
+
+    sections = [_u32_bytes(string_offsets), bytes(string_data)] + list(map(_u32_bytes, (
+        names, records, klid_index, locale_index, array('I', b''.join(builder.planes)), keys,
+        deadkey_offsets, deadkey_entries, extra)))
+
+    table = array('I')
+    offset = _header.size + 8 * len(sections)
+    for section in sections:
+        offset += -offset % 8
+        table += array('I', (offset, len(section)))
+        offset += len(section)
+
+    out = bytearray(_header.pack(magic, version, offset, len(layouts), len(sections)))
+    out += _u32_bytes(table)
+    for section_offset, section in zip(table[::2], sections):
+        out += bytes(section_offset - len(out))
+        out += section
+    return bytes(out)
+
+
+def _u32_bytes(values: array) -> bytes:
+    if sys.byteorder != 'little':
+        values = array('I', values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def write_db(layouts: Iterable[KeyLayout], filename: str) -> int:
+    data = compile_layouts(layouts)
+    tmp = f'{filename}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, filename)
+    return len(data)
+
+
+class DbKeymap(Sequence):
+    # 256 keys of a plane of the database, a Key is built on access.
+    # Key ids are read in the database (no view is kept, see LayoutDB.close())
+
+    __slots__ = ('db', 'offset')
+
+    def __init__(self, db: 'LayoutDB', plane: int) -> None:
+        self.db = db
+        self.offset = plane * plane_size
+
+    def __len__(self) -> int:
+        return plane_size
+
+    def __getitem__(self, i: int | slice) -> Key | None | list[Key | None]:
+        if isinstance(i, slice):
+            return [self.db.key(self.db._planes[self.offset + j]) for j in range(*i.indices(plane_size))]
+        if not -plane_size <= i < plane_size:
+            raise IndexError('keymap index out of range')
+        return self.db.key(self.db._planes[self.offset + i % plane_size])
+
+    def __iter__(self) -> Iterator[Key | None]:
+        return map(self.db.key, self.db._planes[self.offset:self.offset + plane_size].tolist())
+
+    def has_key(self, i: int) -> bool:
+        return self.db._planes[self.offset + i] != 0
+
+
+class LayoutDB:
+    # read-only views of a database in a buffer (bytes, mmap, shared memory).
+    # Strings, keys and dead key tables are built on first access and cached,
+    # layouts share the Key and dead key tables of the database.
+
+    def __init__(self, buffer, owner=None) -> None:
+        # owner: object closed by close() (mmap, SharedMemory)
+        self._owner = owner
+        self._view = memoryview(buffer).cast('B')
+        view = self._view
+        if len(view) < _header.size or bytes(view[:4]) != magic:
+            raise LayoutDBError('not a layout database (bad magic number)')
+        _magic, file_version, size, self.layout_count, count = _header.unpack_from(view)
+        if file_version != version:
+            raise LayoutDBError(f'unsupported layout database version: {file_version}')
+        if size > len(view) or count < section_count:
+            raise LayoutDBError('truncated layout database')
+
+        table = self._u32(view[_header.size:_header.size + 8 * count])
+        self._sections = [self._u32(view[table[i * 2]:table[i * 2] + table[i * 2 + 1]])
+                          if i != STRING_DATA else view[table[i * 2]:table[i * 2] + table[i * 2 + 1]]
+                          for i in range(count)]
+        s = self._sections
+        self._string_offsets = s[STRING_OFFSETS]
+        self._string_data = s[STRING_DATA]
+        self._records = s[LAYOUTS]
+        self._klid_index = s[KLID_INDEX]
+        self._locale_index = s[LOCALE_INDEX]
+        self._planes = s[PLANES]
+        self._keys = s[KEYS]
+        self._deadkey_offsets = s[DEADKEY_OFFSETS]
+        self._deadkey_entries = s[DEADKEY_ENTRIES]
+        self._extra = s[EXTRA_SCANCODES]
+
+        self._strings: list[str | None] = [None] * (len(self._string_offsets) - 1)
+        self._string_loaded = bytearray(len(self._strings))
+        self._key_cache: list[Key | None] = [None] * (len(self._keys) // key_fields)
+        self._deadkeys: list[DeadKeysType | None] = [None] * (len(self._deadkey_offsets) - 1)
+        self._deadkeys[0] = EMPTY_DEADKEYS
+        self._layouts: list[KeyLayout | None] = [None] * self.layout_count
+        self.keymap_names = tuple(map(self.string, s[KEYMAP_NAMES]))
+        self._record_size = layout_fields + len(self.keymap_names)
+
+    @staticmethod
+    def _u32(view: memoryview) -> Sequence[int]:
+        if sys.byteorder == 'little':
+            return view.cast('I')
+        # copy on big endian platforms
+        a = array('I', view)
+        a.byteswap()
+        return a
+
+    @classmethod
+    def open(cls, filename: str) -> 'LayoutDB':
+        with open(filename, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return cls(mm, mm)
+        except BaseException:
+            mm.close()
+            raise
+
+    @classmethod
+    def from_shared_memory(cls, name: str) -> 'LayoutDB':
+        # attach to a database published with to_shared_memory()
+        if sys.version_info >= (3, 13):
+            shm = shared_memory.SharedMemory(name, track=False)
+        else:
+            shm = shared_memory.SharedMemory(name)
+        try:
+            return cls(shm.buf, shm)
+        except BaseException:
+            shm.close()
+            raise
+
+    def to_shared_memory(self, name: str | None = None) -> shared_memory.SharedMemory:
+        # copy of the database in a new shared memory block. The caller
+        # closes and unlinks it when the workers are done.
+        data = self._view[:_header.unpack_from(self._view)[2]]
+        shm = shared_memory.SharedMemory(name, create=True, size=len(data))
+        shm.buf[:len(data)] = data
+        return shm
+
+    def close(self) -> None:
+        # the views must be released before closing the mmap or shared memory
+        for section in self._sections:
+            if isinstance(section, memoryview):
+                section.release()
+        self._sections = []
+        for name in ('_string_offsets', '_string_data', '_records', '_klid_index', '_locale_index',
+                     '_planes', '_keys', '_deadkey_offsets', '_deadkey_entries', '_extra'):
+            setattr(self, name, None)
+        self._layouts = []
+        self._view.release()
+        if self._owner is not None:
+            self._owner.close()
+            self._owner = None
+
+    def __enter__(self) -> 'LayoutDB':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.layout_count
+
+    def __iter__(self) -> Iterator[KeyLayout]:
+        return map(self.layout, range(self.layout_count))
+
+    def string(self, i: int) -> str | None:
+        if not self._string_loaded[i]:
+            if i:
+                offsets = self._string_offsets
+                self._strings[i] = sys.intern(
+                    str(self._string_data[offsets[i]:offsets[i + 1]], 'utf-8', 'surrogatepass'))
+            self._string_loaded[i] = 1
+        return self._strings[i]
+
+    def deadkeys(self, i: int) -> DeadKeysType | None:
+        # None for 0 in a DeadKey (EMPTY_DEADKEYS in a Key)
+        deadkeys = self._deadkeys[i]
+        if deadkeys is None:
+            entries = self._deadkey_entries
+            string = self.string
+            deadkeys = {}
+            for j in range(self._deadkey_offsets[i] * deadkey_fields,
+                           self._deadkey_offsets[i + 1] * deadkey_fields, deadkey_fields):
+                accent, with_, text, codepoint, table = entries[j:j + deadkey_fields]
+                dk = DeadKey(string(accent), string(with_), string(text), codepoint,
+                             self.deadkeys(table) if table else None)
+                deadkeys[(dk.accent, dk.with_)] = dk
+            self._deadkeys[i] = deadkeys
+        return deadkeys
+
+    def key(self, i: int) -> Key | None:
+        if not i:
+            return None
+        key = self._key_cache[i]
+        if key is None:
+            j = i * key_fields
+            scancode, codepoint, text, vk, deadkeys = self._keys[j:j + key_fields]
+            key = self._key_cache[i] = Key(scancode, codepoint, self.string(text), self.string(vk),
+                                           self.deadkeys(deadkeys))
+        return key
+
+    def keymap(self, plane: int) -> DbKeymap:
+        return DbKeymap(self, plane)
+
+    def klid(self, i: int) -> str:
+        # KLID of the layout i without building it
+        return self.string(self._records[i * self._record_size + 1])
+
+    def locale_name(self, i: int) -> str:
+        return self.string(self._records[i * self._record_size + 2])
+
+    def layout(self, i: int) -> KeyLayout:
+        layout = self._layouts[i]
+        if layout is None:
+            start = i * self._record_size
+            record = self._records[start:start + self._record_size]
+            (_klid, klid, locale_name, display_name, origin_display_name, flags,
+             extra_offset, extra_count) = record[:layout_fields]
+            keymaps = {mods: self.keymap(plane) for mods, plane in zip(self.keymap_names, record[layout_fields:])}
+            extra = self._extra
+            extra_scancodes = {extra[j]: self.key(extra[j + 1])
+                               for j in range(extra_offset * 2, (extra_offset + extra_count) * 2, 2)}
+            layout = self._layouts[i] = KeyLayout(
+                klid=self.string(klid),
+                locale_name=self.string(locale_name),
+                display_name=self.string(display_name),
+                origin_display_name=self.string(origin_display_name),
+                keymaps=keymaps,
+                extra_scancodes=extra_scancodes,
+                alt_right_is_altgr=bool(flags & AltRightIsAltGrFlag),
+                has_right_ctrl_like_oem8=bool(flags & RightCtrlLikeOem8Flag),
+            )
+        return layout
+
+    def find(self, klid: str | int) -> int | None:
+        # index of the layout (binary search in the klid index)
+        value = _klid_value(klid)
+        index = self._klid_index
+        n = len(index) // 2
+        i = bisect_left(range(n), value, key=lambda j: index[j * 2])
+        if i < n and index[i * 2] == value:
+            return index[i * 2 + 1]
+        return None
+
+    def get(self, klid: str | int) -> KeyLayout | None:
+        i = self.find(klid)
+        return None if i is None else self.layout(i)
+
+    def find_locale(self, locale_name: str) -> list[int]:
+        # indexes of the layouts of a locale (case insensitive)
+        locale_name = locale_name.lower()
+        index = self._locale_index
+        n = len(index) // 2
+        key = lambda j: self.string(index[j * 2]).lower()  # noqa: E731
+        i = bisect_left(range(n), locale_name, key=key)
+        result = []
+        while i < n and key(i) == locale_name:
+            result.append(index[i * 2 + 1])
+            i += 1
+        return result
+
+    def by_locale(self, locale_name: str) -> list[KeyLayout]:
+        return list(map(self.layout, self.find_locale(locale_name)))
+
+    def select(self, klids: Iterable[str] = (), locales: Iterable[str] = ()) -> list[KeyLayout]:
+        # layouts of klids or locales (all without filter), in database order
+        klids = list(klids)
+        locales = list(locales)
+        if not klids and not locales:
+            return list(self)
+        indexes = {i for klid in klids if (i := self.find(klid)) is not None}
+        for locale_name in locales:
+            indexes.update(self.find_locale(locale_name))
+        return list(map(self.layout, sorted(indexes)))
+
+
+def is_layout_db(filename: str) -> bool:
+    return filename.endswith('.kldb')
+
+
+def main(argv: list[str]) -> int:
+    if len(argv) < 3 or argv[1] not in ('build', 'info'):
+        print(argv[0], 'build layouts.kldb [-j N] [--cache DIR] [--klid KLID,...] [--locale NAME,...]'
+              ' {layout.xml | layouts.tar.zst}...', file=sys.stderr)
+        print(argv[0], 'info layouts.kldb [KLID | locale]...', file=sys.stderr)
+        return 1
+
+    filename = argv[2]
+    if argv[1] == 'build':
+        errors = []
+        t = time.perf_counter()
+        layouts = parse_argv(argv[:1] + argv[3:], errors=errors)
+        t_parse = time.perf_counter() - t
+        t = time.perf_counter()
+        size = write_db(layouts, filename)
+        print(f'{filename}: {len(layouts)} layouts, {size} bytes'
+              f' (parse: {t_parse:.3f}s, compile: {time.perf_counter() - t:.3f}s)', file=sys.stderr)
+        if errors:
+            print('\n'.join(errors), file=sys.stderr)
+            return 1
+        return 0
+
+    t = time.perf_counter()
+    with LayoutDB.open(filename) as db:
+        t_open = time.perf_counter() - t
+        queries = argv[3:]
+        if queries:
+            indexes = []
+            for query in queries:
+                # a KLID or a locale name ('de' is both)
+                if all(c in '0123456789abcdefABCDEF' for c in query) and (i := db.find(query)) is not None:
+                    indexes.append(i)
+                indexes += db.find_locale(query)
+            indexes = dict.fromkeys(indexes)
+        else:
+            indexes = range(len(db))
+        for i in indexes:
+            layout = db.layout(i)
+            print(f'{layout.klid} {layout.locale_name:12} {layout.display_name}')
+        print(f'{len(db)} layouts, {len(db.keymap_names)} keymaps by layout,'
+              f' {len(db._planes) // plane_size} planes, {len(db._keys) // key_fields - 1} keys,'
+              f' {len(db._deadkey_offsets) - 2} dead key tables (open: {t_open * 1e3:.2f}ms)', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# Detect the keyboard layout of a browser from KeyboardEvent (key, code) pairs.
+#
+#   index = DetectionIndex(layouts)
+#   detector = LayoutDetector(index, locale_hint='fr-FR')
+#   detector.observe('q', 'KeyA')  # a french AZERTY has q on the US A key
+#   detector.best()
+import sys
+import time
+from collections.abc import Iterable
+from typing import NamedTuple
+
+from kbd_parser import KeyLayout, keymap_names, parse_argv
+
+
+# KeyboardEvent.code -> index of KeyLayout.keymaps (scancode, 0x80 for extended scancode)
+code_to_scancode = {
+    'Backquote': 0x29, 'Digit1': 0x02, 'Digit2': 0x03, 'Digit3': 0x04, 'Digit4': 0x05,
+    'Digit5': 0x06, 'Digit6': 0x07, 'Digit7': 0x08, 'Digit8': 0x09, 'Digit9': 0x0A,
+    'Digit0': 0x0B, 'Minus': 0x0C, 'Equal': 0x0D,
+    'KeyQ': 0x10, 'KeyW': 0x11, 'KeyE': 0x12, 'KeyR': 0x13, 'KeyT': 0x14, 'KeyY': 0x15,
+    'KeyU': 0x16, 'KeyI': 0x17, 'KeyO': 0x18, 'KeyP': 0x19, 'BracketLeft': 0x1A, 'BracketRight': 0x1B,
+    'KeyA': 0x1E, 'KeyS': 0x1F, 'KeyD': 0x20, 'KeyF': 0x21, 'KeyG': 0x22, 'KeyH': 0x23,
+    'KeyJ': 0x24, 'KeyK': 0x25, 'KeyL': 0x26, 'Semicolon': 0x27, 'Quote': 0x28, 'Backslash': 0x2B,
+    'IntlBackslash': 0x56, 'KeyZ': 0x2C, 'KeyX': 0x2D, 'KeyC': 0x2E, 'KeyV': 0x2F, 'KeyB': 0x30,
+    'KeyN': 0x31, 'KeyM': 0x32, 'Comma': 0x33, 'Period': 0x34, 'Slash': 0x35,
+    'IntlRo': 0x73, 'IntlYen': 0x7D, 'Space': 0x39,
+    'NumpadMultiply': 0x37, 'NumpadSubtract': 0x4A, 'NumpadAdd': 0x4E, 'NumpadDecimal': 0x53,
+    'NumpadComma': 0x7E, 'NumpadDivide': 0xB5,
+    'Numpad0': 0x52, 'Numpad1': 0x4F, 'Numpad2': 0x50, 'Numpad3': 0x51, 'Numpad4': 0x4B,
+    'Numpad5': 0x4C, 'Numpad6': 0x4D, 'Numpad7': 0x47, 'Numpad8': 0x48, 'Numpad9': 0x49,
+}
+
+scancode_to_code = {sc: code for code, sc in code_to_scancode.items()}
+
+# KeyboardEvent.key of a dead key
+dead_key = 'Dead'
+
+# keymaps with control without alt produce control characters, but the browser
+# reports the key without control
+detection_planes = tuple(mods for mods in keymap_names
+                         if 'VK_CONTROL' not in mods or 'VK_MENU' in mods)
+
+_plane_ids = {mods: i for i, mods in enumerate(detection_planes)}
+
+
+def _fallback_planes(mods: str) -> tuple[str, ...]:
+    # mods, then without CapsLock then without NumLock: as with Windows, a key
+    # without CapsLock (NumLock) plane ignores the lock (see scancode_decoder.py)
+    candidates = [mods.split()]
+    for lock in ('VK_CAPITAL', 'VK_NUMLOCK'):
+        candidates += [[m for m in c if m != lock] for c in candidates if lock in c]
+    return tuple(' '.join(c) for c in candidates)
+
+
+_planes_with_fallback = {mods: _fallback_planes(mods) for mods in detection_planes}
+
+
+def plane_from_modifiers(shift: bool = False, capslock: bool = False, altgr: bool = False,
+                         numlock: bool = False) -> str:
+    # keymap name of a KeyboardEvent state (shiftKey, getModifierState('CapsLock'), ...)
+    mods = []
+    if shift:
+        mods.append('VK_SHIFT')
+    if altgr:
+        mods.append('VK_CONTROL VK_MENU')
+    if capslock:
+        mods.append('VK_CAPITAL')
+    if numlock:
+        mods.append('VK_NUMLOCK')
+    return ' '.join(mods)
+
+
+class LayoutInfo(NamedTuple):
+    klid: str
+    locale_name: str
+    display_name: str
+
+
+class DetectionIndex:
+    # (key, scancode, plane id) -> bitset of layouts (bit i = layouts[i])
+    # and (key, scancode) -> bitset of layouts for any plane.
+    # key is the text of a single character or dead_key.
+
+    __slots__ = ('layouts', 'by_plane', 'by_key', 'all_layouts', 'rank')
+
+    def __init__(self, layouts: Iterable[KeyLayout]) -> None:
+        self.layouts: list[LayoutInfo] = []
+        self.by_plane: dict[tuple[str, int, int], int] = {}
+        self.by_key: dict[tuple[str, int], int] = {}
+
+        by_plane = self.by_plane
+        by_key = self.by_key
+        for i, layout in enumerate(layouts):
+            self.layouts.append(LayoutInfo(layout.klid, layout.locale_name, layout.display_name))
+            bit = 1 << i
+            for mods, fallback in _planes_with_fallback.items():
+                plane = _plane_ids[mods]
+                defined = set()
+                for keymap in filter(None, map(layout.keymaps.get, fallback)):
+                    for sc, key in enumerate(keymap):
+                        if key is None or sc in defined:
+                            continue
+                        defined.add(sc)
+                        text = dead_key if key.deadkeys else key.text
+                        if not text or len(text) != 1 and text != dead_key:
+                            continue
+                        k = (text, sc, plane)
+                        by_plane[k] = by_plane.get(k, 0) | bit
+                        k = (text, sc)
+                        by_key[k] = by_key.get(k, 0) | bit
+
+        self.all_layouts = (1 << len(self.layouts)) - 1
+        # base layouts (KLID 0000xxxx) before their variants
+        self.rank = sorted(range(len(self.layouts)),
+                           key=lambda i: (self.layouts[i].klid[:4], self.layouts[i].klid))
+
+    def lookup(self, key: str, code: str, plane: str | None = None) -> int | None:
+        # bitset of the layouts which produce key with code, None when not indexable
+        sc = code_to_scancode.get(code)
+        if sc is None or (len(key) != 1 and key != dead_key):
+            return None
+        if plane is None:
+            return self.by_key.get((key, sc), 0)
+        plane_id = _plane_ids.get(plane)
+        if plane_id is None:
+            return None
+        return self.by_plane.get((key, sc, plane_id), 0)
+
+
+class LayoutDetector:
+    # candidates of a session narrowed by each observed key.
+    # An observation which matches none of the candidates (typing on an unknown
+    # layout, IME, key remapping) is counted as a mismatch and ignored.
+
+    __slots__ = ('index', 'candidates', 'observations', 'mismatches', 'locale_hint')
+
+    def __init__(self, index: DetectionIndex, locale_hint: str | None = None) -> None:
+        self.index = index
+        self.candidates = index.all_layouts
+        self.observations = 0
+        self.mismatches = 0
+        self.locale_hint = locale_hint
+
+    def observe(self, key: str, code: str, plane: str | None = None) -> int:
+        # plane: keymap name of the modifiers (see plane_from_modifiers()), None when unknown
+        # return the number of candidates
+        bits = self.index.lookup(key, code, plane)
+        if bits is not None:
+            self.observations += 1
+            narrowed = self.candidates & bits
+            if narrowed:
+                self.candidates = narrowed
+            else:
+                self.mismatches += 1
+        return self.candidates.bit_count()
+
+    def reset(self) -> None:
+        self.candidates = self.index.all_layouts
+        self.observations = 0
+        self.mismatches = 0
+
+    def candidate_layouts(self) -> list[LayoutInfo]:
+        layouts = self.index.layouts
+        candidates = self.candidates
+        return [layouts[i] for i in self.index.rank if candidates >> i & 1]
+
+    def is_unique(self) -> bool:
+        return self.candidates.bit_count() == 1
+
+    def best(self) -> LayoutInfo:
+        # the first candidate of locale_hint, otherwise the first candidate
+        # (base layouts before their variants)
+        layouts = self.index.layouts
+        candidates = self.candidates
+        first = None
+        for i in self.index.rank:
+            if candidates >> i & 1:
+                if first is None:
+                    first = layouts[i]
+                    if not self.locale_hint:
+                        break
+                if layouts[i].locale_name == self.locale_hint:
+                    return layouts[i]
+        return first
+
+
+def simulate_typing(layout: KeyLayout, text: str) -> list[tuple[str, str, str]]:
+    # (key, code, plane) of KeyboardEvents of text typed with layout.
+    # Characters without key are skipped.
+    positions = {}
+    for mods in detection_planes:
+        keymap = layout.keymaps.get(mods)
+        if keymap is None:
+            continue
+        for sc, key in enumerate(keymap):
+            if key and not key.deadkeys and key.text and sc in scancode_to_code:
+                positions.setdefault(key.text, (key.text, scancode_to_code[sc], mods))
+    return [positions[c] for c in text if c in positions]
+
+
+def main(argv: list[str]) -> int:
+    # layout_detector.py KLID text [parser options] layouts...
+    if len(argv) < 4:
+        print(argv[0], 'KLID text [-j N] [--cache DIR] {layout.xml | layouts.tar.zst}...', file=sys.stderr)
+        return 1
+
+    klid = argv[1].lower().rjust(8, '0')
+    text = argv[2]
+    layouts = parse_argv(argv[:1] + argv[3:])
+
+    t = time.perf_counter()
+    index = DetectionIndex(layouts)
+    print(f'index: {len(index.by_plane)} entries, built in {time.perf_counter() - t:.3f}s')
+
+    layout = next((layout for layout in layouts if layout.klid == klid), None)
+    if layout is None:
+        print(f'unknown KLID: {klid}', file=sys.stderr)
+        return 1
+
+    events = simulate_typing(layout, text)
+    detector = LayoutDetector(index, layout.locale_name)
+    t = time.perf_counter()
+    for n, (key, code, plane) in enumerate(events, 1):
+        remaining = detector.observe(key, code, plane)
+        print(f'{n:3} {key!r:6} {code:14} {remaining:4} candidates, best: {detector.best().display_name}')
+    elapsed = time.perf_counter() - t
+
+    if events:
+        print(f'{elapsed / len(events) * 1e6:.1f}µs per observation (with print)')
+    for info in detector.candidate_layouts():
+        print(f'  {info.klid} {info.locale_name} {info.display_name}')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+import sys
+from typing import NamedTuple
+
+import numpy as np
+
+from kbd_parser import (KeyLayout, keymap_names, parsed_keymap_names,
+                        merge_numlock_mods, merge_numlock_capital_mods, parse_argv)
+
+
+class LayoutTensor(NamedTuple):
+    klids: list[str]
+    locale_names: list[str]
+    mods: tuple[str, ...]  # keymap_names
+    # arrays of shape (layouts, mods, 256)
+    codepoints: np.ndarray  # int32: Key.codepoint, -1 without key
+    chars: np.ndarray  # int32: ord(Key.text) for a single character, -1 otherwise
+    deadkeys: np.ndarray  # bool: dead key
+
+
+_mod_index = {mods: i for i, mods in enumerate(keymap_names)}
+
+
+def merge_numlock(ids: np.ndarray) -> np.ndarray:
+    # vectorized kbd_parser.merge_numlock_keymaps() on any number of layouts.
+    # ids: keymap ids of shape (..., len(parsed_keymap_names), 256), 0 without key
+    # return ids of shape (..., len(keymap_names), 256)
+    merged = np.zeros(ids.shape[:-2] + (len(keymap_names), 256), ids.dtype)
+    merged[..., :len(parsed_keymap_names), :] = ids
+
+    def merge(mods: str, num_mod: str) -> np.ndarray:
+        keys = merged[..., _mod_index[mods], :]
+        numlock_keys = merged[..., _mod_index[num_mod], :]
+        if np.any((keys != 0) & (numlock_keys != 0)):
+            raise Exception(f'{mods} and {num_mod} have common keys')
+        return np.where(keys != 0, keys, numlock_keys)
+
+    for num_mod, caps_mod, final_mod in merge_numlock_capital_mods:
+        merged[..., _mod_index[final_mod], :] = merge(caps_mod, num_mod)
+
+    for num_mod, merged_mod in merge_numlock_mods:
+        merged[..., _mod_index[num_mod], :] = merge(merged_mod, num_mod)
+
+    return merged
+
+
+def from_layouts(layouts: list[KeyLayout]) -> LayoutTensor:
+    # layouts parsed with or without merge_numlock
+    shape = (len(layouts), len(keymap_names), 256)
+    ids = np.zeros(shape, np.uint16)
+    unmerged = []
+    for i, layout in enumerate(layouts):
+        for mods, keymap in layout.keymaps.items():
+            ids[i, _mod_index[mods]] = np.frombuffer(keymap.ids, np.uint16)
+        if len(layout.keymaps) != len(keymap_names):
+            unmerged.append(i)
+
+    if unmerged:
+        ids[unmerged] = merge_numlock(ids[unmerged, :len(parsed_keymap_names)])
+
+    codepoints = np.empty(shape, np.int32)
+    chars = np.empty(shape, np.int32)
+    deadkeys = np.empty(shape, np.bool_)
+    for i, layout in enumerate(layouts):
+        table = next(iter(layout.keymaps.values())).table
+        table_codepoints = np.frombuffer(table.codepoints, np.uint32).astype(np.int32)
+        table_codepoints[0] = -1
+        table_chars = np.array([-1 if not s or len(s) != 1 else ord(s) for s in table.strings], np.int32)
+        table_chars = table_chars[np.frombuffer(table.texts, np.uint16)]
+        codepoints[i] = table_codepoints[ids[i]]
+        chars[i] = table_chars[ids[i]]
+        deadkeys[i] = np.frombuffer(table.deadkey_ids, np.uint16)[ids[i]] != 0
+
+    return LayoutTensor(klids=[layout.klid for layout in layouts],
+                        locale_names=[layout.locale_name for layout in layouts],
+                        mods=keymap_names,
+                        codepoints=codepoints, chars=chars, deadkeys=deadkeys)
+
+
+def save_tensor(filename: str, tensor: LayoutTensor) -> None:
+    np.savez_compressed(filename,
+                        klids=np.array(tensor.klids), locale_names=np.array(tensor.locale_names),
+                        mods=np.array(tensor.mods),
+                        codepoints=tensor.codepoints, chars=tensor.chars, deadkeys=tensor.deadkeys)
+
+
+def load_tensor(filename: str) -> LayoutTensor:
+    with np.load(filename) as data:
+        return LayoutTensor(klids=data['klids'].tolist(), locale_names=data['locale_names'].tolist(),
+                            mods=tuple(data['mods'].tolist()),
+                            codepoints=data['codepoints'], chars=data['chars'], deadkeys=data['deadkeys'])
+
+
+class ReverseIndex(NamedTuple):
+    shape: tuple[int, int, int]
+    chars: np.ndarray  # sorted characters
+    positions: np.ndarray  # flat positions in (layouts, mods, 256) of chars
+
+
+def reverse_index(tensor: LayoutTensor, with_deadkeys: bool = False) -> ReverseIndex:
+    chars = tensor.chars.ravel()
+    mask = chars >= 0
+    if not with_deadkeys:
+        mask &= ~tensor.deadkeys.ravel()
+    positions = np.flatnonzero(mask)
+    order = np.argsort(chars[positions], kind='stable')
+    positions = positions[order]
+    return ReverseIndex(tensor.chars.shape, chars[positions], positions)
+
+
+def lookup(index: ReverseIndex, char: str, layout: int | None = None) -> np.ndarray:
+    # return [(layout, mod, scancode)] which produce char
+    c = ord(char)
+    lo = np.searchsorted(index.chars, c, 'left')
+    hi = np.searchsorted(index.chars, c, 'right')
+    found = np.column_stack(np.unravel_index(index.positions[lo:hi], index.shape))
+    if layout is not None:
+        found = found[found[:, 0] == layout]
+    return found
+
+
+def typeable_layouts(index: ReverseIndex, text: str) -> np.ndarray:
+    # mask of layouts that have a key (without dead key) for each character of text
+    nlayouts = index.shape[0]
+    result = np.ones(nlayouts, np.bool_)
+    chars = np.unique(np.fromiter(map(ord, text), np.int32, len(text)))
+    lo = np.searchsorted(index.chars, chars, 'left')
+    hi = np.searchsorted(index.chars, chars, 'right')
+    for a, b in zip(lo, hi):
+        found = np.zeros(nlayouts, np.bool_)
+        found[index.positions[a:b] // (index.shape[1] * index.shape[2])] = True
+        result &= found
+    return result
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print(sys.argv[0], 'output.npz [kbd_parser options] layout.xml...', file=sys.stderr)
+        sys.exit(1)
+
+    errors = []
+    layouts = parse_argv(sys.argv[:1] + sys.argv[2:], errors=errors)
+    save_tensor(sys.argv[1], from_layouts(layouts))
+    if errors:
+        print('\n'.join(errors), file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+# Scancode events of a layout to the events which type the same text with
+# another layout (client keyboard different from the layout of the server).
+#
+#   layout_transcoder.py SOURCE_KLID TARGET_KLID {text | @file} [--repeat N] {layout.xml | layouts.tar.zst}...
+#
+# A pair of layouts is compiled to one table of 1024 entries per modifier
+# state of the source layout (see scancode_decoder.py), indexed by scancode
+# and direction:
+#
+#   None        nothing is sent
+#   TextEntry   typed text and its events on the target layout (TextEncoder)
+#   tuple       events sent as is (keys without text, shortcuts)
+#   int         next state (Shift, AltGr, locks: typed text carries its modifiers)
+#   StateEntry  next state and the events of a forwarded modifier (Ctrl, Alt)
+#   DeadEntry   a dead key, composed with the next text of the source layout
+#
+# With Ctrl or Alt held, a key is a shortcut: the key of the target layout
+# which types the text of the key without modifier (the key itself without
+# one). The target layout is expected without held modifier and without
+# CapsLock: the locks of the source layout only change the typed text. With
+# Shift held, a shortcut, a key without text or a control character (Tab,
+# Enter...) is pressed between a Shift down and up of the target layout.
+#
+# The tables of the states are built when a state is reached, the pairs when
+# they are used (TranscoderCache keeps the last ones).
+import sys
+import time
+from collections import OrderedDict
+from collections.abc import Iterable
+from typing import NamedTuple
+
+from kbd_parser import KeyLayout, parse_argv, _normalize_klid
+from gen_reversed_keylayout import reverse_layout
+from scancode_decoder import (CapsLockBit, DeadEntry, EntryMask, KeyRelease, LAltBit, LCtrlBit, LShiftBit,
+                              NumLockBit, RAltBit, RCtrlBit, RShiftBit, ReleaseEntry, ScancodeDecoder, compose,
+                              locks, state_count, table_size)
+from text_encoder import LShiftSC, TextEncoder
+
+
+LCtrlSC = 0x1D
+RCtrlSC = 0x11D
+AltSC = 0x38
+AltGrSC = 0x138
+
+
+class TextEntry(NamedTuple):
+    text: str
+    events: tuple[int, ...]
+
+
+class StateEntry(NamedTuple):
+    state: int
+    events: tuple[int, ...]
+
+
+class TranscodingTable:
+    # compiled pair of layouts, shared by the transcoders of the pair
+
+    __slots__ = ('source', 'target', 'tables', 'unencodable', '_decoder', '_encoder', '_text_events',
+                 '_forwarded', '_forwarded_scancodes', '_shortcut_scancodes')
+
+    def __init__(self, source: KeyLayout, target: KeyLayout) -> None:
+        self.source = source
+        self.target = target
+        self.tables: list[list | None] = [None] * state_count
+        # characters without key on the target layout
+        self.unencodable: set[str] = set()
+        self._decoder = ScancodeDecoder(source)
+        self._encoder = TextEncoder(reverse_layout(target, []))
+        # {text: events on the target layout}
+        self._text_events: dict[str, tuple[int, ...]] = {}
+
+        # Ctrl and Alt are forwarded, AltGr and the right Ctrl as OEM8 type text
+        self._forwarded = LCtrlBit | RCtrlBit | LAltBit | (0 if source.alt_right_is_altgr else RAltBit)
+        # right modifiers of the target layout which would type text
+        self._forwarded_scancodes = {}
+        if target.has_right_ctrl_like_oem8:
+            self._forwarded_scancodes[RCtrlSC] = LCtrlSC
+        if target.alt_right_is_altgr:
+            self._forwarded_scancodes[AltGrSC] = AltSC
+
+        # {text: scancode} of the keys without modifier of the target layout
+        self._shortcut_scancodes = {text: scancodes_by_mods[0][0]
+                                    for text, scancodes_by_mods in self._encoder.keymap.items()
+                                    if scancodes_by_mods.get(0)}
+
+    def text_events(self, text: str) -> tuple[int, ...]:
+        events = self._text_events.get(text)
+        if events is None:
+            encoded = self._encoder.encode(text)
+            self.unencodable.update(encoded.unencodable)
+            events = self._text_events[text] = tuple(encoded.events)
+        return events
+
+    def _shortcut(self, index: int, base: str | DeadEntry) -> tuple[int, ...]:
+        # key pressed with Ctrl or Alt: a tap of the target key of its text
+        scancode = self._shortcut_scancodes.get(base.accent if base.__class__ is DeadEntry else base, index)
+        return (scancode, scancode | KeyRelease)
+
+    @staticmethod
+    def _shifted(events: tuple[int, ...]) -> tuple[int, ...]:
+        # events with the Shift of the target layout held
+        return (LShiftSC, *events, LShiftSC | KeyRelease)
+
+    def state_table(self, state: int) -> list:
+        table = self.tables[state]
+        if table is not None:
+            return table
+
+        decoder = self._decoder
+        source_table = decoder.state_table(state)
+        base_table = decoder.state_table(0)
+        shortcut = state & self._forwarded
+        # Shift is not held on the target layout (typed text has its modifiers)
+        shifted = state & (LShiftBit | RShiftBit)
+        table = [None] * table_size
+        for i, entry in enumerate(source_table):
+            index = i & EntryMask
+            release = KeyRelease if i & ReleaseEntry else 0
+            # key down without modifier: held bits of a modifier key, text or None
+            base = base_table[index]
+            cls = entry.__class__
+            if cls is int:
+                if base & self._forwarded:
+                    table[i] = StateEntry(entry, (self._forwarded_scancodes.get(index, index) | release,))
+                else:
+                    table[i] = entry
+            elif shortcut and base is not None:
+                if not release:
+                    events = self._shortcut(index, base)
+                    table[i] = self._shifted(events) if shifted else events
+            elif cls is str:
+                events = self.text_events(entry)
+                # Shift+Tab, Shift+Enter...
+                if shifted and not entry.isprintable():
+                    events = self._shifted(events)
+                table[i] = TextEntry(entry, events)
+            elif cls is DeadEntry:
+                table[i] = entry
+            elif base is None and source_table[index] is None:
+                # key without text (arrows, function keys...)
+                events = (index | release,)
+                table[i] = self._shifted(events) if shifted and not release else events
+        self.tables[state] = table
+        return table
+
+
+class ScancodeTranscoder:
+    # state machine of a session: modifiers and locks of the source layout,
+    # pending dead key
+
+    __slots__ = ('pair', 'state', 'table', 'dead')
+
+    def __init__(self, pair: TranscodingTable, capslock: bool = False, numlock: bool = False) -> None:
+        self.pair = pair
+        self.dead: DeadEntry | None = None
+        self.state = 0
+        self.sync(capslock, numlock)
+
+    def sync(self, capslock: bool = False, numlock: bool = False) -> None:
+        # locks of a synchronize event of the client
+        state = self.state & ~locks
+        if capslock:
+            state |= CapsLockBit
+        if numlock:
+            state |= NumLockBit
+        self.state = state
+        self.table = self.pair.state_table(state)
+
+    def feed(self, events: Iterable[int]) -> list[int]:
+        # events for the target layout
+        accu = []
+        extend = accu.extend
+        pair = self.pair
+        tables = pair.tables
+        table = self.table
+        dead = self.dead
+        for event in events:
+            entry = table[(event & EntryMask) | (event >> 6 & ReleaseEntry)]
+            if entry is None:
+                continue
+            cls = entry.__class__
+            if cls is TextEntry:
+                if dead is None:
+                    extend(entry.events)
+                else:
+                    texts = []
+                    dead = compose(dead, entry.text, texts)
+                    for text in texts:
+                        extend(pair.text_events(text))
+            elif cls is tuple:
+                extend(entry)
+            elif cls is int:
+                table = tables[entry] or pair.state_table(entry)
+                self.state = entry
+            elif cls is StateEntry:
+                extend(entry.events)
+                table = tables[entry.state] or pair.state_table(entry.state)
+                self.state = entry.state
+            elif dead is None:
+                dead = entry
+            else:
+                texts = []
+                dead = compose(dead, entry, texts)
+                for text in texts:
+                    extend(pair.text_events(text))
+        self.table = table
+        self.dead = dead
+        return accu
+
+
+class TranscoderCache:
+    # pairs of layouts compiled on demand, the max_pairs last used are kept
+
+    def __init__(self, layouts: Iterable[KeyLayout], max_pairs: int = 16) -> None:
+        self.max_pairs = max_pairs
+        self.layouts: dict[str, KeyLayout] = {}
+        for layout in layouts:
+            self.layouts.setdefault(_normalize_klid(layout.klid), layout)
+        # {(source klid, target klid): TranscodingTable} by order of use
+        self._pairs: OrderedDict[tuple[str, str], TranscodingTable] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _layout(self, klid: str) -> KeyLayout:
+        layout = self.layouts.get(_normalize_klid(klid))
+        if layout is None:
+            raise KeyError(f'unknown KLID: {klid}')
+        return layout
+
+    def pair(self, source_klid: str, target_klid: str) -> TranscodingTable:
+        k = (_normalize_klid(source_klid), _normalize_klid(target_klid))
+        pair = self._pairs.get(k)
+        if pair is not None:
+            self._pairs.move_to_end(k)
+            self.hits += 1
+            return pair
+
+        self.misses += 1
+        pair = self._pairs[k] = TranscodingTable(self._layout(source_klid), self._layout(target_klid))
+        if len(self._pairs) > self.max_pairs:
+            self._pairs.popitem(last=False)
+        return pair
+
+    def transcoder(self, source_klid: str, target_klid: str,
+                   capslock: bool = False, numlock: bool = False) -> ScancodeTranscoder:
+        return ScancodeTranscoder(self.pair(source_klid, target_klid), capslock, numlock)
+
+    def __len__(self) -> int:
+        return len(self._pairs)
+
+
+def main(argv: list[str]) -> int:
+    # layout_transcoder.py SOURCE_KLID TARGET_KLID {text | @file} [--repeat N] [parser options] layouts...
+    # the events of text on the source layout (text_encoder.py) are
+    # transcoded, then decoded with the target layout (scancode_decoder.py)
+    if len(argv) < 5:
+        print(argv[0], 'SOURCE_KLID TARGET_KLID {text | @file} [--repeat N] [-j N] [--cache DIR]'
+              ' {layout.xml | layouts.tar.zst}...', file=sys.stderr)
+        return 1
+
+    source_klid = _normalize_klid(argv[1])
+    target_klid = _normalize_klid(argv[2])
+    text = argv[3]
+    if text.startswith('@'):
+        with open(text[1:], encoding='utf-8') as f:
+            text = f.read()
+    repeat = 1
+    iargv = 4
+    if argv[iargv] == '--repeat' and iargv + 1 < len(argv):
+        repeat = int(argv[iargv + 1])
+        iargv += 2
+
+    layouts = parse_argv(argv[:1] + ['--klid', f'{source_klid},{target_klid}'] + argv[iargv:])
+    cache = TranscoderCache(layouts)
+    try:
+        source = cache._layout(source_klid)
+        target = cache._layout(target_klid)
+    except KeyError as e:
+        print(e.args[0], file=sys.stderr)
+        return 1
+
+    encoded = TextEncoder(reverse_layout(source, [])).encode(text)
+    events = encoded.events * repeat
+    expected = ScancodeDecoder(source).feed(events)
+
+    t = time.perf_counter()
+    transcoder = cache.transcoder(source_klid, target_klid)
+    compiled = time.perf_counter() - t
+    t = time.perf_counter()
+    transcoded = transcoder.feed(events)
+    elapsed = time.perf_counter() - t
+
+    output = ScancodeDecoder(target).feed(transcoded)
+    unencodable = transcoder.pair.unencodable
+    ok = output == ''.join(c for c in expected if c not in unencodable)
+    print(f'{source.display_name} -> {target.display_name}: round trip: {"ok" if ok else "mismatch"}',
+          file=sys.stderr)
+    if unencodable:
+        print(f'without key on the target layout: {"".join(sorted(unencodable))!r}', file=sys.stderr)
+    print(f'{len(events)} -> {len(transcoded)} events in {elapsed:.3f}s'
+          f' ({len(events) / elapsed / 1e6 if elapsed else 0:.2f}M events/s), pair compiled in {compiled * 1000:.1f}ms',
+          file=sys.stderr)
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# Scancode events to RDP fast-path input PDUs (MS-RDPBCGR 2.2.8.1.2).
+#
+# An event is `scancode | flag` with flag = 0 (key down) or KeyRelease, as in
+# scancodes.js and text_encoder.py ; 0x100 is the extended bit of scancode
+# (0xE0 prefix) and 0x200 the extended1 bit (0xE1 prefix, Pause).
+#
+# A PDU (TS_FP_INPUT_PDU, without encryption) is
+#
+#   fpInputHeader  u8   action (0 = fast-path) | numEvents << 2 (0 when > 15)
+#   length         PER  whole PDU: 1 byte (<= 0x7F) or 2 bytes big endian | 0x8000
+#   numEvents      u8   only when numEvents > 15
+#   events         TS_FP_KEYBOARD_EVENT: eventHeader u8 (eventFlags | eventCode << 5
+#                  with eventCode = 0 (scancode)), keyCode u8
+#
+# The high byte of the events (KeyRelease, extended bits) is translated to
+# eventHeader by bytes.translate() and interleaved with the low byte (keyCode)
+# by extended slice assignments, then each PDU is a header and a slice copy
+# into a preallocated buffer: no Python object by event.
+import sys
+import time
+from array import array
+from collections.abc import Iterable, Iterator
+
+
+KeyRelease = 0x8000
+Extended = 0x100
+Extended1 = 0x200
+
+# eventFlags of TS_FP_KEYBOARD_EVENT
+FastPathKbdRelease = 0x01
+FastPathKbdExtended = 0x02
+FastPathKbdExtended1 = 0x04
+
+FastPathInputActionFastPath = 0
+FastPathInputEventScancode = 0
+
+# numEvents is a u8
+MaxEventsPerPdu = 255
+# length is at most 15 bits
+MaxPduSize = 0x7FFF
+
+# eventHeader of an event with unknown flags
+InvalidHeader = 0xFF
+
+
+def pdu_size(events: int) -> int:
+    size = 1 + (events > 15) + events * 2
+    return size + (1 if size + 1 <= 0x7F else 2)
+
+
+DefaultMaxPduSize = pdu_size(MaxEventsPerPdu)
+
+
+def _event_headers() -> bytes:
+    # high byte of an event -> eventHeader
+    headers = bytearray([InvalidHeader]) * 0x100
+    for flags in range(8):
+        headers[((flags & FastPathKbdRelease) << 7) | (flags >> 1)] = flags
+    return bytes(headers)
+
+
+_headers = _event_headers()
+
+
+def max_events_per_pdu(max_pdu_size: int) -> int:
+    if not pdu_size(1) <= max_pdu_size <= MaxPduSize:
+        raise ValueError(f'max_pdu_size must be in [{pdu_size(1)}, {MaxPduSize}]: {max_pdu_size}')
+    n = MaxEventsPerPdu
+    while pdu_size(n) > max_pdu_size:
+        n -= 1
+    return n
+
+
+def encoded_size(events: int, max_pdu_size: int = DefaultMaxPduSize) -> int:
+    # bytes of the PDUs of events, to size a buffer for encode_into()
+    n = max_events_per_pdu(max_pdu_size)
+    full, rest = divmod(events, n)
+    return full * pdu_size(n) + (pdu_size(rest) if rest else 0)
+
+
+def _to_u16(events: Iterable[int]) -> array:
+    if isinstance(events, array) and events.typecode == 'H':
+        return events
+    try:
+        return array('H', events)
+    except OverflowError as e:
+        raise ValueError(f'event out of u16: {e}') from None
+
+
+def _to_codes(events: array) -> bytearray:
+    # eventHeader, keyCode of each event
+    data = memoryview(events).cast('B')
+    low, high = (data[0::2], data[1::2]) if sys.byteorder == 'little' else (data[1::2], data[0::2])
+    headers = bytes(high).translate(_headers)
+    i = headers.find(InvalidHeader)
+    if i >= 0:
+        raise ValueError(f'invalid event: 0x{events[i]:x}')
+    codes = bytearray(len(data))
+    codes[0::2] = headers
+    codes[1::2] = low
+    return codes
+
+
+def encode_into(buffer: bytearray | memoryview, events: Iterable[int],
+                max_pdu_size: int = DefaultMaxPduSize, offset: int = 0) -> list[int]:
+    # writes the PDUs of events in buffer from offset and returns the end
+    # offset of each PDU (ValueError when buffer is too small)
+    events = _to_u16(events)
+    n = max_events_per_pdu(max_pdu_size)
+    size = encoded_size(len(events), max_pdu_size)
+    if offset + size > len(buffer):
+        raise ValueError(f'buffer too small: {len(buffer) - offset} bytes for {size}')
+
+    codes = _to_codes(events)
+    ends = []
+    end = len(codes)
+    i = 0
+    while i < end:
+        count = min(n, (end - i) >> 1)
+        length = pdu_size(count)
+        buffer[offset] = FastPathInputActionFastPath | ((count << 2) if count <= 15 else 0)
+        if length <= 0x7F:
+            buffer[offset + 1] = length
+            offset += 2
+        else:
+            buffer[offset + 1] = 0x80 | length >> 8
+            buffer[offset + 2] = length & 0xFF
+            offset += 3
+        if count > 15:
+            buffer[offset] = count
+            offset += 1
+        j = i + count * 2
+        buffer[offset:offset + j - i] = codes[i:j]
+        offset += j - i
+        i = j
+        ends.append(offset)
+    return ends
+
+
+class FastPathEncoder:
+    # PDUs written in a buffer reused (and grown) by each encode(): the
+    # returned views are valid until the next call
+
+    def __init__(self, max_pdu_size: int = DefaultMaxPduSize, capacity: int = 1 << 16) -> None:
+        max_events_per_pdu(max_pdu_size)
+        self.max_pdu_size = max_pdu_size
+        self.buffer = bytearray(capacity)
+        self._view = memoryview(self.buffer)
+
+    def encode(self, events: Iterable[int]) -> list[memoryview]:
+        events = _to_u16(events)
+        size = encoded_size(len(events), self.max_pdu_size)
+        if size > len(self.buffer):
+            self._view.release()
+            self.buffer = bytearray(max(size, len(self.buffer) * 2))
+            self._view = memoryview(self.buffer)
+        view = self._view
+        pdus = []
+        start = 0
+        for end in encode_into(view, events, self.max_pdu_size):
+            pdus.append(view[start:end])
+            start = end
+        return pdus
+
+
+def iter_pdus(data: bytes | bytearray | memoryview) -> Iterator[memoryview]:
+    # consecutive PDUs of data
+    view = memoryview(data)
+    offset = 0
+    while offset < len(view):
+        if offset + 2 > len(view):
+            raise ValueError(f'truncated PDU header at {offset}')
+        length = view[offset + 1]
+        if length & 0x80:
+            if offset + 3 > len(view):
+                raise ValueError(f'truncated PDU length at {offset}')
+            length = (length & 0x7F) << 8 | view[offset + 2]
+        if length < 2 or offset + length > len(view):
+            raise ValueError(f'invalid PDU length at {offset}: {length}')
+        yield view[offset:offset + length]
+        offset += length
+
+
+def decode_pdu(pdu: bytes | bytearray | memoryview, events: list[int] | None = None) -> list[int]:
+    # events of a PDU (appended to events)
+    if events is None:
+        events = []
+    header = pdu[0]
+    if header & 3 != FastPathInputActionFastPath:
+        raise ValueError(f'not a fast-path input PDU: action {header & 3}')
+    if header >> 6:
+        raise ValueError('encrypted PDU')
+    offset = 3 if pdu[1] & 0x80 else 2
+    count = (header >> 2) & 0xF
+    if not count:
+        count = pdu[offset]
+        offset += 1
+    if offset + count * 2 != len(pdu):
+        raise ValueError(f'{count} events in a PDU of {len(pdu)} bytes')
+    for i in range(offset, len(pdu), 2):
+        event_header = pdu[i]
+        if event_header >> 5 != FastPathInputEventScancode:
+            raise ValueError(f'not a scancode event: eventCode {event_header >> 5}')
+        events.append(pdu[i + 1] | ((event_header & FastPathKbdRelease) * KeyRelease)
+                      | ((event_header & (FastPathKbdExtended | FastPathKbdExtended1)) << 7))
+    return events
+
+
+def decode(data: bytes | bytearray | memoryview) -> list[int]:
+    # events of consecutive PDUs (the inverse of encode_into())
+    events = []
+    for pdu in iter_pdus(data):
+        decode_pdu(pdu, events)
+    return events
+
+
+def main(argv: list[str]) -> int:
+    # rdp_fastpath.py capture.bin [--max-pdu-size N] [--batch N] [--repeat N]
+    # encodes the events of a capture file (see scancode_decoder.py) by
+    # batches and checks the round trip
+    if len(argv) < 2:
+        print(argv[0], 'capture.bin [--max-pdu-size N] [--batch EVENTS] [--repeat N]', file=sys.stderr)
+        return 1
+
+    from scancode_decoder import read_capture
+
+    max_pdu_size = DefaultMaxPduSize
+    batch = 1 << 16
+    repeat = 1
+
+    iargv = 2
+    while iargv + 1 < len(argv):
+        arg = argv[iargv]
+        if arg == '--max-pdu-size':
+            max_pdu_size = int(argv[iargv + 1], 0)
+        elif arg == '--batch':
+            batch = int(argv[iargv + 1])
+        elif arg == '--repeat':
+            repeat = int(argv[iargv + 1])
+        else:
+            break
+        iargv += 2
+    if iargv != len(argv):
+        print(f'unknown option: {argv[iargv]}', file=sys.stderr)
+        return 1
+
+    events = array('H')
+    for chunk in read_capture(argv[1], batch):
+        events.extend(chunk)
+    events *= repeat
+
+    try:
+        encoder = FastPathEncoder(max_pdu_size)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    pdus = 0
+    size = 0
+    ok = True
+    elapsed = 0.
+    for i in range(0, len(events), batch):
+        chunk = events[i:i + batch]
+        t = time.perf_counter()
+        try:
+            encoded = encoder.encode(chunk)
+        except ValueError as e:
+            print(f'{argv[1]}: {e}', file=sys.stderr)
+            return 1
+        elapsed += time.perf_counter() - t
+        pdus += len(encoded)
+        size += sum(len(pdu) for pdu in encoded)
+        if decode(b''.join(encoded)) != chunk.tolist():
+            ok = False
+
+    print(f'round trip: {"ok" if ok else "mismatch"}', file=sys.stderr)
+    print(f'{len(events)} events, {pdus} PDUs, {size} bytes in {elapsed:.3f}s'
+          f' ({len(events) / elapsed / 1e6 if elapsed else 0:.2f}M events/s)', file=sys.stderr)
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
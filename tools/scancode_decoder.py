@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+# Scancode events back to text (session audit).
+#
+# The keymaps of a KeyLayout are compiled to dense tables indexed by
+# (modifier state, event). A state is the set of modifier keys held down and
+# of the locks (CapsLock, NumLock). Its table has 1024 entries, one per
+# scancode (0x100 = extended) and per direction (0x200 = release):
+#
+#   None       nothing is typed (key release, key without text)
+#   str        typed text
+#   int        next state (modifier key)
+#   DeadEntry  a dead key
+#
+# so that an event costs a single list lookup outside of dead keys. The
+# tables of the states are built when a state is reached for the first time.
+#
+# An event is `scancode | flag` with flag = 0 (key down) or KeyRelease, as in
+# scancodes.js and text_encoder.py. A capture file is a sequence of these
+# events as little endian u16.
+import mmap
+import sys
+import time
+from array import array
+from collections.abc import Iterable, Iterator
+from typing import NamedTuple
+
+from kbd_parser import DeadKeysType, KeyLayout, parse_argv
+
+
+KeyRelease = 0x8000
+
+# bits of a state: modifier keys held down
+LShiftBit = 1 << 0
+RShiftBit = 1 << 1
+LCtrlBit = 1 << 2
+RCtrlBit = 1 << 3
+LAltBit = 1 << 4
+RAltBit = 1 << 5
+OEM8Bit = 1 << 6
+KanaBit = 1 << 7
+# locks and lock keys held down (a lock toggles on the press, not on the repeat)
+CapsLockBit = 1 << 8
+NumLockBit = 1 << 9
+CapsLockDownBit = 1 << 10
+NumLockDownBit = 1 << 11
+
+state_count = 1 << 12
+locks = CapsLockBit | NumLockBit
+
+# virtual key of a modifier key -> (held bit, lock bit)
+vk_state_bits = {
+    'VK_LSHIFT': (LShiftBit, 0),
+    'VK_RSHIFT': (RShiftBit, 0),
+    'VK_LCONTROL': (LCtrlBit, 0),
+    'VK_RCONTROL': (RCtrlBit, 0),
+    'VK_LMENU': (LAltBit, 0),
+    'VK_RMENU': (RAltBit, 0),
+    'VK_OEM_8': (OEM8Bit, 0),
+    'VK_KANA': (KanaBit, 0),
+    'VK_CAPITAL': (CapsLockDownBit, CapsLockBit),
+    'VK_NUMLOCK': (NumLockDownBit, NumLockBit),
+}
+
+# index of a table entry
+EntryMask = 0x1FF
+ReleaseEntry = 0x200
+table_size = 0x400
+
+
+class DeadEntry(NamedTuple):
+    # accent typed by the dead key and {next key text: (text, DeadEntry | None)}
+    accent: str
+    edges: dict[str, tuple[str, 'DeadEntry | None']]
+
+
+def compose(dead: DeadEntry, text: str | DeadEntry, accu: list[str]) -> DeadEntry | None:
+    # text of a key after a dead key, return the new pending dead key
+    result = dead.edges.get(text.accent if text.__class__ is DeadEntry else text)
+    if result is None:
+        # not a combination: accent then the key
+        accu.append(dead.accent)
+        if text.__class__ is DeadEntry:
+            return text
+        accu.append(text)
+        return None
+    if result[1] is not None:
+        return result[1]
+    accu.append(result[0])
+    return None
+
+
+class ScancodeDecoder:
+    # state machine of a session: modifiers, locks and pending dead key
+
+    __slots__ = ('layout', 'planes', 'tables', 'state', 'table', 'dead', '_modifiers', '_dead_entries',
+                 '_keymaps')
+
+    def __init__(self, layout: KeyLayout, capslock: bool = False, numlock: bool = False) -> None:
+        self.layout = layout
+        # {event index (key down): (held bit, lock bit)} of the modifier keys
+        self._modifiers: dict[int, tuple[int, int]] = {}
+        # {id(deadkeys): DeadEntry}
+        self._dead_entries: dict[int, DeadEntry] = {}
+        # {frozenset(mods): keymap name}
+        keymaps = {frozenset(mods.split()): mods for mods in layout.keymaps}
+        # {logical mods: 512 entries of key down}
+        self.planes: dict[frozenset[str], list] = {}
+        self.tables: list[list | None] = [None] * state_count
+
+        for sc, key in enumerate(layout.keymaps['']):
+            if key is None:
+                continue
+            bits = vk_state_bits.get(key.vk)
+            if bits is not None:
+                self._modifiers[(sc & 0x7F) | (0x100 if sc & 0x80 else 0)] = bits
+
+        self._keymaps = keymaps
+        self.state = 0
+        self.table = self.tables[0]
+        self.dead: DeadEntry | None = None
+        self.sync(capslock, numlock)
+
+    def _logical_mods(self, state: int) -> frozenset[str]:
+        mods = set()
+        altgr = state & RAltBit and self.layout.alt_right_is_altgr
+        if state & (LShiftBit | RShiftBit):
+            mods.add('VK_SHIFT')
+        if state & (LCtrlBit | RCtrlBit) or altgr:
+            mods.add('VK_CONTROL')
+        if state & (LAltBit | RAltBit):
+            mods.add('VK_MENU')
+        if state & OEM8Bit:
+            mods.add('VK_OEM_8')
+        if state & KanaBit:
+            mods.add('VK_KANA')
+        if state & CapsLockBit:
+            mods.add('VK_CAPITAL')
+        if state & NumLockBit:
+            mods.add('VK_NUMLOCK')
+        return frozenset(mods)
+
+    def _dead_entry(self, accent: str, deadkeys: DeadKeysType) -> DeadEntry:
+        # tables are shared by the dead keys, but not always their accent
+        k = id(deadkeys)
+        entry = self._dead_entries.get(k)
+        if entry is None:
+            edges = {}
+            entry = self._dead_entries[k] = DeadEntry(accent, edges)
+            for dk in deadkeys.values():
+                edges[dk.with_] = (dk.text, self._dead_entry(dk.text, dk.deadkeys) if dk.deadkeys else None)
+        if entry.accent != accent:
+            entry = DeadEntry(accent, entry.edges)
+        return entry
+
+    def _plane(self, mods: frozenset[str]) -> list:
+        plane = self.planes.get(mods)
+        if plane is not None:
+            return plane
+
+        # keymaps without lock then fallback to the keymap without
+        # CapsLock (keys without CapsLock plane), then without NumLock
+        candidates = [mods]
+        for lock in ('VK_CAPITAL', 'VK_NUMLOCK'):
+            candidates += [m - {lock} for m in candidates if lock in m]
+        keymaps = [self.layout.keymaps[self._keymaps[m]] for m in candidates if m in self._keymaps]
+
+        plane = [None] * (table_size // 2)
+        for keymap in reversed(keymaps):
+            for sc, key in enumerate(keymap):
+                if key is None or not key.text:
+                    continue
+                i = (sc & 0x7F) | (0x100 if sc & 0x80 else 0)
+                plane[i] = self._dead_entry(key.text, key.deadkeys) if key.deadkeys else key.text
+
+        self.planes[mods] = plane
+        return plane
+
+    def state_table(self, state: int) -> list:
+        table = self.tables[state]
+        if table is not None:
+            return table
+
+        table = self._plane(self._logical_mods(state)) + [None] * (table_size // 2)
+        for i, (held, lock) in self._modifiers.items():
+            if lock:
+                table[i] = state if state & held else (state | held) ^ lock
+            else:
+                table[i] = state | held
+            table[i | ReleaseEntry] = state & ~held
+        self.tables[state] = table
+        return table
+
+    def sync(self, capslock: bool = False, numlock: bool = False) -> None:
+        # locks of a synchronize event
+        state = self.state & ~locks
+        if capslock:
+            state |= CapsLockBit
+        if numlock:
+            state |= NumLockBit
+        self.state = state
+        self.table = self.state_table(state)
+
+    def reset(self, capslock: bool = False, numlock: bool = False) -> None:
+        # keys released and no pending dead key
+        self.state = 0
+        self.dead = None
+        self.sync(capslock, numlock)
+
+    def feed(self, events: Iterable[int]) -> str:
+        # text typed by events
+        accu = []
+        append = accu.append
+        tables = self.tables
+        table = self.table
+        dead = self.dead
+        for event in events:
+            entry = table[(event & EntryMask) | (event >> 6 & ReleaseEntry)]
+            if entry is None:
+                continue
+            cls = entry.__class__
+            if cls is str:
+                if dead is None:
+                    append(entry)
+                else:
+                    dead = compose(dead, entry, accu)
+            elif cls is int:
+                table = tables[entry] or self.state_table(entry)
+                self.state = entry
+            elif dead is None:
+                dead = entry
+            else:
+                dead = compose(dead, entry, accu)
+        self.table = table
+        self.dead = dead
+        return ''.join(accu)
+
+    def decode(self, chunks: Iterable[Iterable[int]]) -> Iterator[str]:
+        # text of each chunk of events (a chunk is an iterable of events,
+        # a memoryview of a capture file...)
+        feed = self.feed
+        for events in chunks:
+            text = feed(events)
+            if text:
+                yield text
+
+
+def _little_endian_u16(view: memoryview) -> Iterable[int]:
+    if sys.byteorder == 'little':
+        return view.cast('H')
+    events = array('H', view)
+    events.byteswap()
+    return events
+
+
+def read_capture(filename: str, chunk_size: int = 1 << 16) -> Iterator[Iterable[int]]:
+    # chunks of chunk_size events of a capture file, without copy when
+    # the file can be mapped (not for a pipe)
+    with open(filename, 'rb') as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            # empty file or not mappable
+            data = f.read()
+            data = data[:len(data) & ~1]
+            for i in range(0, len(data), chunk_size * 2):
+                yield _little_endian_u16(memoryview(data[i:i + chunk_size * 2]))
+            return
+
+        with mm:
+            size = len(mm) & ~1
+            view = memoryview(mm)
+            try:
+                for i in range(0, size, chunk_size * 2):
+                    chunk = view[i:min(size, i + chunk_size * 2)]
+                    events = _little_endian_u16(chunk)
+                    try:
+                        yield events
+                    finally:
+                        # the map cannot be closed with exported views
+                        if isinstance(events, memoryview):
+                            events.release()
+                        chunk.release()
+            finally:
+                view.release()
+
+
+def decode_capture(decoder: ScancodeDecoder, filename: str, chunk_size: int = 1 << 16) -> Iterator[str]:
+    return decoder.decode(read_capture(filename, chunk_size))
+
+
+def write_capture(filename: str, events: Iterable[int]) -> int:
+    data = array('H', events)
+    if sys.byteorder != 'little':
+        data.byteswap()
+    with open(filename, 'wb') as f:
+        data.tofile(f)
+    return len(data)
+
+
+def usage(argv0: str) -> None:
+    print(argv0, 'KLID capture.bin [--capslock] [--numlock] [--encode {text | @file} [--repeat N]]'
+          ' [-j N] [--cache DIR] {layout.xml | layouts.tar.zst}...', file=sys.stderr)
+
+
+def main(argv: list[str]) -> int:
+    # scancode_decoder.py KLID capture.bin [options] [parser options] layouts...
+    # --encode writes the events of a text (text_encoder.py) in capture.bin
+    # before decoding it
+    if len(argv) < 4:
+        usage(argv[0])
+        return 1
+
+    klid = argv[1].lower().rjust(8, '0')
+    capture = argv[2]
+    capslock = False
+    numlock = False
+    text = None
+    repeat = 1
+
+    iargv = 3
+    while iargv < len(argv):
+        arg = argv[iargv]
+        has_value = iargv + 1 < len(argv)
+        if arg == '--capslock':
+            capslock = True
+        elif arg == '--numlock':
+            numlock = True
+        elif arg == '--encode' and has_value:
+            iargv += 1
+            text = argv[iargv]
+            if text.startswith('@'):
+                with open(text[1:], encoding='utf-8') as f:
+                    text = f.read()
+        elif arg == '--repeat' and has_value:
+            iargv += 1
+            repeat = int(argv[iargv])
+        else:
+            break
+        iargv += 1
+
+    layouts = parse_argv(argv[:1] + ['--klid', klid] + argv[iargv:])
+    if not layouts:
+        print(f'unknown KLID: {klid}', file=sys.stderr)
+        return 1
+    layout = layouts[0]
+
+    if text is not None:
+        from text_encoder import TextEncoder
+        from gen_reversed_keylayout import reverse_layout
+        encoder = TextEncoder(reverse_layout(layout, []))
+        encoded = encoder.encode(text, capslock_on=capslock)
+        n = write_capture(capture, encoded.events * repeat)
+        print(f'{capture}: {n} events', file=sys.stderr)
+
+    decoder = ScancodeDecoder(layout, capslock=capslock, numlock=numlock)
+    outputs = []
+    chars = 0
+    events = 0
+    t = time.perf_counter()
+    for chunk in read_capture(capture):
+        events += len(chunk)
+        output = decoder.feed(chunk)
+        chars += len(output)
+        if text is None:
+            sys.stdout.write(output.replace('\r', '\n'))
+        else:
+            outputs.append(output)
+    elapsed = time.perf_counter() - t
+
+    if text is not None:
+        # without the characters of the text which have no key, Enter types '\r'
+        expected = ''.join(c for c in text if c not in encoded.unencodable)
+        expected = expected.replace('\r\n', '\r').replace('\n', '\r') * repeat
+        ok = ''.join(outputs) == expected
+        print(f'round trip: {"ok" if ok else "mismatch"}', file=sys.stderr)
+        if not ok:
+            return 1
+    print(f'{layout.display_name}: {events} events, {chars} characters in {elapsed:.3f}s'
+          f' ({events / elapsed / 1e6 if elapsed else 0:.2f}M events/s)', file=sys.stderr)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
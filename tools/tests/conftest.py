@@ -0,0 +1,26 @@
+# tests of the Python tools: python -m pytest tools/tests
+import os
+import sys
+
+import pytest
+
+tools_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, tools_dir)
+
+from kbd_parser import KeyLayout, parse_argv  # noqa: E402
+
+archive = os.path.join(tools_dir, 'kbdlayout.info.tar.zst')
+
+
+@pytest.fixture(scope='session')
+def layouts() -> list[KeyLayout]:
+    # every layout of kbdlayout.info (a layout without metadata is in error)
+    errors = []
+    layouts = parse_argv(['kbd_parser.py', archive], errors=errors)
+    assert len(errors) <= 1
+    return layouts
+
+
+@pytest.fixture(scope='session')
+def layouts_by_klid(layouts) -> dict[str, KeyLayout]:
+    return {layout.klid: layout for layout in layouts}
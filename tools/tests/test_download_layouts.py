@@ -0,0 +1,100 @@
+import itertools
+import os
+import tarfile
+import threading
+import time
+
+import pytest
+
+from download_layouts import HttpClient, download, read_archive
+from kbd_parser import read_sources
+from kbdlayout_server import LayoutServer, load_layouts
+
+from conftest import archive
+
+
+def no_log(message):
+    pass
+
+
+@pytest.fixture(scope='module')
+def server():
+    layouts = load_layouts(itertools.islice(read_sources([archive]), 12), time.time() - 3600)
+    server = LayoutServer(('localhost', 0), layouts)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def base_url(server):
+    return f'http://localhost:{server.server_port}'
+
+
+def check_archive(filename, server):
+    members = read_archive(filename)
+    assert members.keys() == server.layouts.keys()
+    for klid, member in members.items():
+        assert member.etag == server.layouts[klid].etag
+        assert f'KLID="{klid}"'.encode() in member.data
+    assert not os.path.exists(f'{filename}.partial')
+
+
+def test_download_and_revalidate(server, tmp_path):
+    filename = str(tmp_path / 'layouts.tar.zst')
+    count = len(server.layouts)
+
+    stats = download(filename, base_url(server), jobs=4, log=no_log)
+    assert (stats.layouts, stats.downloaded, stats.not_modified, stats.errors) == (count, count, 0, [])
+    # one keep-alive connection per thread (the index is fetched by the caller)
+    assert stats.connections <= 1 + 4
+    check_archive(filename, server)
+    data = read_archive(filename)
+
+    not_modified = server.not_modified
+    stats = download(filename, base_url(server), jobs=4, log=no_log)
+    assert (stats.downloaded, stats.not_modified, stats.errors) == (0, count, [])
+    assert server.not_modified - not_modified == count
+    check_archive(filename, server)
+    assert read_archive(filename) == data
+
+
+class InterruptedClient(HttpClient):
+    # interrupted (as by Ctrl+C) after some layouts
+
+    def __init__(self, base_url, layouts):
+        super().__init__(base_url)
+        self.layouts = layouts
+
+    def get(self, path, headers=None):
+        if path.endswith('/download/xml'):
+            with self._lock:
+                self.layouts -= 1
+                if self.layouts < 0:
+                    raise KeyboardInterrupt
+        return super().get(path, headers)
+
+
+def test_resume(server, tmp_path):
+    filename = str(tmp_path / 'layouts.tar.zst')
+    partial = f'{filename}.partial'
+    count = len(server.layouts)
+
+    with pytest.raises(KeyboardInterrupt):
+        download(filename, jobs=1, client=InterruptedClient(base_url(server), 6), log=no_log)
+    assert not os.path.exists(filename)
+
+    # interrupted during the write of the last member
+    with tarfile.open(partial) as tar:
+        infos = tar.getmembers()
+    assert len(infos) == 6
+    with open(partial, 'r+b') as f:
+        f.truncate(infos[-1].offset_data + infos[-1].size // 2)
+
+    requests = server.requests
+    stats = download(filename, base_url(server), jobs=4, log=no_log)
+    assert (stats.resumed, stats.downloaded, stats.errors) == (5, count - 5, [])
+    # index, locale pages and the missing layouts
+    assert server.requests - requests == 1 + len(server.locales) + count - 5
+    check_archive(filename, server)
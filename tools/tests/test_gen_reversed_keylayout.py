@@ -0,0 +1,21 @@
+import io
+import struct
+
+import pytest
+
+from gen_reversed_keylayout import binary_magic, generate, output_formats
+
+
+@pytest.mark.parametrize('output_format', output_formats)
+def test_generate_without_layout(output_format):
+    # e.g. a --klid or --locale that matches nothing
+    out = io.BytesIO() if output_format == 'bin' else io.StringIO()
+    assert generate([], out, output_format) == []
+    data = out.getvalue()
+    assert data
+    if output_format == 'bin':
+        magic, nsections = struct.unpack_from('<II', data)
+        assert magic == binary_magic
+        # the sections are empty, except the first offset of the offset tables
+        sections = struct.unpack_from(f'<{nsections * 2}I', data, 8)
+        assert sum(sections[1::2]) == 4 * 6
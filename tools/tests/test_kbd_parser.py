@@ -0,0 +1,198 @@
+import os
+from glob import glob
+from io import BytesIO, StringIO
+
+import pytest
+
+import kbd_parser
+from gen_reversed_keylayout import generate
+from kbd_parser import (LayoutCache, filter_sources, null_fn, parse_argv, parse_files, parse_xml_layout, read_archive,
+                        read_sources, share_keymaps)
+from layout_db import write_db
+
+from conftest import archive
+
+
+def klids(layouts):
+    return [layout.klid for layout in layouts]
+
+
+def test_parse_argv_order(layouts_by_klid, tmp_path):
+    # layouts in the order of the paths, compiled databases included
+    db1 = str(tmp_path / 'de.kldb')
+    db2 = str(tmp_path / 'us.kldb')
+    write_db([layouts_by_klid['00000407']], db1)
+    write_db([layouts_by_klid['00000409']], db2)
+
+    selection = ['--klid', '407,409,40c,80c']
+    parsed = klids(parse_argv(['x', *selection, archive]))
+    assert sorted(parsed) == ['00000407', '00000409', '0000040c', '0000080c']
+
+    assert klids(parse_argv(['x', *selection, archive, db1])) == parsed + ['00000407']
+    assert klids(parse_argv(['x', *selection, db2, archive, db1])) == ['00000409', *parsed, '00000407']
+    layouts = parse_argv(['x', *selection, db1, db2])
+    assert klids(layouts) == ['00000407', '00000409']
+    assert layouts[1].keymaps[''][0x10].text == 'q'
+
+
+def test_share_keymaps_split(monkeypatch):
+    # a new KeyTable when any u16 id (key, string, dead key) would be exhausted
+    selection = ['409', '40c', '407', '80c', '807', '20409', '2040c', '20407']
+    layouts = parse_files(filter_sources(read_sources([archive]), selection, []))
+    max_ids = 300
+    monkeypatch.setattr(kbd_parser, '_max_table_ids', max_ids)
+    shared = share_keymaps(layouts)
+
+    tables = {id(keymap.table): keymap.table for layout in shared for keymap in layout.keymaps.values()}
+    assert len(tables) > 1
+    for table in tables.values():
+        assert len(table) <= max_ids
+        assert len(table.strings) <= max_ids
+        assert len(table.deadkeys) <= max_ids
+    for layout, shared_layout in zip(layouts, shared):
+        for mods, keymap in layout.keymaps.items():
+            assert list(shared_layout.keymaps[mods]) == list(keymap)
+
+
+def test_archive_as_glob(layouts, tmp_path):
+    # the members of an archive are sorted like the extracted files
+    names = [source.name.rpartition('/')[2] for source in read_archive(archive, stream=True)]
+    assert names != sorted(names)
+    for source in read_archive(archive, stream=True):
+        (tmp_path / source.name.rpartition('/')[2]).write_bytes(source.data)
+    paths = sorted(glob(f'{tmp_path}/*.xml'))
+    assert [source.name.rpartition('/')[2] for source in read_archive(archive)] == sorted(names)
+
+    errors = []
+    extracted = parse_argv(['x', *paths], errors=errors)
+    assert len(errors) <= 1
+    assert klids(extracted) == klids(layouts)
+
+    def js(layouts):
+        out = StringIO()
+        generate(layouts, out)
+        return out.getvalue()
+    assert js(extracted) == js(layouts)
+
+
+_metadata = '<metadata KLID="00000409" LocaleName="en-US" LayoutDisplayName="US"/>'
+_pk = '<PK VK="VK_A" SC="1E"><Result Text="a"/>%s</PK>'
+_deadkey = '<Result With="VK_SHIFT"><DeadKeyTable Accent="~"><Result Text="ã" With="a"/></DeadKeyTable></Result>'
+
+
+def _layout_xml(*children: str) -> BytesIO:
+    xml = f'<KeyboardLayout RightAltIsAltGr="false">{"".join(children)}</KeyboardLayout>'
+    return BytesIO(xml.encode())
+
+
+@pytest.mark.parametrize('children, error', [
+    (('<PhysicalKeys/>', _metadata), 'tag = PhysicalKeys, but metadata expected'),
+    ((_metadata, '<PhysicalKeys><Key/></PhysicalKeys>'), 'tag = Key, but PK expected'),
+    ((_metadata, f'<PhysicalKeys>{_pk % "<Text/>"}</PhysicalKeys>'), 'tag = Text, but Result expected'),
+    ((_metadata, f'<PhysicalKeys>{_pk % _deadkey.replace("DeadKeyTable", "Table")}</PhysicalKeys>'),
+     'tag = Table, but DeadKeyTable expected'),
+    ((_metadata, f'<PhysicalKeys>{_pk % _deadkey.replace("<Result Text", "<R Text")}</PhysicalKeys>'),
+     'tag = R, but Result expected'),
+])
+def test_parse_xml_layout_tags(children, error):
+    with pytest.raises(Exception, match=error):
+        parse_xml_layout(_layout_xml(*children), null_fn)
+
+
+def test_parse_xml_layout_minimal():
+    layout = parse_xml_layout(_layout_xml(_metadata, f'<PhysicalKeys>{_pk % _deadkey}</PhysicalKeys>'), null_fn)
+    assert layout.klid == '00000409'
+    assert layout.keymaps[''][0x1E].text == 'a'
+    assert layout.keymaps['VK_SHIFT'][0x1E].deadkeys
+
+
+def _write_layouts(tmp_path, *selection: str) -> list[str]:
+    paths = []
+    for source in filter_sources(read_archive(archive), selection, []):
+        path = tmp_path / source.name.rpartition('/')[2]
+        path.write_bytes(source.data)
+        paths.append(str(path))
+    return paths
+
+
+def _cached_files(path) -> list[str]:
+    return sorted(name for name in os.listdir(path) if name.endswith('.pickle'))
+
+
+def test_layout_cache(tmp_path, monkeypatch):
+    path, = _write_layouts(tmp_path, '409')
+    cache_path = tmp_path / 'cache'
+
+    def parse():
+        cache = LayoutCache(str(cache_path))
+        layout, = parse_files([path], cache=cache)
+        assert layout.keymaps[''][0x1E].text == 'a'
+        return cache, layout
+
+    cache, layout = parse()
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert len(_cached_files(cache_path)) == 1
+
+    cache, layout = parse()
+    assert (cache.hits, cache.misses) == (1, 0)
+    assert len(_cached_files(cache_path)) == 1
+
+    # the content changed
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(data.replace(b'LayoutDisplayName="US"', b'LayoutDisplayName="US edited"'))
+    cache, layout = parse()
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert layout.origin_display_name == 'US edited'
+    assert len(_cached_files(cache_path)) == 2
+
+    # the parser changed
+    monkeypatch.setattr(kbd_parser, 'PARSER_VERSION', kbd_parser.PARSER_VERSION + 1)
+    cache, layout = parse()
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert len(_cached_files(cache_path)) == 3
+
+
+def test_layout_cache_lru(tmp_path):
+    paths = _write_layouts(tmp_path, '407', '409', '40c')
+    cache_path = str(tmp_path / 'cache')
+    cache = LayoutCache(cache_path)
+    parse_files(paths, cache=cache)
+    keys = []
+    for i, path in enumerate(paths):
+        with open(path, 'rb') as f:
+            keys.append(cache.key(f.read()))
+        os.utime(os.path.join(cache_path, f'{keys[-1]}.pickle'), (1000 + i, 1000 + i))
+    assert _cached_files(cache_path) == sorted(f'{key}.pickle' for key in keys)
+
+    # a hit makes the oldest entry the most recently used
+    assert cache.get(keys[0])
+    sizes = [os.path.getsize(os.path.join(cache_path, f'{key}.pickle')) for key in keys]
+    cache.max_size = sum(sizes) - 1
+    cache.prune()
+    assert _cached_files(cache_path) == sorted(f'{key}.pickle' for key in (keys[0], keys[2]))
+
+    cache.max_size = sizes[0]
+    cache.prune()
+    assert _cached_files(cache_path) == [f'{keys[0]}.pickle']
+
+
+def test_clear_cache(tmp_path):
+    path, = _write_layouts(tmp_path, '409')
+    cache_path = str(tmp_path / 'cache')
+    parse_argv(['x', '--cache', cache_path, path])
+    assert len(_cached_files(cache_path)) == 1
+
+    with pytest.raises(SystemExit) as e:
+        parse_argv(['x', '--cache', cache_path, '--clear-cache'])
+    assert e.value.code == 0
+    assert _cached_files(cache_path) == []
+
+    # cleared, then filled by the parse
+    parse_argv(['x', '--cache', cache_path, path])
+    cached = _cached_files(cache_path)
+    with open(os.path.join(cache_path, 'stale.pickle'), 'wb'):
+        pass
+    parse_argv(['x', '--cache', cache_path, '--clear-cache', path])
+    assert _cached_files(cache_path) == cached
@@ -0,0 +1,125 @@
+# ReversedKeymap replays the key events of test/scancodes.js (lib/scancodes.js)
+import os
+import re
+
+import pytest
+
+from keystroke_service import (AltGrMod, AltMod, CapsLockMod, CtrlMod, KeyAcquire, KeyRelease, NumLockMod,
+                               ReversedKeymap, RightCtrlMod, RightShiftMod, ShiftMod, SyncFlags,
+                               compile_layouts)
+
+from conftest import tools_dir
+
+
+scancodes_js = os.path.join(os.path.dirname(tools_dir), 'test', 'scancodes.js')
+
+# rkeymap variables of test/scancodes.js
+keymap_klids = {
+    'rkeymapFr': '0000040c',
+    'rkeymapUsInternational': '00020409',
+    'rkeymapEn': '00000409',
+    'rkeymapDoubleDeadKey': '0001045c',
+    'rkeymapDeExtended': '00020407',
+}
+
+constants = {
+    'NoMod': 0, 'ShiftMod': ShiftMod, 'AltGrMod': AltGrMod, 'CapsLockMod': CapsLockMod, 'CtrlMod': CtrlMod,
+    'AltMod': AltMod, 'NumLockMod': NumLockMod, 'RightShiftMod': RightShiftMod, 'RightCtrlMod': RightCtrlMod,
+    'SyncFlags': SyncFlags, 'KeyAcquire': KeyAcquire, 'KeyRelease': KeyRelease,
+    'undefined': None, 'true': True, 'false': False,
+}
+
+_string_re = re.compile(r'"(?:[^"\\]|\\.)*"')
+_keymap = r'(rkeymap\w+)'
+statement_res = (
+    ('sync', re.compile(_keymap + r'\.sync\((.*)\)$', re.S)),
+    ('key', re.compile(r't\.hexArrayEqual\(' + _keymap + r'\.toScancodesAndFlags\((.*?)\), (.*)\)$', re.S)),
+    ('key', re.compile(_keymap + r'\.toScancodesAndFlags\((.*?)\)(\.push\(0\))$', re.S)),
+    ('mod_flags', re.compile(r't\.hexEqual\(' + _keymap + r'\.getModFlags\(\), (.*)\)$', re.S)),
+    ('virtual_mod_flags', re.compile(r't\.hexEqual\(' + _keymap + r'\.getVirtualModFlags\(\), (.*)\)$', re.S)),
+    ('ctrl_and_alt_is_altgr', re.compile(_keymap + r'\.ctrlAndAltIsAltGr = (true|false)$')),
+    ('property', re.compile(r't\.(?:hexEqual|equal)\(' + _keymap + r'\.(layout\.\w+|ctrlAndAltIsAltGr), (.*)\)$')),
+    ('const', re.compile(r'const (\w+) = ("[^"]*")$')),
+)
+
+
+def read_statements(filename):
+    # (line, kind, groups) of the statements of test/scancodes.js which use
+    # a ReversedKeymap, in order (the state of a keymap is kept between tests)
+    statements = []
+    accu = []
+    depth = 0
+    first_line = 0
+    with open(filename, encoding='utf-8') as f:
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not accu:
+                if not line.startswith(('rkeymap', 't.', 'const ')):
+                    continue
+                first_line = n
+            accu.append(line)
+            code = _string_re.sub('""', line)
+            depth += code.count('(') + code.count('[') - code.count(')') - code.count(']')
+            if depth > 0:
+                continue
+            statement = ' '.join(accu).removesuffix(';')
+            accu = []
+            depth = 0
+            for kind, statement_re in statement_res:
+                m = statement_re.match(statement)
+                if m:
+                    statements.append((first_line, kind, m.groups()))
+                    break
+    return statements
+
+
+# ReversedKeymap (lib/scancodes.js) property -> value of a ReversedKeymap
+properties = {
+    'layout.klid': lambda keymap: int(keymap.layout.klid, 16),
+    'layout.altRightIsAltGr': lambda keymap: keymap.layout.alt_right_is_altgr,
+    'layout.ctrlRightIsOem8': lambda keymap: keymap.layout.ctrl_right_is_oem8,
+    'ctrlAndAltIsAltGr': lambda keymap: keymap.ctrl_and_alt_is_altgr,
+}
+
+
+def js_eval(expression, variables):
+    return eval(expression, {'__builtins__': {}}, {**constants, **variables})
+
+
+@pytest.fixture(scope='module')
+def keymaps(layouts):
+    compiled = compile_layouts(layout for layout in layouts if layout.klid in keymap_klids.values())
+    return {name: ReversedKeymap(compiled[klid]) for name, klid in keymap_klids.items()}
+
+
+def test_scancodes_js(keymaps):
+    statements = read_statements(scancodes_js)
+    assert len(statements) > 500
+    variables = {}
+    checked = 0
+    for line, kind, groups in statements:
+        where = f'test/scancodes.js:{line}'
+        if kind == 'const':
+            variables[groups[0]] = js_eval(groups[1], variables)
+            continue
+
+        keymap = keymaps[groups[0]]
+        if kind == 'sync':
+            keymap.sync(js_eval(groups[1], variables))
+        elif kind == 'ctrl_and_alt_is_altgr':
+            keymap.ctrl_and_alt_is_altgr = groups[1] == 'true'
+        elif kind == 'property':
+            if groups[1] in properties:
+                assert properties[groups[1]](keymap) == js_eval(groups[2], variables), where
+                checked += 1
+        elif kind == 'key':
+            key, code, flag = js_eval(f'({groups[1]})', variables)
+            scancodes = keymap.to_scancodes_and_flags(key, code, flag)
+            if groups[2] != '.push(0)':
+                expected = js_eval(groups[2], variables)
+                assert (list(scancodes) if scancodes is not None else None) == expected, where
+                checked += 1
+        else:
+            assert getattr(keymap, kind) == js_eval(groups[1], variables), where
+            checked += 1
+    assert checked > 500
@@ -0,0 +1,58 @@
+from kbd_parser import LayoutSource
+from layout_catalog import LayoutCatalog
+
+from conftest import archive
+
+
+def header(layout):
+    return (layout.klid, layout.locale_name, layout.display_name, layout.origin_display_name,
+            layout.alt_right_is_altgr)
+
+
+def test_scan(layouts):
+    # same layouts as parse_argv() without parsing them
+    errors = []
+    catalog = LayoutCatalog.from_paths([archive], errors=errors)
+    assert len(errors) <= 1
+    assert [header(layout) for layout in catalog] == [header(layout) for layout in layouts]
+    assert catalog.loaded() == 0
+
+
+def test_select():
+    catalog = LayoutCatalog.from_paths([archive], errors=[])
+    assert [layout.klid for layout in catalog.select(['409', '0000040C'])] == ['00000409', '0000040c']
+    assert catalog.find('409').origin_display_name == 'US'
+    fr_ch = catalog.select(locales=['fr-ch'])
+    assert [layout.klid for layout in fr_ch] == ['0000100c']
+    assert [layout.klid for layout in catalog.select(['409'], ['fr-CH'])] == ['00000409', '0000100c']
+    assert catalog.select() == list(catalog)
+    assert catalog.select(['12345678']) == []
+    assert catalog.loaded() == 0
+
+
+def test_load_lru():
+    catalog = LayoutCatalog.from_paths([archive], max_layouts=2, errors=[])
+    us, fr, de = (catalog.find(klid) for klid in ('409', '40c', '407'))
+
+    assert us.keymaps[''][0x1E].text == 'a'
+    assert fr.keymaps[''][0x10].text == 'a'
+    assert us.keymaps['VK_SHIFT'][0x1E].text == 'A'
+    assert (catalog.hits, catalog.misses, catalog.loaded()) == (1, 2, 2)
+
+    # fr is the least recently used
+    assert de.keymaps[''][0x15].text == 'z'
+    assert (catalog.hits, catalog.misses, catalog.loaded()) == (1, 3, 2)
+    assert us.layout() is us.layout()
+    assert fr.keymaps[''][0x10].text == 'a'
+    assert (catalog.hits, catalog.misses, catalog.loaded()) == (3, 4, 2)
+
+
+def test_errors(tmp_path):
+    path = tmp_path / 'broken.xml'
+    path.write_bytes(b'<KeyboardLayout RightAltIsAltGr="false"><metadata KLID="00000409"/></KeyboardLayout>')
+    errors = []
+    catalog = LayoutCatalog([str(path), LayoutSource('truncated.xml', b'<KeyboardLayout')], errors=errors)
+    assert len(catalog) == 0
+    assert len(errors) == 2
+    assert errors[0].startswith(f'{path}: ')
+    assert errors[1].startswith('truncated.xml: ')
@@ -0,0 +1,34 @@
+from layout_detector import DetectionIndex, LayoutDetector, plane_from_modifiers, simulate_typing
+
+
+def detect(index, events, locale_hint=None):
+    detector = LayoutDetector(index, locale_hint)
+    for key, code, plane in events:
+        detector.observe(key, code, plane)
+    return detector
+
+
+def test_typed_text(layouts, layouts_by_klid):
+    index = DetectionIndex(layouts)
+    for klid in ('00000409', '0000040c', '00000407'):
+        layout = layouts_by_klid[klid]
+        detector = detect(index, simulate_typing(layout, 'The quick brown fox; 1234!?'), layout.locale_name)
+        assert detector.mismatches == 0
+        assert detector.best().klid == klid
+
+
+def test_capslock(layouts):
+    # with CapsLock, the keys without CapsLock plane type their text without it
+    index = DetectionIndex(layouts)
+    capslock = plane_from_modifiers(capslock=True)
+    events = [('H', 'KeyH', capslock), ('I', 'KeyI', capslock), ('1', 'Digit1', capslock),
+              (';', 'Semicolon', capslock), ('[', 'BracketLeft', capslock), (',', 'Comma', capslock),
+              ('/', 'Slash', capslock)]
+    detector = detect(index, events, 'en-US')
+    assert detector.mismatches == 0
+    assert detector.best().klid == '00000409'
+
+    # a layout with a CapsLock plane for the key: shift lock of the french layout
+    detector = detect(index, [('1', 'Digit1', capslock), ('A', 'KeyQ', capslock)], 'fr-FR')
+    assert detector.mismatches == 0
+    assert detector.best().klid == '0000040c'
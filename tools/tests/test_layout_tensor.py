@@ -0,0 +1,41 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from kbd_parser import keymap_names
+from layout_tensor import from_layouts, load_tensor, lookup, reverse_index, save_tensor, typeable_layouts
+
+
+@pytest.fixture(scope='module')
+def tensor(layouts_by_klid):
+    # US, French, Russian
+    return from_layouts([layouts_by_klid[klid] for klid in ('00000409', '0000040c', '00000419')])
+
+
+def test_lookup(tensor):
+    index = reverse_index(tensor)
+    no_mod = keymap_names.index('')
+    shift = keymap_names.index('VK_SHIFT')
+    assert tensor.codepoints[0, no_mod, 0x1E] == ord('a')
+
+    found = lookup(index, 'a', 0).tolist()
+    assert [0, no_mod, 0x1E] in found
+    assert all(sc == 0x1E for _, _, sc in found)
+    assert [1, no_mod, 0x10] in lookup(index, 'a', 1).tolist()
+    assert [0, shift, 0x1E] in lookup(index, 'A').tolist()
+    assert lookup(index, '€', 0).size == 0
+
+
+def test_typeable_layouts(tensor, tmp_path):
+    index = reverse_index(tensor)
+    assert typeable_layouts(index, 'hello').tolist() == [True, True, False]
+    assert typeable_layouts(index, 'ж').tolist() == [False, False, True]
+    # ~ is a dead key of the French layout
+    assert typeable_layouts(index, '~').tolist() == [True, False, False]
+    assert typeable_layouts(reverse_index(tensor, with_deadkeys=True), '~').tolist() == [True, True, False]
+
+    filename = str(tmp_path / 'layouts.npz')
+    save_tensor(filename, tensor)
+    loaded = load_tensor(filename)
+    assert loaded.klids == tensor.klids
+    assert np.array_equal(loaded.chars, tensor.chars)
@@ -0,0 +1,53 @@
+import pytest
+
+from layout_transcoder import TranscoderCache
+from scancode_decoder import KeyRelease, ScancodeDecoder
+from text_encoder import TextEncoder
+from gen_reversed_keylayout import reverse_layout
+
+LShift = 0x2A
+RShift = 0x36
+LCtrl = 0x1D
+
+
+def tap(*scancodes):
+    # keys pressed in order and released in reverse order
+    return [*scancodes, *(scancode | KeyRelease for scancode in reversed(scancodes))]
+
+
+@pytest.fixture(scope='module')
+def cache(layouts):
+    return TranscoderCache(layouts)
+
+
+@pytest.mark.parametrize('source, target', [('409', '40c'), ('40c', '409')])
+def test_text(cache, source, target):
+    text = 'Hello, World! 1234 azerty qwerty [{(@#)}]'
+    source_layout = cache._layout(source)
+    events = TextEncoder(reverse_layout(source_layout, [])).encode(text).events
+    transcoded = cache.transcoder(source, target).feed(events)
+    assert ScancodeDecoder(cache._layout(target)).feed(transcoded) == text
+
+
+@pytest.mark.parametrize('source, target', [('409', '40c'), ('40c', '409')])
+@pytest.mark.parametrize('events, expected', [
+    # keys without text
+    (tap(LShift, 0x14B), [LShift, 0x14B, LShift | KeyRelease, 0x14B | KeyRelease]),
+    (tap(RShift, 0x3F), [LShift, 0x3F, LShift | KeyRelease, 0x3F | KeyRelease]),
+    (tap(0x14B), tap(0x14B)),
+    # control characters
+    (tap(LShift, 0x0F), tap(LShift, 0x0F)),
+    (tap(RShift, 0x1C), tap(LShift, 0x1C)),
+    (tap(0x0F), tap(0x0F)),
+    # shortcuts
+    (tap(LCtrl, LShift, 0x14), [LCtrl, *tap(LShift, 0x14), LCtrl | KeyRelease]),
+    (tap(LCtrl, 0x14), [LCtrl, 0x14, 0x14 | KeyRelease, LCtrl | KeyRelease]),
+])
+def test_shift(cache, source, target, events, expected):
+    assert cache.transcoder(source, target).feed(events) == expected
+
+
+def test_shortcut_of_text(cache):
+    # Ctrl+Shift+A on AZERTY (Q key) is Ctrl+Shift+A on QWERTY
+    transcoder = cache.transcoder('40c', '409')
+    assert transcoder.feed(tap(LCtrl, LShift, 0x10)) == [LCtrl, *tap(LShift, 0x1E), LCtrl | KeyRelease]
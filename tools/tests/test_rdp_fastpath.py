@@ -0,0 +1,111 @@
+from array import array
+
+import pytest
+
+from rdp_fastpath import (DefaultMaxPduSize, Extended, Extended1, FastPathEncoder, KeyRelease, decode,
+                          decode_pdu, encode_into, encoded_size, iter_pdus, max_events_per_pdu, pdu_size)
+
+
+def encode(events, max_pdu_size=DefaultMaxPduSize):
+    buffer = bytearray(encoded_size(len(events), max_pdu_size))
+    ends = encode_into(buffer, events, max_pdu_size)
+    assert ends[-1] == len(buffer)
+    return bytes(buffer), ends
+
+
+def test_small_pdu():
+    # 1 byte length, numEvents in the header
+    data, ends = encode([0x1E, 0x1E | KeyRelease])
+    assert data == bytes([2 << 2, 6, 0x00, 0x1E, 0x01, 0x1E])
+    assert ends == [6]
+    assert decode(data) == [0x1E, 0x1E | KeyRelease]
+
+
+def test_flags():
+    # eventHeader of each combination of release, extended and extended1
+    events = [0x45 | flags for flags in (0, KeyRelease, Extended, KeyRelease | Extended, Extended1,
+                                         KeyRelease | Extended1, Extended | Extended1,
+                                         KeyRelease | Extended | Extended1)]
+    data, _ends = encode(events)
+    assert data[:2] == bytes([8 << 2, 2 + 16])
+    assert list(data[2::2]) == [0, 1, 2, 3, 4, 5, 6, 7]
+    assert set(data[3::2]) == {0x45}
+    assert decode(data) == events
+
+
+@pytest.mark.parametrize('event', [0x400, 0x4000, 0x1E | 0x800])
+def test_invalid_event(event):
+    with pytest.raises(ValueError):
+        encode([0x1E, event])
+
+
+def test_explicit_event_count():
+    # more than 15 events: numEvents byte after the length
+    events = [0x10 + i % 32 | (KeyRelease if i & 1 else 0) for i in range(16)]
+    data, _ends = encode(events)
+    assert data[0] == 0
+    assert data[1] == len(data) == 3 + 32
+    assert data[2] == 16
+    assert decode(data) == events
+
+    events = events[:15]
+    data, _ends = encode(events)
+    assert data[0] == 15 << 2
+    assert data[1] == len(data) == 2 + 30
+    assert decode(data) == events
+
+
+def test_two_bytes_length():
+    # more than 0x7F bytes: big endian length | 0x8000
+    events = [0x1E | (KeyRelease if i & 1 else 0) | (Extended if i & 2 else 0) for i in range(255)]
+    data, ends = encode(events)
+    assert len(data) == pdu_size(255) == 1 + 2 + 1 + 255 * 2
+    assert ends == [len(data)]
+    assert data[0] == 0
+    assert (data[1] << 8 | data[2]) == 0x8000 | len(data)
+    assert data[3] == 255
+    assert decode(data) == events
+
+    # 62 events: 1 + 1 + 1 + 124 = 127 bytes, 63 events: 2 bytes length
+    assert encode([0x1E] * 62)[0][1] == 127
+    data = encode([0x1E] * 63)[0]
+    assert (data[1], data[2]) == (0x80, 130)
+
+
+@pytest.mark.parametrize('max_pdu_size', [pdu_size(1), 32, 0x7F, 0x80, 200, DefaultMaxPduSize])
+def test_max_pdu_size(max_pdu_size):
+    n = max_events_per_pdu(max_pdu_size)
+    events = array('H', (sc | flags for sc in range(1, 0x80) for flags in (0, KeyRelease)))
+    data, ends = encode(events, max_pdu_size)
+    pdus = list(iter_pdus(data))
+    assert len(pdus) == len(ends) == -(-len(events) // n)
+    assert all(len(pdu) <= max_pdu_size for pdu in pdus)
+    assert [len(decode_pdu(pdu)) for pdu in pdus[:-1]] == [n] * (len(pdus) - 1)
+    assert decode(data) == events.tolist()
+
+
+def test_max_pdu_size_range():
+    with pytest.raises(ValueError):
+        max_events_per_pdu(pdu_size(1) - 1)
+    with pytest.raises(ValueError):
+        max_events_per_pdu(0x8000)
+
+
+def test_buffer_offset():
+    events = [0x2A, 0x1E, 0x1E | KeyRelease, 0x2A | KeyRelease]
+    size = encoded_size(len(events))
+    buffer = bytearray(3 + size)
+    assert encode_into(buffer, events, offset=3) == [3 + size]
+    assert decode(buffer[3:]) == events
+    with pytest.raises(ValueError):
+        encode_into(bytearray(size - 1), events)
+
+
+def test_encoder():
+    encoder = FastPathEncoder(max_pdu_size=64, capacity=8)
+    events = [0x1E | (KeyRelease if i & 1 else 0) for i in range(100)]
+    pdus = encoder.encode(events)
+    assert len(pdus) == 4
+    assert decode(b''.join(pdus)) == events
+    # the buffer is reused
+    assert decode(b''.join(encoder.encode(events[:10]))) == events[:10]
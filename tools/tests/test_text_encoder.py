@@ -0,0 +1,62 @@
+import io
+
+import pytest
+
+from gen_reversed_keylayout import reverse_layout
+from kbd_parser import null_fn, parse_xml_layout
+from scancode_decoder import ScancodeDecoder
+from text_encoder import TextEncoder
+
+
+# ~ ~ ~ e types ẽ (dead key tables chained 3 times)
+chained_deadkeys_xml = b'''<KeyboardLayout RightAltIsAltGr="true">
+  <metadata KLID="a0000409" LocaleName="en-US" LayoutDisplayName="Chained dead keys"/>
+  <PhysicalKeys>
+    <PK VK="VK_OEM_3" SC="29">
+      <Result With="">
+        <DeadKeyTable Accent="~" Name="Tilde">
+          <Result Text="\xc3\xa3" With="a" />
+          <Result With="~">
+            <DeadKeyTable Accent="\xe2\x89\x88" Name="Double tilde">
+              <Result With="~">
+                <DeadKeyTable Accent="\xe2\x89\x8b" Name="Triple tilde">
+                  <Result Text="\xe1\xba\xbd" With="e" />
+                </DeadKeyTable>
+              </Result>
+            </DeadKeyTable>
+          </Result>
+        </DeadKeyTable>
+      </Result>
+    </PK>
+    <PK VK="VK_A" SC="1E">
+      <Result Text="a" />
+    </PK>
+    <PK VK="VK_E" SC="12">
+      <Result Text="e" />
+    </PK>
+  </PhysicalKeys>
+</KeyboardLayout>
+'''
+
+
+def round_trip(layout, text):
+    encoded = TextEncoder(reverse_layout(layout, [])).encode(text)
+    assert encoded.unencodable == ''
+    assert ScancodeDecoder(layout).feed(encoded.events) == text
+    return encoded
+
+
+def test_chained_deadkeys():
+    layout = parse_xml_layout(io.BytesIO(chained_deadkeys_xml), null_fn)
+    encoded = round_trip(layout, 'aẽã')
+    assert encoded.strokes == 7
+
+
+@pytest.mark.parametrize('klid', ['00000409', '0000040c', '0002040c', '00020407', '0001045c'])
+def test_round_trip(layouts_by_klid, klid):
+    layout = layouts_by_klid[klid]
+    rlayout = reverse_layout(layout, [])
+    encoder = TextEncoder(rlayout)
+    # every character of the layout (with dead keys)
+    assert set(rlayout.deadkeys) <= set(encoder.strokes)
+    round_trip(layout, ''.join(sorted(set(encoder.strokes) - {'\r', '\n', '\r\n'})))
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+# Text to scancode events planned on whole strings.
+#
+# ReversedKeymap (lib/scancodes.js) converts each character on its own and
+# presses/releases Shift, AltGr or toggles CapsLock around each of them.
+# TextEncoder keeps the modifiers between the characters and chooses the
+# modifier plane of each character with the fewest events over the whole text
+# (Viterbi on the modifier state).
+#
+# An event is `scancode | flag` with flag = 0 (key down) or KeyRelease, as in
+# scancodes.js ; 0x100 is the extended bit of scancode.
+import sys
+from collections.abc import Iterable
+from typing import NamedTuple
+
+from kbd_parser import Key, parse_argv
+from gen_reversed_keylayout import (ComposeTrie, ReversedLayout, ScancodesByMods, altgr, capslock,
+                                    key_to_scancode, keymap_text, reverse_layout, vk_control_masks,
+                                    vk_mod_to_mod_flags)
+
+
+KeyRelease = 0x8000
+
+LShiftSC = 0x2A
+LCtrlSC = 0x1D
+RCtrlSC = 0x11D
+AltSC = 0x38
+AltGrSC = 0x138
+CapsLockSC = 0x3A
+
+shift = vk_control_masks['VK_SHIFT']
+oem8 = vk_control_masks['VK_OEM_8']
+
+# modifiers held down, CapsLock is a lock
+held_mods = shift | altgr | oem8
+supported_mods = held_mods | capslock
+
+
+class Stroke(NamedTuple):
+    # one key of the text: [(mod_flags, scancode)], one option by plane
+    options: tuple[tuple[int, int], ...]
+
+
+class Encoded(NamedTuple):
+    events: list[int]
+    strokes: int
+    unencodable: str  # characters without key
+
+
+def _options(scancodes_by_mods: ScancodesByMods, allowed_mods: int) -> tuple[tuple[int, int], ...]:
+    return tuple((mod_flags, scancodes[0])
+                 for mod_flags, scancodes in scancodes_by_mods.items()
+                 if not mod_flags & ~allowed_mods)
+
+
+class TextEncoder:
+    # caps_lock_min_run: with the same number of events, a CapsLock toggle is
+    # preferred to a held Shift for runs of at least this number of keys
+
+    def __init__(self, rlayout: ReversedLayout, caps_lock_min_run: int = 8) -> None:
+        layout = rlayout.layout
+        self.alt_right_is_altgr = layout.alt_right_is_altgr
+        self.caps_lock_min_run = caps_lock_min_run
+        allowed_mods = supported_mods if layout.has_right_ctrl_like_oem8 else supported_mods & ~oem8
+
+        # same keys as the javascript keymap (the last (text, codepoint) wins)
+        keymap = {keymap_text(text, codepoint): scancodes_by_mods
+                  for (text, codepoint), scancodes_by_mods in rlayout.keymap.items()}
+        self.keymap = keymap
+
+        # the reversed keymap merges the control planes with the planes
+        # without control and adds a CapsLock plane to the characters without
+        # one: options are checked with the keys of the layout
+        planes = {}
+        for mods, plane in layout.keymaps.items():
+            mod_flags = vk_mod_to_mod_flags(mods)
+            if ('VK_CONTROL' not in mods or 'VK_MENU' in mods) and not mod_flags & ~allowed_mods:
+                planes[mod_flags] = plane
+        for mod_flags in list(planes):
+            planes.setdefault(mod_flags | capslock, None)
+
+        def typed_key(mod_flags: int, scancode: int) -> Key | None:
+            plane = planes.get(mod_flags)
+            sc = (scancode & 0x7f) | (0x80 if scancode & 0x100 else 0)
+            if plane is not None and plane.has_key(sc):
+                return plane[sc]
+            # a key without CapsLock plane ignores CapsLock
+            if mod_flags & capslock:
+                return typed_key(mod_flags & ~capslock, scancode)
+            return None
+
+        self.strokes: dict[str, tuple[Stroke, ...]] = {}
+        for c, scancodes_by_mods in keymap.items():
+            options = tuple(option for option in _options(scancodes_by_mods, allowed_mods)
+                            if (key := typed_key(*option)) and not key.deadkeys
+                            and keymap_text(key.text, key.codepoint) == c)
+            if options:
+                self.strokes[c] = (Stroke(options),)
+
+        # characters typed with dead keys: shortest compose sequences of the
+        # keys of the layout (dead keys chained at any depth)
+        dead_keys = []
+        rkeymap: dict[tuple[str, int], ScancodesByMods] = {}
+        for mod_flags in planes:
+            for sc in range(256):
+                key = typed_key(mod_flags, (sc & 0x7f) | (sc & 0x80) << 1)
+                if key is None or not key.text:
+                    continue
+                if key.deadkeys:
+                    dead_keys.append((mod_flags, key))
+                else:
+                    scancodes = rkeymap.setdefault((key.text, key.codepoint), {}).setdefault(mod_flags, [])
+                    scancodes.append(key_to_scancode(key))
+        for text, keys in ComposeTrie(dead_keys, rkeymap).shortest_sequences().items():
+            self.strokes.setdefault(text, tuple(map(Stroke, keys)))
+
+        # line breaks are typed with Enter ('\n' is Ctrl+Enter)
+        if '\r' in self.strokes:
+            self.strokes['\n'] = self.strokes['\r']
+            self.strokes['\r\n'] = self.strokes['\r']
+
+        self.max_text_len = max(map(len, self.strokes), default=1)
+        self._transitions: dict[tuple[int, int], tuple[int, ...]] = {}
+
+    def _mod_events(self, mod: int, flag: int) -> tuple[int, ...]:
+        if mod == shift:
+            return (LShiftSC | flag,)
+        if mod == oem8:
+            return (RCtrlSC | flag,)
+        if self.alt_right_is_altgr:
+            return (AltGrSC | flag,)
+        # ctrl+alt
+        return (LCtrlSC | flag, AltSC | flag) if flag == 0 else (AltSC | flag, LCtrlSC | flag)
+
+    def transition(self, state: int, mods: int) -> tuple[int, ...]:
+        # events to go from the modifier state to mods
+        k = (state, mods)
+        events = self._transitions.get(k)
+        if events is not None:
+            return events
+
+        release = state & held_mods & ~mods
+        press = mods & held_mods & ~state
+        # Shift pressed while AltGr is down looks like a shortcut (Ctrl+Shift,
+        # Alt+Shift) which changes the layout on the server
+        if press & shift and state & mods & altgr:
+            release |= altgr
+            press |= altgr
+
+        accu = []
+        for mod in (altgr, oem8, shift):
+            if release & mod:
+                accu += self._mod_events(mod, KeyRelease)
+        if (state ^ mods) & capslock:
+            accu += (CapsLockSC, CapsLockSC | KeyRelease)
+        for mod in (shift, oem8, altgr):
+            if press & mod:
+                accu += self._mod_events(mod, 0)
+
+        events = tuple(accu)
+        self._transitions[k] = events
+        return events
+
+    def text_strokes(self, text: str) -> tuple[list[Stroke], str]:
+        # some keys type several characters: longest match first
+        strokes = []
+        unencodable = []
+        max_len = self.max_text_len
+        i = 0
+        while i < len(text):
+            for n in range(min(max_len, len(text) - i), 0, -1):
+                key_strokes = self.strokes.get(text[i:i + n])
+                if key_strokes is not None:
+                    strokes += key_strokes
+                    i += n
+                    break
+            else:
+                unencodable.append(text[i])
+                i += 1
+        return strokes, ''.join(unencodable)
+
+    def encode(self, text: str, capslock_on: bool = False) -> Encoded:
+        # events of text from a state without held modifier,
+        # modifiers are released and CapsLock restored at the end
+        strokes, unencodable = self.text_strokes(text)
+        initial = capslock if capslock_on else 0
+
+        # Viterbi: {state: (events, secondary cost)} with back pointers
+        # secondary cost: number of keys typed with a held modifier and
+        # caps_lock_min_run / 2 by CapsLock toggle
+        caps_cost = self.caps_lock_min_run / 2
+        costs = {initial: (0, 0.)}
+        back: list[dict[int, tuple[int, int]]] = []
+        transition = self.transition
+
+        for stroke in strokes:
+            new_costs = {}
+            pointers = {}
+            for mods, scancode in stroke.options:
+                if mods in new_costs:
+                    continue
+                held = 1 if mods & held_mods else 0
+                best = None
+                for state, (events, secondary) in costs.items():
+                    n = len(transition(state, mods))
+                    cost = (events + n + 2, secondary + held + (caps_cost if (state ^ mods) & capslock else 0))
+                    if best is None or cost < best:
+                        best = cost
+                        best_state = state
+                new_costs[mods] = best
+                pointers[mods] = (best_state, scancode)
+            costs = new_costs
+            back.append(pointers)
+
+        final_cost = None
+        final_state = initial
+        for state, (events, secondary) in costs.items():
+            cost = (events + len(transition(state, initial)), secondary)
+            if final_cost is None or cost < final_cost:
+                final_cost = cost
+                final_state = state
+
+        # back tracking
+        path = []
+        state = final_state
+        for pointers in reversed(back):
+            prev_state, scancode = pointers[state]
+            path.append((state, scancode))
+            state = prev_state
+        path.reverse()
+
+        events = []
+        state = initial
+        for mods, scancode in path:
+            events += transition(state, mods)
+            events += (scancode, scancode | KeyRelease)
+            state = mods
+        events += transition(state, initial)
+
+        return Encoded(events, len(strokes), unencodable)
+
+    def naive_encode(self, text: str) -> Encoded:
+        # events of ReversedKeymap.keyDown() + keyUp() for each key
+        # without held modifier (see _scancodeByModsToScancodes())
+        strokes, unencodable = self.text_strokes(text)
+        events = []
+        for stroke in strokes:
+            # numeric keys of a js object are sorted
+            mods, scancode = min(stroke.options)
+            events += self._naive_key_down(mods, scancode)
+            events.append(scancode | KeyRelease)
+        return Encoded(events, len(strokes), unencodable)
+
+    def _naive_key_down(self, mods: int, scancode: int) -> list[int]:
+        if mods == 0:
+            return [scancode]
+        accu = []
+        if mods & shift:
+            accu.append(LShiftSC)
+        if mods & oem8:
+            accu.append(RCtrlSC)
+        if mods & altgr:
+            accu.append(AltGrSC)
+        n = len(accu)
+        if mods & capslock:
+            accu += (CapsLockSC, CapsLockSC | KeyRelease)
+        accu.append(scancode)
+        accu += (accu[i] | KeyRelease for i in reversed(range(n)))
+        if mods & capslock:
+            accu += (CapsLockSC, CapsLockSC | KeyRelease)
+        return accu
+
+
+def encoder_report(encoder: TextEncoder, text: str) -> dict:
+    encoded = encoder.encode(text)
+    naive = encoder.naive_encode(text)
+    chars = len(text) - len(encoded.unencodable)
+    return {
+        'chars': chars,
+        'keys': encoded.strokes,
+        'events': len(encoded.events),
+        'naive_events': len(naive.events),
+        'events_per_char': len(encoded.events) / chars if chars else 0,
+        'naive_events_per_char': len(naive.events) / chars if chars else 0,
+        'unencodable': encoded.unencodable,
+    }
+
+
+def format_events(events: Iterable[int]) -> str:
+    return ' '.join(f'{"-" if e & KeyRelease else "+"}{e & ~KeyRelease:x}' for e in events)
+
+
+def main(argv: list[str]) -> int:
+    # text_encoder.py KLID {text | @file} [parser options] layouts...
+    if len(argv) < 4:
+        print(argv[0], 'KLID {text | @file} [-v] [-j N] [--cache DIR] {layout.xml | layouts.tar.zst}...', file=sys.stderr)
+        return 1
+
+    klid = argv[1].lower().rjust(8, '0')
+    text = argv[2]
+    if text.startswith('@'):
+        with open(text[1:], encoding='utf-8') as f:
+            text = f.read()
+
+    error_messages = []
+    layouts = parse_argv(argv[:1] + ['--klid', klid] + argv[3:], errors=error_messages)
+    if not layouts:
+        print(f'unknown KLID: {klid}', file=sys.stderr)
+        return 1
+
+    encoder = TextEncoder(reverse_layout(layouts[0], error_messages))
+    report = encoder_report(encoder, text)
+
+    if len(text) <= 80:
+        print('events:', format_events(encoder.encode(text).events))
+        print('naive: ', format_events(encoder.naive_encode(text).events))
+    print(f"{layouts[0].display_name}: {report['chars']} characters, {report['keys']} keys")
+    print(f"events: {report['events']} ({report['events_per_char']:.2f} by character)")
+    print(f"naive:  {report['naive_events']} ({report['naive_events_per_char']:.2f} by character)")
+    if report['unencodable']:
+        print(f"unencodable: {''.join(sorted(set(report['unencodable'])))!r}")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))